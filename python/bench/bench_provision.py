@@ -0,0 +1,204 @@
+"""
+Provision and then remove simulated devices through TahoeDeviceController
+against a local fake zabbix frontend, and report the API calls and wall
+time per device of both phases.
+
+Usage:
+  python bench/bench_provision.py [options]
+"""
+import json
+import logging
+import os
+import sys
+import time
+
+from optparse import OptionParser
+from Queue import Queue
+from threading import Lock, Thread
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import zabbix.config as zabbix_config
+
+from fake_zabbix import FakeZabbix
+
+def device_logical_address(index):
+    return "BENCH-%08d" % index
+
+def device_username(index, users):
+    return "bench-dealer-%04d" % (index % users)
+
+class Phase(object):
+    """
+    Run 'operation' on the device indexes, 'batch' at a time, with
+    'concurrency' threads. 'operation' returns a (status, message) result
+    per index.
+    """
+    def __init__(self, name, operation, devices, batch, concurrency):
+        self.name = name
+        self.operation = operation
+        self.devices = devices
+        self.batch = batch
+        self.concurrency = concurrency
+        self.lock = Lock()
+        self.failures = []
+
+    def worker(self, queue):
+        while True:
+            indexes = queue.get()
+            if indexes is None:
+                return
+            results = self.operation(indexes)
+            for index, (status, message) in zip(indexes, results):
+                if not status:
+                    self.lock.acquire()
+                    self.failures.append((index, message))
+                    self.lock.release()
+
+    def run(self):
+        """
+        Output:
+        * elapsed: wall seconds of the phase
+        """
+        queue = Queue()
+        for start in xrange(0, self.devices, self.batch):
+            queue.put(range(start, min(start + self.batch, self.devices)))
+        workers = []
+        for i in range(self.concurrency):
+            queue.put(None)
+            worker = Thread(target=self.worker, args=(queue,))
+            worker.setDaemon(True)
+            workers.append(worker)
+        start = time.time()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return time.time() - start
+
+def cache_delta(before, after):
+    """
+    Output:
+    * delta: object type -> {'hits', 'misses'} of the cache between the
+      'before' and 'after' stats
+    """
+    delta = {}
+    for kind, stats in after.items():
+        old = before.get(kind, {})
+        delta[kind] = {"hits": stats["hits"] - old.get("hits", 0),
+                       "misses": stats["misses"] - old.get("misses", 0)}
+    return delta
+
+def report(name, devices, elapsed, calls, failures, cache, shared):
+    total = sum(calls.values())
+    print "%s: %d devices in %.2f s, %.2f ms/device, %d api calls, %.2f calls/device, " \
+          "%d failed" % (name, devices, elapsed, elapsed * 1000 / devices, total,
+                         float(total) / devices, len(failures))
+    for method, count in sorted(calls.items()):
+        print "  %-18s %8d %8.2f/device" % (method, count, float(count) / devices)
+    print "  shared reads       %8d %8.2f/device" % (shared, float(shared) / devices)
+    for kind, stats in sorted(cache.items()):
+        print "  cache %-12s %8d hits %8d misses" % (kind, stats["hits"], stats["misses"])
+    for index, message in failures[:5]:
+        print "  device %d: %s" % (index, message)
+    return {"devices": devices,
+            "seconds": elapsed,
+            "seconds_per_device": elapsed / devices,
+            "calls": calls,
+            "calls_per_device": float(total) / devices,
+            "failures": len(failures),
+            "cache": cache,
+            "shared_reads": shared}
+
+def parse_command_line():
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option("-n", "--devices", type="int", dest="devices", default=2000,
+                      help="number of provisioned devices")
+    parser.add_option("-u", "--users", type="int", dest="users", default=20,
+                      help="number of dealers the devices belong to")
+    parser.add_option("-l", "--latency", type="float", dest="latency", default=1,
+                      help="milliseconds every api call is delayed")
+    parser.add_option("-j", "--jitter", type="float", dest="jitter", default=0,
+                      help="up to this many more milliseconds of random delay")
+    parser.add_option("-b", "--bulk", type="int", dest="bulk", default=0,
+                      help="devices per bulk call, 0 calls the single device methods")
+    parser.add_option("-c", "--concurrency", type="int", dest="concurrency", default=1,
+                      help="number of provisioning threads")
+    parser.add_option("--no-cache", action="store_true", dest="no_cache", default=False,
+                      help="don't cache the looked up zabbix objects")
+    parser.add_option("-o", "--output", dest="output",
+                      help="also write the results as JSON to this file")
+    (options, args) = parser.parse_args()
+    if options.devices < 1 or options.users < 1 or options.concurrency < 1:
+        parser.error("devices, users and concurrency must be positive")
+    if options.bulk < 0:
+        parser.error("bulk can't be negative")
+    return options
+
+def main():
+    options = parse_command_line()
+    frontend = FakeZabbix(latency=options.latency / 1000.0, jitter=options.jitter / 1000.0)
+    frontend.start()
+    zabbix_config.ZABBIX_URL = frontend.url
+
+    from zabbix.common.utils import get_logger, set_log_level
+    get_logger()
+    set_log_level(logging.WARNING)
+    from zabbix.cache import MetadataCache
+    from zabbix.controller import ZabbixController
+
+    cache = MetadataCache(0, {}) if options.no_cache else None
+    zabbix_controller = ZabbixController(zabbix_config.ZABBIX_USER, zabbix_config.ZABBIX_PASSWORD,
+                                         cache)
+    device_controller = zabbix_controller.get_device_controller()
+    frontend.store.reset_calls()
+
+    def device(index):
+        username = device_username(index, options.users)
+        return (device_logical_address(index), username,
+                ["1%010d" % (index % options.users)], ["%s@example.com" % username])
+
+    def setup(indexes):
+        if options.bulk:
+            return device_controller.devices_first_setup([device(index) for index in indexes])
+        return [device_controller.device_first_setup(*device(indexes[0]))]
+
+    def remove(indexes):
+        if options.bulk:
+            return device_controller.remove_device_hosts([device_logical_address(index) \
+                                                          for index in indexes])
+        return [device_controller.remove_device_host(device_logical_address(indexes[0]))]
+
+    print "%d devices of %d users, %g ms latency, %d thread(s), %s%s" % \
+          (options.devices, options.users, options.latency, options.concurrency,
+           "%d devices per bulk call" % options.bulk if options.bulk else "single device calls",
+           ", no cache" if options.no_cache else "")
+    results = {"devices": options.devices,
+               "users": options.users,
+               "latency": options.latency,
+               "concurrency": options.concurrency,
+               "bulk": options.bulk,
+               "cache": not options.no_cache}
+    for name, operation in (("setup", setup), ("remove", remove)):
+        phase = Phase(name, operation, options.devices, max(options.bulk, 1), options.concurrency)
+        cache_stats = zabbix_controller.cache_stats()
+        shared = zabbix_controller.read_stats()["shared"]
+        elapsed = phase.run()
+        results[name] = report(name, options.devices, elapsed, frontend.store.reset_calls(),
+                               phase.failures,
+                               cache_delta(cache_stats, zabbix_controller.cache_stats()),
+                               zabbix_controller.read_stats()["shared"] - shared)
+    store = frontend.store
+    results["left_hosts"] = len(store.hosts)
+    results["left_actions"] = len(store.actions)
+    if store.hosts or store.actions:
+        print "warning: %d hosts and %d actions left after the removal" % \
+              (len(store.hosts), len(store.actions))
+    frontend.stop()
+    if options.output:
+        fd = open(options.output, "w")
+        json.dump(results, fd, indent=4, sort_keys=True)
+        fd.close()
+
+if __name__ == "__main__":
+    main()
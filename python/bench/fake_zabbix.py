@@ -0,0 +1,521 @@
+"""
+An in-process stand-in for the zabbix frontend JSON-RPC API. It keeps the
+hosts, users and actions in memory and implements the methods the zabbix
+controller uses, each call can be delayed to model a remote frontend.
+
+Usage:
+  python bench/fake_zabbix.py [-p port] [-l latency]
+"""
+import json
+import os
+import random
+import socket
+import sys
+import threading
+import time
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from optparse import OptionParser
+from threading import Lock, Thread
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import zabbix.config as zabbix_config
+
+API_PATH = "/zabbix/api_jsonrpc.php"
+
+# JSON-RPC error codes as returned by the zabbix frontend
+ERROR_INVALID_REQUEST = -32600
+ERROR_METHOD_NOT_FOUND = -32601
+ERROR_INVALID_PARAMS = -32602
+
+# action condition types and operators the controller writes
+CONDITION_TYPE_HOST = "1"
+CONDITION_OPERATOR_EQUAL = "0"
+
+class FakeZabbixError(Exception):
+    def __init__(self, code, message, data):
+        Exception.__init__(self, "%s %s" % (message, data))
+        self.code = code
+        self.message = message
+        self.data = data
+
+def invalid_params(data):
+    return FakeZabbixError(ERROR_INVALID_PARAMS, "Invalid params.", data)
+
+def as_list(params):
+    if isinstance(params, list):
+        return params
+    return [params]
+
+def stringify(value):
+    """
+    The frontend returns every scalar as a string.
+    """
+    if isinstance(value, dict):
+        return dict((key, stringify(element)) for key, element in value.items())
+    if isinstance(value, list):
+        return [stringify(element) for element in value]
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, (int, long, float)):
+        return str(value)
+    return value
+
+class FakeZabbixStore(object):
+    """
+    The zabbix objects and the JSON-RPC methods working on them.
+    """
+    def __init__(self, user, password):
+        self.user = user
+        self.password = password
+        self.token = "%032x" % random.getrandbits(128)
+        self.lock = Lock()
+        self.next_id = 10000
+        self.templates = {zabbix_config.ZABBIX_TEMPLATE_NAME: self._new_id()}
+        self.hostgroups = {zabbix_config.ZABBIX_HOSTGROUP_NAME: self._new_id()}
+        self.usergroups = {zabbix_config.ZABBIX_USERGROUP_NAME: self._new_id()}
+        # host id -> host
+        self.hosts = {}
+        # host name -> host id
+        self.host_names = {}
+        # user id -> user
+        self.users = {}
+        # user alias -> user id
+        self.user_aliases = {}
+        # action id -> action
+        self.actions = {}
+        # method -> number of calls
+        self.calls = {}
+        self.methods = {"user.login": self.user_login,
+                        "template.get": self.template_get,
+                        "hostgroup.get": self.hostgroup_get,
+                        "usergroup.get": self.usergroup_get,
+                        "host.get": self.host_get,
+                        "host.create": self.host_create,
+                        "host.delete": self.host_delete,
+                        "user.get": self.user_get,
+                        "user.create": self.user_create,
+                        "user.update": self.user_update,
+                        "user.updatemedia": self.user_updatemedia,
+                        "user.delete": self.user_delete,
+                        "action.get": self.action_get,
+                        "action.create": self.action_create,
+                        "action.update": self.action_update,
+                        "action.delete": self.action_delete}
+
+    def _new_id(self):
+        self.next_id += 1
+        return str(self.next_id)
+
+    def call(self, request):
+        """
+        Input:
+        * request: a decoded JSON-RPC request
+        Output:
+        * response: the encoded JSON-RPC response, encoded under the lock
+          so the results can share the stored objects
+        """
+        method = request.get("method")
+        response = {"jsonrpc": zabbix_config.ZABBIX_JSONRPC_VERSION, "id": request.get("id")}
+        self.lock.acquire()
+        try:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            if method not in self.methods:
+                raise FakeZabbixError(ERROR_METHOD_NOT_FOUND, "Method not found.",
+                                      "Incorrect API \"%s\"." % method)
+            if method != "user.login" and request.get("auth") != self.token:
+                raise invalid_params("Not authorised.")
+            response["result"] = self.methods[method](request.get("params"))
+        except FakeZabbixError as e:
+            response["error"] = {"code": e.code, "message": e.message, "data": e.data}
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            response["error"] = {"code": ERROR_INVALID_PARAMS, "message": "Invalid params.",
+                                 "data": "Incorrect parameters: %s." % e}
+        try:
+            return json.dumps(response)
+        finally:
+            self.lock.release()
+
+    def reset_calls(self):
+        self.lock.acquire()
+        calls = self.calls
+        self.calls = {}
+        self.lock.release()
+        return calls
+
+    ##### login and group lookups
+    def user_login(self, params):
+        if params.get("user") != self.user or params.get("password") != self.password:
+            raise invalid_params("Login name or password is incorrect.")
+        return self.token
+
+    def _names(self, params, field):
+        return as_list(params.get("filter", {}).get(field, []))
+
+    def template_get(self, params):
+        return [{"templateid": self.templates[name]} \
+                for name in self._names(params, "host") if name in self.templates]
+
+    def hostgroup_get(self, params):
+        return [{"groupid": self.hostgroups[name], "name": name, "internal": "0", "flags": "0"} \
+                for name in self._names(params, "name") if name in self.hostgroups]
+
+    def usergroup_get(self, params):
+        return [{"usrgrpid": self.usergroups[name], "name": name, "gui_access": "0",
+                 "users_status": "0", "debug_mode": "0"} \
+                for name in self._names(params, "name") if name in self.usergroups]
+    ##### login and group lookups section end
+
+    ##### hosts
+    def host_get(self, params):
+        host_ids = set()
+        for name in self._names(params, "host"):
+            if name in self.host_names:
+                host_ids.add(self.host_names[name])
+        for host_id in as_list(params.get("hostids", [])):
+            if host_id in self.hosts:
+                host_ids.add(host_id)
+        return [self.hosts[host_id] for host_id in sorted(host_ids)]
+
+    def host_create(self, params):
+        hosts = as_list(params)
+        names = set()
+        for host in hosts:
+            name = host.get("host")
+            if not name:
+                raise invalid_params("Host name cannot be empty.")
+            if name in self.host_names or name in names:
+                raise invalid_params("Host with the same name \"%s\" already exists." % name)
+            if not host.get("groups"):
+                raise invalid_params("No groups for host \"%s\"." % name)
+            names.add(name)
+        host_ids = []
+        for host in hosts:
+            host_id = self._new_id()
+            self.hosts[host_id] = {"hostid": host_id,
+                                   "host": host["host"],
+                                   "name": host.get("name", host["host"]),
+                                   "status": "0",
+                                   "groups": stringify(host["groups"]),
+                                   "templates": stringify(host.get("templates", []))}
+            self.host_names[host["host"]] = host_id
+            host_ids.append(host_id)
+        return {"hostids": host_ids}
+
+    def host_delete(self, params):
+        host_ids = [str(host_id) for host_id in as_list(params)]
+        for host_id in host_ids:
+            if host_id not in self.hosts:
+                raise invalid_params("No permissions to referred object or it does not exist!")
+        for host_id in host_ids:
+            host = self.hosts.pop(host_id)
+            del self.host_names[host["host"]]
+        return {"hostids": host_ids}
+    ##### hosts section end
+
+    ##### users
+    def _user_view(self, user, params):
+        view = dict((key, value) for key, value in user.items() if key != "medias")
+        if params.get("selectMedias"):
+            view["medias"] = user["medias"]
+        return view
+
+    def _medias(self, user_id, medias):
+        result = []
+        for media in medias:
+            media = stringify(media)
+            media["mediaid"] = self._new_id()
+            media["userid"] = user_id
+            result.append(media)
+        return result
+
+    def user_get(self, params):
+        user_ids = set()
+        for alias in self._names(params, "alias"):
+            if alias in self.user_aliases:
+                user_ids.add(self.user_aliases[alias])
+        for user_id in as_list(params.get("userids", [])):
+            if user_id in self.users:
+                user_ids.add(user_id)
+        return [self._user_view(self.users[user_id], params) for user_id in sorted(user_ids)]
+
+    def user_create(self, params):
+        users = as_list(params)
+        for user in users:
+            alias = user.get("alias")
+            if not alias:
+                raise invalid_params("Incorrect value for field \"alias\": cannot be empty.")
+            if alias in self.user_aliases:
+                raise invalid_params("User with alias \"%s\" already exists." % alias)
+            if not user.get("usrgrps"):
+                raise invalid_params("User \"%s\" cannot be without user group." % alias)
+        user_ids = []
+        for user in users:
+            user_id = self._new_id()
+            self.users[user_id] = {"userid": user_id,
+                                   "alias": user["alias"],
+                                   "name": user.get("name", ""),
+                                   "surname": user.get("surname", ""),
+                                   "type": "1",
+                                   "usrgrps": stringify(user["usrgrps"]),
+                                   "medias": self._medias(user_id, user.get("user_medias", []))}
+            self.user_aliases[user["alias"]] = user_id
+            user_ids.append(user_id)
+        return {"userids": user_ids}
+
+    def _existing_users(self, user_ids):
+        user_ids = [str(user_id) for user_id in user_ids]
+        for user_id in user_ids:
+            if user_id not in self.users:
+                raise invalid_params("No permissions to referred object or it does not exist!")
+        return user_ids
+
+    def user_update(self, params):
+        users = as_list(params)
+        user_ids = self._existing_users(user.get("userid") for user in users)
+        for user_id, user in zip(user_ids, users):
+            for key in ("name", "surname"):
+                if key in user:
+                    self.users[user_id][key] = user[key]
+            if "user_medias" in user:
+                self.users[user_id]["medias"] = self._medias(user_id, user["user_medias"])
+        return {"userids": user_ids}
+
+    def user_updatemedia(self, params):
+        user_ids = self._existing_users(user.get("userid") for user in as_list(params.get("users", [])))
+        for user_id in user_ids:
+            self.users[user_id]["medias"] = self._medias(user_id, params.get("medias", []))
+        return {"userids": user_ids}
+
+    def user_delete(self, params):
+        user_ids = self._existing_users(as_list(params))
+        for user_id in user_ids:
+            user = self.users.pop(user_id)
+            del self.user_aliases[user["alias"]]
+        return {"userids": user_ids}
+    ##### users section end
+
+    ##### actions
+    def _action_user_ids(self, action):
+        user_ids = set()
+        for operation in action["operations"]:
+            for user in operation.get("opmessage_usr", []):
+                user_ids.add(user["userid"])
+        return user_ids
+
+    def _action_host_ids(self, action):
+        return set(condition["value"] for condition in action["filter"]["conditions"] \
+                   if condition["conditiontype"] == CONDITION_TYPE_HOST)
+
+    def _filter(self, action_filter):
+        conditions = []
+        for condition in stringify(action_filter.get("conditions", [])):
+            condition.setdefault("operator", CONDITION_OPERATOR_EQUAL)
+            condition.setdefault("value2", "")
+            conditions.append(condition)
+        return {"evaltype": str(action_filter.get("evaltype", "0")),
+                "formula": "",
+                "eval_formula": "",
+                "conditions": conditions}
+
+    def _operations(self, action_id, operations):
+        result = []
+        for operation in stringify(operations):
+            operation["operationid"] = self._new_id()
+            operation["actionid"] = action_id
+            result.append(operation)
+        return result
+
+    def action_get(self, params):
+        user_ids = set(str(user_id) for user_id in params.get("userids", []))
+        host_ids = set(str(host_id) for host_id in params.get("hostids", []))
+        eventsource = params.get("filter", {}).get("eventsource")
+        result = []
+        for action_id in sorted(self.actions):
+            action = self.actions[action_id]
+            if eventsource is not None and action["eventsource"] != str(eventsource):
+                continue
+            if user_ids and not (user_ids & self._action_user_ids(action)):
+                continue
+            if host_ids and not (host_ids & self._action_host_ids(action)):
+                continue
+            result.append(action)
+        return result
+
+    def action_create(self, params):
+        actions = as_list(params)
+        names = set(action["name"] for action in self.actions.values())
+        for action in actions:
+            name = action.get("name")
+            if not name:
+                raise invalid_params("Incorrect value for field \"name\": cannot be empty.")
+            if name in names:
+                raise invalid_params("Action \"%s\" already exists." % name)
+            if not action.get("operations"):
+                raise invalid_params("Action \"%s\" no operations defined." % name)
+            names.add(name)
+        action_ids = []
+        for action in actions:
+            action_id = self._new_id()
+            self.actions[action_id] = {"actionid": action_id,
+                                       "name": action["name"],
+                                       "eventsource": str(action.get("eventsource", 0)),
+                                       "status": str(action.get("status", 0)),
+                                       "esc_period": str(action.get("esc_period", 0)),
+                                       "def_shortdata": action.get("def_shortdata", ""),
+                                       "def_longdata": action.get("def_longdata", ""),
+                                       "filter": self._filter(action.get("filter", {})),
+                                       "operations": self._operations(action_id, action["operations"]),
+                                       "recoveryOperations": []}
+            action_ids.append(action_id)
+        return {"actionids": action_ids}
+
+    def action_update(self, params):
+        actions = as_list(params)
+        for action in actions:
+            if str(action.get("actionid")) not in self.actions:
+                raise invalid_params("No permissions to referred object or it does not exist!")
+        action_ids = []
+        for action in actions:
+            action_id = str(action["actionid"])
+            if "filter" in action:
+                self.actions[action_id]["filter"] = self._filter(action["filter"])
+            if "operations" in action:
+                self.actions[action_id]["operations"] = self._operations(action_id, action["operations"])
+            if "name" in action:
+                self.actions[action_id]["name"] = action["name"]
+            action_ids.append(action_id)
+        return {"actionids": action_ids}
+
+    def action_delete(self, params):
+        action_ids = [str(action_id) for action_id in as_list(params)]
+        for action_id in action_ids:
+            if action_id not in self.actions:
+                raise invalid_params("No permissions to referred object or it does not exist!")
+        for action_id in action_ids:
+            del self.actions[action_id]
+        return {"actionids": action_ids}
+    ##### actions section end
+
+class FakeZabbixHandler(BaseHTTPRequestHandler):
+    # keep the connections alive like the frontend web server does
+    protocol_version = "HTTP/1.1"
+    # answer in one segment, a kept alive connection otherwise stalls on
+    # the client's delayed ack
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        if self.path != API_PATH:
+            self.send_error(404)
+            return
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.server.latency:
+            time.sleep(self.server.latency + random.uniform(0, self.server.jitter))
+        try:
+            request = json.loads(body)
+        except ValueError:
+            data = json.dumps({"jsonrpc": zabbix_config.ZABBIX_JSONRPC_VERSION, "id": None,
+                               "error": {"code": ERROR_INVALID_REQUEST, "message": "Invalid Request.",
+                                         "data": "Invalid JSON."}})
+        else:
+            data = self.server.store.call(request)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json-rpc")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.add_connection(self.connection)
+
+    def finish(self):
+        self.server.remove_connection(self.connection)
+        BaseHTTPRequestHandler.finish(self)
+
+    def log_message(self, format, *args):
+        pass
+
+class FakeZabbixHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, handler_class):
+        HTTPServer.__init__(self, address, handler_class)
+        self.connections_lock = Lock()
+        # connection -> its handler thread
+        self.connections = {}
+
+    def add_connection(self, connection):
+        self.connections_lock.acquire()
+        self.connections[connection] = threading.current_thread()
+        self.connections_lock.release()
+
+    def remove_connection(self, connection):
+        self.connections_lock.acquire()
+        self.connections.pop(connection, None)
+        self.connections_lock.release()
+
+    def close_connections(self):
+        """
+        Close the connections kept alive and wait for their handler threads.
+        """
+        self.connections_lock.acquire()
+        connections = self.connections.items()
+        self.connections_lock.release()
+        for connection, handler in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            handler.join(1)
+
+class FakeZabbix(Thread):
+    """
+    The fake frontend serving on 'host':'port' (0 picks a free port), every
+    call is answered after 'latency' plus up to 'jitter' seconds.
+    """
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0,
+                 user=zabbix_config.ZABBIX_USER, password=zabbix_config.ZABBIX_PASSWORD):
+        Thread.__init__(self, name="FakeZabbix")
+        self.setDaemon(True)
+        self.server = FakeZabbixHTTPServer((host, port), FakeZabbixHandler)
+        self.server.latency = latency
+        self.server.jitter = jitter
+        self.server.store = FakeZabbixStore(user, password)
+        self.store = self.server.store
+        self.port = self.server.server_address[1]
+        self.url = "http://%s:%d%s" % (host, self.port, API_PATH)
+
+    def run(self):
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.server.close_connections()
+
+def main():
+    parser = OptionParser(usage="usage: %prog [-p port] [-l latency]")
+    parser.add_option("-p", "--port", type="int", dest="port", default=8000,
+                      help="the port to listen on")
+    parser.add_option("-l", "--latency", type="float", dest="latency", default=0,
+                      help="milliseconds every call is delayed")
+    parser.add_option("-j", "--jitter", type="float", dest="jitter", default=0,
+                      help="up to this many more milliseconds of random delay")
+    (options, args) = parser.parse_args()
+    frontend = FakeZabbix("0.0.0.0", options.port, options.latency / 1000.0, options.jitter / 1000.0)
+    frontend.start()
+    print "Fake zabbix listening on %d%s" % (frontend.port, API_PATH)
+    try:
+        while True:
+            time.sleep(10)
+            print "calls: %s" % frontend.store.calls
+    except KeyboardInterrupt:
+        frontend.stop()
+
+if __name__ == "__main__":
+    main()
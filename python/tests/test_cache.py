@@ -0,0 +1,57 @@
+import logging
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import zabbix.config as zabbix_config
+zabbix_config.LOG_FILE = os.devnull
+
+from zabbix.common.utils import get_logger, set_log_level
+get_logger()
+set_log_level(logging.CRITICAL)
+
+from zabbix.cache import MetadataCache, CACHE_HOST, CACHE_USER
+
+class MetadataCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = MetadataCache(10, {CACHE_HOST: 60, CACHE_USER: 0})
+
+    def test_copies(self):
+        host = {"hostid": "1", "groups": []}
+        self.cache.add(CACHE_HOST, "device", host)
+        host["groups"].append("changed")
+        found, value = self.cache.find(CACHE_HOST, "device")
+        self.assertTrue(found)
+        self.assertEqual(value, {"hostid": "1", "groups": []})
+        value["hostid"] = "2"
+        self.assertEqual(self.cache.find(CACHE_HOST, "device")[1]["hostid"], "1")
+
+    def test_not_cached_kind(self):
+        self.cache.add(CACHE_USER, "admin", {"userid": "1"})
+        self.assertEqual(self.cache.find(CACHE_USER, "admin"), (False, None))
+        self.assertFalse(CACHE_USER in self.cache.stats())
+
+    def test_none_is_cached(self):
+        self.cache.add(CACHE_HOST, "missing", None)
+        self.assertEqual(self.cache.find(CACHE_HOST, "missing"), (True, None))
+
+    def test_generation(self):
+        generation = self.cache.generation(CACHE_HOST)
+        # a host deleted while 'device' was being loaded
+        self.cache.delete(CACHE_HOST, "other")
+        self.cache.add(CACHE_HOST, "device", {"hostid": "1"}, generation)
+        self.assertEqual(self.cache.peek(CACHE_HOST, "device"), (False, None))
+        self.cache.add(CACHE_HOST, "device", {"hostid": "1"}, self.cache.generation(CACHE_HOST))
+        self.assertEqual(self.cache.peek(CACHE_HOST, "device"), (True, {"hostid": "1"}))
+
+    def test_clear(self):
+        self.cache.add(CACHE_HOST, "device", {"hostid": "1"})
+        generation = self.cache.generation(CACHE_HOST)
+        self.cache.clear()
+        self.assertEqual(self.cache.peek(CACHE_HOST, "device"), (False, None))
+        self.assertEqual(self.cache.generation(CACHE_HOST), generation + 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import logging
+import os
+import sys
+import unittest
+
+from threading import Event, Thread
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import zabbix.config as zabbix_config
+zabbix_config.LOG_FILE = os.devnull
+
+from zabbix.common.utils import get_logger, set_log_level, SingleFlight
+get_logger()
+set_log_level(logging.CRITICAL)
+
+class SingleFlightTest(unittest.TestCase):
+    def setUp(self):
+        self.reads = SingleFlight()
+        self.started = Event()
+        self.release = Event()
+        self.calls = 0
+
+    def slow_read(self):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(5)
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+    def run_concurrently(self, count):
+        results = []
+        def read():
+            try:
+                results.append(self.reads.do("key", self.slow_read))
+            except Exception as e:
+                results.append(e)
+        first = Thread(target=read)
+        first.start()
+        self.started.wait(5)
+        others = [Thread(target=read) for i in range(count - 1)]
+        for thread in others:
+            thread.start()
+        # the others are waiting for the first call once they are counted
+        while self.reads.stats()["calls"] < count:
+            self.release.wait(0.01)
+        self.release.set()
+        for thread in [first] + others:
+            thread.join()
+        return results
+
+    def test_shared(self):
+        self.result = ["hosts"]
+        results = self.run_concurrently(3)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, [(["hosts"], True)] * 3)
+        self.assertEqual(self.reads.stats(), {"calls": 3, "shared": 2})
+        # nothing in flight, the next call runs again
+        self.assertEqual(self.reads.do("key", lambda: "again"), ("again", False))
+
+    def test_shared_error(self):
+        self.result = ValueError("refused")
+        results = self.run_concurrently(2)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual([type(result) for result in results], [ValueError, ValueError])
+
+    def test_forget(self):
+        self.result = "old"
+        thread = Thread(target=self.reads.do, args=("key", self.slow_read))
+        thread.start()
+        self.started.wait(5)
+        self.reads.forget(lambda key: key == "key")
+        self.assertEqual(self.reads.do("key", lambda: "new"), ("new", False))
+        self.release.set()
+        thread.join()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+import copy
+from threading import Lock
+
+import zabbix.config as zabbix_config
+from zabbix.common.utils import get_logger, LRUCache
+
+logger = get_logger()
+
+# the types of the cached zabbix objects
+CACHE_TEMPLATE = "template"
+CACHE_HOSTGROUP = "hostgroup"
+CACHE_USERGROUP = "usergroup"
+# host name -> host info, None if the host doesn't exist
+CACHE_HOST = "host"
+# user login name -> user info, None if the user doesn't exist
+CACHE_USER = "user"
+# user id -> the actions notifying the user
+CACHE_ACTIONS = "actions"
+
+
+class MetadataCache:
+    """
+    TTL cache of the zabbix objects read by the controller, one bounded
+    LRU cache of 'capacity' elements per object type. 'ttls' maps an
+    object type to its ttl in seconds, the types without a positive ttl
+    aren't cached.
+
+    The values are copied in and out, callers may change what they get.
+    Any object with the same methods can be given to the controller
+    instead, e.g. one shared by several processes.
+    """
+    def __init__(self, capacity, ttls):
+        self.caches = {}
+        for kind, ttl in ttls.items():
+            if ttl > 0:
+                self.caches[kind] = LRUCache(capacity, ttl)
+        self.lock = Lock()
+        # object type -> number of invalidations
+        self.generations = {}
+
+    def find(self, kind, key):
+        """
+        Output:
+          * (found, value): see LRUCache.find()
+        """
+        cache = self.caches.get(kind)
+        if cache is None:
+            return (False, None)
+        found, value = cache.find(key)
+        if found:
+            value = copy.deepcopy(value)
+        return (found, value)
+
+    def peek(self, kind, key):
+        """
+        Like find(), without counting a hit or miss.
+        """
+        cache = self.caches.get(kind)
+        if cache is None:
+            return (False, None)
+        return cache.peek(key)
+
+    def generation(self, kind):
+        """
+        Get the invalidation generation of an object type, taken before
+        loading an object and given back to add() it.
+        """
+        return self.generations.get(kind, 0)
+
+    def add(self, kind, key, value, generation=None):
+        """
+        Add an object loaded since 'generation', it is dropped if objects
+        of its type have been invalidated meanwhile: it may be older than
+        the change that invalidated them.
+        """
+        cache = self.caches.get(kind)
+        if cache is None:
+            return
+        value = copy.deepcopy(value)
+        self.lock.acquire()
+        try:
+            if generation is None or generation == self.generations.get(kind, 0):
+                cache.add(key, value)
+        finally:
+            self.lock.release()
+
+    def delete(self, kind, key):
+        cache = self.caches.get(kind)
+        if cache is None:
+            return
+        self.lock.acquire()
+        self.generations[kind] = self.generations.get(kind, 0) + 1
+        cache.delete(key)
+        self.lock.release()
+
+    def clear(self, kind=None):
+        """
+        Drop the objects of a type, or of all types if kind is None.
+        """
+        self.lock.acquire()
+        for cache_kind, cache in self.caches.items():
+            if kind is None or kind == cache_kind:
+                self.generations[cache_kind] = self.generations.get(cache_kind, 0) + 1
+                cache.clear()
+        self.lock.release()
+
+    def stats(self):
+        """
+        Output:
+          * stats: dict, object type -> the stats of its cache, see
+            LRUCache.stats()
+        """
+        return dict((kind, cache.stats()) for kind, cache in self.caches.items())
+
+
+def new_metadata_cache():
+    """
+    Create the cache of the zabbix objects configured by ZABBIX_CACHE_SIZE
+    and ZABBIX_CACHE_TTLS.
+    """
+    return MetadataCache(zabbix_config.ZABBIX_CACHE_SIZE, zabbix_config.ZABBIX_CACHE_TTLS)
@@ -7,7 +7,8 @@ import sys
 import time
 import pickle
 
-from threading import Lock
+from collections import OrderedDict
+from threading import Event, Lock
 
 
 #log_level = logging.INFO
@@ -181,6 +182,171 @@ class LockedList:
         self.lock.release()
         return ret
 
+# the same as LRUCache in zabbixserver-v1.0/utils.py, the two packages
+# are deployed separately: change both copies together
+class LRUCache:
+    """
+    Bounded map evicting the least recently used element, whose elements
+    expire 'ttl' seconds after they were added.
+    """
+    def __init__(self, capacity, ttl):
+        self.lock = Lock()
+        self.capacity = capacity
+        self.ttl = ttl
+        # key -> (value, expire time), least recently used first
+        self.data_map = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def add(self, key, value, ttl=None):
+        """
+        Add or replace the element related with 'key', it expires after
+        'ttl' seconds, the cache ttl by default.
+        """
+        if ttl is None:
+            ttl = self.ttl
+        self.lock.acquire()
+        self.data_map.pop(key, None)
+        self.data_map[key] = (value, time.time() + ttl)
+        while len(self.data_map) > self.capacity:
+            self.data_map.popitem(last=False)
+            self.evictions += 1
+        self.lock.release()
+
+    def find(self, key):
+        """
+        Find out the element related with the 'key'
+
+        Output:
+        * (found, value): found is False if there is no such element or it
+          has expired, a cached None is a hit with value None
+        """
+        ret = (False, None)
+        self.lock.acquire()
+        element = self.data_map.pop(key, None)
+        if element is None:
+            self.misses += 1
+        elif element[1] < time.time():
+            self.misses += 1
+            self.expirations += 1
+        else:
+            self.data_map[key] = element
+            self.hits += 1
+            ret = (True, element[0])
+        self.lock.release()
+        return ret
+
+    def peek(self, key):
+        """
+        Like find(), without counting a hit or miss nor refreshing the
+        element.
+        """
+        ret = (False, None)
+        self.lock.acquire()
+        element = self.data_map.get(key)
+        if element is not None and element[1] >= time.time():
+            ret = (True, element[0])
+        self.lock.release()
+        return ret
+
+    def delete(self, key):
+        """
+        Delete the element related with 'key'.
+        """
+        self.lock.acquire()
+        self.data_map.pop(key, None)
+        self.lock.release()
+
+    def clear(self):
+        self.lock.acquire()
+        self.data_map.clear()
+        self.lock.release()
+
+    def stats(self):
+        return {"size": len(self.data_map),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations}
+
+class Flight:
+    """
+    A call run by SingleFlight, waited for by the callers sharing it.
+    """
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+class SingleFlight:
+    """
+    Collapse concurrent calls with the same key into one: the callers
+    arriving while a call runs wait for it and share its result or its
+    exception, instead of running it again.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        # key -> the running Flight
+        self.flights = {}
+        self.calls = 0
+        self.shared = 0
+
+    def do(self, key, function):
+        """
+        Run function() unless a call with the same key is running.
+
+        Output:
+        * (result, shared): the result of function(), shared is True if
+          other callers got it too, it is then the same object for all of
+          them
+        """
+        self.lock.acquire()
+        self.calls += 1
+        flight = self.flights.get(key)
+        if flight is not None:
+            self.shared += 1
+            flight.waiters += 1
+            self.lock.release()
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return (flight.result, True)
+        flight = Flight()
+        self.flights[key] = flight
+        self.lock.release()
+        try:
+            flight.result = function()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            self.lock.acquire()
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+            shared = flight.waiters > 0
+            self.lock.release()
+            flight.done.set()
+        return (flight.result, shared)
+
+    def forget(self, match=None):
+        """
+        Make the calls from now on run again rather than share the running
+        ones, e.g. after a change the running ones may not see. Only the
+        keys for which match(key) is True if match isn't None.
+        """
+        self.lock.acquire()
+        for key in self.flights.keys():
+            if match is None or match(key):
+                del self.flights[key]
+        self.lock.release()
+
+    def stats(self):
+        return {"calls": self.calls,
+                "shared": self.shared}
+
 # make a the process a daemon. If any error happen, it will raise an exception.
 def daemonize(root_dir="/", \
               pidfile="", \
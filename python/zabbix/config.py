@@ -31,3 +31,21 @@ ZABBIX_HOSTGROUP_NAME          = "Tahoe devices"
 ZABBIX_TEMPLATE_NAME           = "Tahoe device template"
 ZABBIX_USERGROUP_NAME          = "Tahoe users"
 
+# connections kept alive to the zabbix frontend, shared by the threads
+# calling the API
+ZABBIX_HTTP_POOL_SIZE          = 10
+# hosts or users per API call of the bulk device calls
+ZABBIX_BULK_SIZE               = 500
+
+# looked up zabbix objects cached per type, at most ZABBIX_CACHE_SIZE of
+# each type. The controller drops the objects it changes itself, changes
+# made by others are only seen after the ttl of the type (seconds), 0
+# disables the cache of a type
+ZABBIX_CACHE_SIZE              = 10000
+ZABBIX_CACHE_TTLS              = {"template": 3600,
+                                  "hostgroup": 3600,
+                                  "usergroup": 3600,
+                                  "host": 60,
+                                  "user": 300,
+                                  "actions": 60}
+
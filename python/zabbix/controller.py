@@ -1,10 +1,19 @@
+import copy
 import requests
 import json
+from requests.adapters import HTTPAdapter
 from threading import Lock
 
 import zabbix.config as zabbix_config
 from zabbix.exception import ZabbixException
-from zabbix.common.utils import get_logger, random_chars
+from zabbix.common.utils import get_logger, random_chars, SingleFlight
+from zabbix.cache import (new_metadata_cache,
+                          CACHE_TEMPLATE,
+                          CACHE_HOSTGROUP,
+                          CACHE_USERGROUP,
+                          CACHE_HOST,
+                          CACHE_USER,
+                          CACHE_ACTIONS)
 from zabbix.common.types import (pack_usermedias,
                                  pack_action_conditions,
                                  remove_action_conditions,
@@ -18,6 +27,27 @@ logger = get_logger()
 ZABBIX_HTTP_SUCCESS = 200
 ZABBIX_RESPONSE_KEY_ERROR = "error"
 ZABBIX_RESPONSE_KEY_RESULT = "result"
+ZABBIX_HTTP_HEADERS = {'Content-Type':'application/json'}
+# methods called before logging in, they are sent without auth
+ZABBIX_METHODS_WITHOUT_AUTH = ("user.login", "apiinfo.version")
+# methods only reading, the same concurrent calls are sent once
+ZABBIX_READ_METHOD_SUFFIX = ".get"
+# object -> the reads of other objects a write of it changes, besides its
+# own reads: zabbix removes the conditions on deleted hosts from actions
+ZABBIX_WRITE_CHANGED_READS = {"host": ("action.get",)}
+
+def new_http_session():
+    """
+    Create the HTTP session the controller calls the zabbix API with. It
+    keeps up to ZABBIX_HTTP_POOL_SIZE connections alive, the session can
+    be used by several threads at the same time.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1,
+                          pool_maxsize=zabbix_config.ZABBIX_HTTP_POOL_SIZE)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
 
 
 zabbix_controller = None
@@ -41,45 +71,153 @@ def get_zabbix_controller():
     return zabbix_controller
 
 class ZabbixController:
-    def __init__(self, user, password):
+    def __init__(self, user, password, cache=None):
+        """
+        Input:
+          * user: zabbix API user
+          * password: zabbix API password
+          * cache: the cache of the looked up zabbix objects, see
+            zabbix.cache.MetadataCache, a new one configured by
+            ZABBIX_CACHE_SIZE and ZABBIX_CACHE_TTLS if None
+        """
         self.user = user
         self.password = password
+        self.session = new_http_session()
+        if cache is None:
+            cache = new_metadata_cache()
+        self.cache = cache
+        # the running read calls, see _call()
+        self.reads = SingleFlight()
+        self.auth = None
         self.auth = self.get_auth()
 
-    def get_auth(self):
+    def _call(self, method, params, description):
         """
-        Get auth:
-          curl -v -X POST -H 'Content-Type: application/json' -d '{"jsonrpc": "2.0","method": "user.login","params": {"user": "Admin","password": "zabbix"},"id": 1,"auth": null}' http://192.10.0.60:8000/zabbix/api_jsonrpc.php;
-        Return:
-          {"jsonrpc":"2.0","result":"8725a8b9977280d879b2bf7449160064","id":1}
+        Call a zabbix API method. A read while the same read (method and
+        params) is running isn't sent, it waits for the running one and
+        gets a copy of its result. After a write, the reads of the written
+        object are sent again rather than share a read which may not see
+        the write.
+
+        Input:
+          * method: the API method, e.g. "host.get"
+          * params: the method params
+          * description: what the call does, for the failure logs
+        Output:
+          * result: the result of the call
+        """
+        if not method.endswith(ZABBIX_READ_METHOD_SUFFIX):
+            try:
+                return self._request(method, params, description)
+            finally:
+                if method not in ZABBIX_METHODS_WITHOUT_AUTH:
+                    self._forget_reads(method)
+        key = (method, json.dumps(params, sort_keys=True))
+        result, shared = self.reads.do(key, lambda: self._request(method, params, description))
+        if shared:
+            # every caller sharing the result gets its own copy
+            logger.debug("zabbix %s shared with concurrent calls" % description)
+            result = copy.deepcopy(result)
+        return result
+
+    def _forget_reads(self, method):
+        """
+        Stop sharing the running reads the write 'method' may change.
+        """
+        written = method.split(".")[0]
+        changed = ZABBIX_WRITE_CHANGED_READS.get(written, ())
+        def match(key):
+            return key[0].split(".")[0] == written or key[0] in changed
+        self.reads.forget(match)
+
+    def _request(self, method, params, description):
+        """
+        Send a zabbix API call, see _call().
         """
-        request_method = "user.login"
         data = {"jsonrpc": zabbix_config.ZABBIX_JSONRPC_VERSION,
-                "method": request_method,
-                "params": {"user": self.user,
-                    "password": self.password},
+                "method": method,
+                "params": params,
                 "id": 1,
-                "auth": None}
-        headers = {'Content-Type':'application/json'}
+                "auth": None if method in ZABBIX_METHODS_WITHOUT_AUTH else self.auth}
         try:
-            rsp = requests.post(zabbix_config.ZABBIX_URL,
-                                headers=headers,
-                                json=data)
+            rsp = self.session.post(zabbix_config.ZABBIX_URL,
+                                    headers=ZABBIX_HTTP_HEADERS,
+                                    json=data)
         except Exception as e:
-            logger.error("zabbix get auth info failure: %s" % e.message)
+            logger.error("zabbix %s failure: %s" % (description, e.message))
             raise
         if rsp.status_code != ZABBIX_HTTP_SUCCESS:
-            logger.error("zabbix get auth info failure: code(%d), "
-                    "reason: %s" % (rsp.status_code, rsp.reason))
+            logger.error("zabbix %s failure: code(%d), "
+                    "reason: %s" % (description, rsp.status_code, rsp.reason))
             raise ZabbixException(rsp.reason)
-        if rsp.json().has_key(ZABBIX_RESPONSE_KEY_ERROR):
-            error = rsp.json()[ZABBIX_RESPONSE_KEY_ERROR]
+        body = rsp.json()
+        if body.has_key(ZABBIX_RESPONSE_KEY_ERROR):
+            error = body[ZABBIX_RESPONSE_KEY_ERROR]
             reason = error['message'] + " " + error['data']
-            logger.error("zabbix get auth info failure: code(%d), "
-                    "reason: %s" % (error['code'], reason))
+            logger.error("zabbix %s failure: code(%d), "
+                    "reason: %s" % (description, error['code'], reason))
             raise ZabbixException(reason)
+        return body[ZABBIX_RESPONSE_KEY_RESULT]
 
-        result = rsp.json()[ZABBIX_RESPONSE_KEY_RESULT]
+    def _cached(self, kind, key, load):
+        """
+        Get the object 'key' of type 'kind' from the cache, or load() it
+        and cache it.
+        """
+        found, value = self.cache.find(kind, key)
+        if found:
+            return value
+        generation = self.cache.generation(kind)
+        value = load()
+        self.cache.add(kind, key, value, generation)
+        return value
+
+    def _invalidate(self, kind, index, ids):
+        """
+        Drop the objects of type 'kind' changed by our own write of 'ids',
+        found through their (index, id) cache entries. If one of them isn't
+        cached all the objects of the type are dropped, an object loaded by
+        another lookup may still contain it.
+        """
+        keys = []
+        for id in ids:
+            found, key = self.cache.peek(kind, (index, id))
+            if not found:
+                self.cache.clear(kind)
+                return
+            keys.append(key)
+        for key in keys:
+            self.cache.delete(kind, key)
+
+    def cache_stats(self):
+        """
+        Output:
+          * stats: the hit and miss statistics of the cache, see
+            zabbix.cache.MetadataCache.stats()
+        """
+        return self.cache.stats()
+
+    def read_stats(self):
+        """
+        Output:
+          * stats: dict
+            ** calls: read calls
+            ** shared: read calls which shared a running one instead of
+               being sent
+        """
+        return self.reads.stats()
+
+    def get_auth(self):
+        """
+        Get auth:
+          curl -v -X POST -H 'Content-Type: application/json' -d '{"jsonrpc": "2.0","method": "user.login","params": {"user": "Admin","password": "zabbix"},"id": 1,"auth": null}' http://192.10.0.60:8000/zabbix/api_jsonrpc.php;
+        Return:
+          {"jsonrpc":"2.0","result":"8725a8b9977280d879b2bf7449160064","id":1}
+        """
+        request_method = "user.login"
+        params = {"user": self.user,
+                "password": self.password}
+        result = self._call(request_method, params, "get auth info")
         return result
 
     def get_template_id(self, template_name):
@@ -95,33 +233,12 @@ class ZabbixController:
           * template_id: template id
         """
         request_method = "template.get"
-        data = {"jsonrpc": zabbix_config.ZABBIX_JSONRPC_VERSION,
-                "method": request_method,
-                "params": {"output":["templateid"],
-                    "filter": {"host":[template_name]}},
-                "id": 1,
-                "auth": self.auth}
-        headers = {'Content-Type':'application/json'}
-        try:
-            rsp = requests.post(zabbix_config.ZABBIX_URL,
-                                headers=headers,
-                                json=data)
-        except Exception as e:
-            logger.error("zabbix set template id failure: %s" % e.message)
-            raise
-        if rsp.status_code != ZABBIX_HTTP_SUCCESS:
-            logger.error("zabbix set template id failure: code(%d), "
-                    "reason: %s" % (rsp.status_code, rsp.reason))
-            raise ZabbixException(rsp.reason)
-        if rsp.json().has_key(ZABBIX_RESPONSE_KEY_ERROR):
-            error = rsp.json()[ZABBIX_RESPONSE_KEY_ERROR]
-            reason = error['message'] + " " + error['data']
-            logger.error("zabbix set template id failure: code(%d), "
-                    "reason: %s" % (error['code'], reason))
-            raise ZabbixException(reason)
-
-        result = rsp.json()[ZABBIX_RESPONSE_KEY_RESULT]
-        return result[0]["templateid"]
+        params = {"output":["templateid"],
+                "filter": {"host":[template_name]}}
+        def load():
+            result = self._call(request_method, params, "get template id")
+            return result[0]["templateid"]
+        return self._cached(CACHE_TEMPLATE, template_name, load)
 
     def get_hostgroup_id(self, hostgroup_name):
         """
@@ -136,33 +253,12 @@ class ZabbixController:
           * hostgroup_id: hostgroup id
         """
         request_method = "hostgroup.get"
-        data = {"jsonrpc": zabbix_config.ZABBIX_JSONRPC_VERSION,
-                "method": request_method,
-                "params": {"output":"extend",
-                    "filter": {"name":[hostgroup_name]}},
-                "id": 1,
-                "auth": self.auth}
-        headers = {'Content-Type':'application/json'}
-        try:
-            rsp = requests.post(zabbix_config.ZABBIX_URL,
-                                headers=headers,
-                                json=data)
-        except Exception as e:
-            logger.error("zabbix set host group id failure: %s" % e.message)
-            raise
-        if rsp.status_code != ZABBIX_HTTP_SUCCESS:
-            logger.error("zabbix set host group id failure: code(%d), "
-                    "reason: %s" % (rsp.status_code, rsp.reason))
-            raise ZabbixException(rsp.reason)
-        if rsp.json().has_key(ZABBIX_RESPONSE_KEY_ERROR):
-            error = rsp.json()[ZABBIX_RESPONSE_KEY_ERROR]
-            reason = error['message'] + " " + error['data']
-            logger.error("zabbix set host group id failure: code(%d), "
-                    "reason: %s" % (error['code'], reason))
-            raise ZabbixException(reason)
-
-        result = rsp.json()[ZABBIX_RESPONSE_KEY_RESULT]
-        return result[0]["groupid"]
+        params = {"output":"extend",
+                "filter": {"name":[hostgroup_name]}}
+        def load():
+            result = self._call(request_method, params, "get host group id")
+            return result[0]["groupid"]
+        return self._cached(CACHE_HOSTGROUP, hostgroup_name, load)
 
     def get_usergroup_id(self, usergroup_name):
         """
@@ -177,33 +273,12 @@ class ZabbixController:
           * usergroup_id: usergroup id
         """
         request_method = "usergroup.get"
-        data = {"jsonrpc": zabbix_config.ZABBIX_JSONRPC_VERSION,
-                "method": request_method,
-                "params": {"output":"extend",
-                    "filter": {"name":[usergroup_name]}},
-                "id": 1,
-                "auth": self.auth}
-        headers = {'Content-Type':'application/json'}
-        try:
-            rsp = requests.post(zabbix_config.ZABBIX_URL,
-                                headers=headers,
-                                json=data)
-        except Exception as e:
-            logger.error("zabbix set host group id failure: %s" % e.message)
-            raise
-        if rsp.status_code != ZABBIX_HTTP_SUCCESS:
-            logger.error("zabbix set host group id failure: code(%d), "
-                    "reason: %s" % (rsp.status_code, rsp.reason))
-            raise ZabbixException(rsp.reason)
-        if rsp.json().has_key(ZABBIX_RESPONSE_KEY_ERROR):
-            error = rsp.json()[ZABBIX_RESPONSE_KEY_ERROR]
-            reason = error['message'] + " " + error['data']
-            logger.error("zabbix set host group id failure: code(%d), "
-                    "reason: %s" % (error['code'], reason))
-            raise ZabbixException(reason)
-
-        result = rsp.json()[ZABBIX_RESPONSE_KEY_RESULT]
-        return result[0]["usrgrpid"]
+        params = {"output":"extend",
+                "filter": {"name":[usergroup_name]}}
+        def load():
+            result = self._call(request_method, params, "get user group id")
+            return result[0]["usrgrpid"]
+        return self._cached(CACHE_USERGROUP, usergroup_name, load)
 
     def get_userinfo_by_name(self, username):
         """
@@ -221,39 +296,64 @@ class ZabbixController:
             ** medias : list, meanning SMS, E-mail and other contact information
             ......
         """
+        found, user = self.cache.find(CACHE_USER, username)
+        if found:
+            return user
+        generation = self.cache.generation(CACHE_USER)
         request_method = "user.get"
-        data = {"jsonrpc": zabbix_config.ZABBIX_JSONRPC_VERSION,
-                "method": request_method,
-                "params": {"output":"extend",
-                    "selectMedias":"extend",
-                    "filter": {"alias":[username]}},
-                "id": 1,
-                "auth": self.auth}
-        headers = {'Content-Type':'application/json'}
-        try:
-            rsp = requests.post(zabbix_config.ZABBIX_URL,
-                                headers=headers,
-                                json=data)
-        except Exception as e:
-            logger.error("zabbix get user info by username failure: %s" % e.message)
-            raise
-        if rsp.status_code != ZABBIX_HTTP_SUCCESS:
-            logger.error("zabbix get user info by username failure: code(%d), "
-                    "reason: %s" % (rsp.status_code, rsp.reason))
-            raise ZabbixException(rsp.reason)
-        if rsp.json().has_key(ZABBIX_RESPONSE_KEY_ERROR):
-            error = rsp.json()[ZABBIX_RESPONSE_KEY_ERROR]
-            reason = error['message'] + " " + error['data']
-            logger.error("zabbix get user info by username failure: code(%d), "
-                    "reason: %s" % (error['code'], reason))
-            raise ZabbixException(reason)
-
-        result = rsp.json()[ZABBIX_RESPONSE_KEY_RESULT]
+        params = {"output":"extend",
+                "selectMedias":"extend",
+                "filter": {"alias":[username]}}
+        result = self._call(request_method, params, "get user info by username")
+        self._add_users([username], result, generation)
         user = None
         if len(result) > 0:
             user = result[0]
         return user
 
+    def get_userinfos_by_names(self, usernames):
+        """
+        Get the user info of many users in one call.
+
+        Input:
+          * usernames: a list of user login names
+        Output:
+          * userinfos: dict, user login name -> user info, see
+            get_userinfo_by_name(). The users which don't exist are missing
+        """
+        userinfos = {}
+        missing = []
+        for username in usernames:
+            found, user = self.cache.find(CACHE_USER, username)
+            if not found:
+                missing.append(username)
+            elif user:
+                userinfos[username] = user
+        if not missing:
+            return userinfos
+        generation = self.cache.generation(CACHE_USER)
+        request_method = "user.get"
+        params = {"output":"extend",
+                "selectMedias":"extend",
+                "filter": {"alias":missing}}
+        result = self._call(request_method, params, "get user info by usernames")
+        self._add_users(missing, result, generation)
+        userinfos.update((user["alias"], user) for user in result)
+        return userinfos
+
+    def _add_users(self, usernames, users, generation):
+        """
+        Cache the looked up 'usernames', found as 'users', the missing ones
+        as None.
+        """
+        missing = set(usernames)
+        for user in users:
+            missing.discard(user["alias"])
+            self.cache.add(CACHE_USER, user["alias"], user, generation)
+            self.cache.add(CACHE_USER, ("userid", user["userid"]), user["alias"], generation)
+        for username in missing:
+            self.cache.add(CACHE_USER, username, None, generation)
+
     def create_user(self, username, user_group_id, smss=[], emails=[]):
         """
         Create user:
@@ -272,34 +372,12 @@ class ZabbixController:
         request_method = "user.create"
         medias = pack_usermedias(smss, emails)
         password = random_chars(6)
-        data = {"jsonrpc": zabbix_config.ZABBIX_JSONRPC_VERSION,
-                "method": request_method,
-                "params": {"alias": username,
-                    "passwd": password,
-                    "usrgrps": [{"usrgrpid": user_group_id}],
-                    "user_medias": medias},
-                "id": 1,
-                "auth": self.auth}
-        headers = {'Content-Type':'application/json'}
-        try:
-            rsp = requests.post(zabbix_config.ZABBIX_URL,
-                                headers=headers,
-                                json=data)
-        except Exception as e:
-            logger.error("zabbix create user failure: %s" % e.message)
-            raise
-        if rsp.status_code != ZABBIX_HTTP_SUCCESS:
-            logger.error("zabbix create user failure: code(%d), "
-                    "reason: %s" % (rsp.status_code, rsp.reason))
-            raise ZabbixException(rsp.reason)
-        if rsp.json().has_key(ZABBIX_RESPONSE_KEY_ERROR):
-            error = rsp.json()[ZABBIX_RESPONSE_KEY_ERROR]
-            reason = error['message'] + " " + error['data']
-            logger.error("zabbix create user failure: code(%d), "
-                    "reason: %s" % (error['code'], reason))
-            raise ZabbixException(reason)
-
-        result = rsp.json()[ZABBIX_RESPONSE_KEY_RESULT]
+        params = {"alias": username,
+                "passwd": password,
+                "usrgrps": [{"usrgrpid": user_group_id}],
+                "user_medias": medias}
+        result = self._call(request_method, params, "create user")
+        self.cache.delete(CACHE_USER, username)
         return result["userids"][0]
 
     def update_user_medias(self, user_id, smss=[], emails=[]):
@@ -317,32 +395,10 @@ class ZabbixController:
         request_method = "user.updatemedia"
         medias = pack_usermedias(smss, emails)
 
-        data = {"jsonrpc": zabbix_config.ZABBIX_JSONRPC_VERSION,
-                "method": request_method,
-                "params": {"users": [{"userid": user_id}],
-                    "medias": medias},
-                "id": 1,
-                "auth": self.auth}
-        headers = {'Content-Type':'application/json'}
-        try:
-            rsp = requests.post(zabbix_config.ZABBIX_URL,
-                                headers=headers,
-                                json=data)
-        except Exception as e:
-            logger.error("zabbix update user medias failure: %s" % e.message)
-            raise
-        if rsp.status_code != ZABBIX_HTTP_SUCCESS:
-            logger.error("zabbix update user medias failure: code(%d), "
-                    "reason: %s" % (rsp.status_code, rsp.reason))
-            raise ZabbixException(rsp.reason)
-        if rsp.json().has_key(ZABBIX_RESPONSE_KEY_ERROR):
-            error = rsp.json()[ZABBIX_RESPONSE_KEY_ERROR]
-            reason = error['message'] + " " + error['data']
-            logger.error("zabbix update user medias failure: code(%d), "
-                    "reason: %s" % (error['code'], reason))
-            raise ZabbixException(reason)
-
-        result = rsp.json()[ZABBIX_RESPONSE_KEY_RESULT]
+        params = {"users": [{"userid": user_id}],
+                "medias": medias}
+        result = self._call(request_method, params, "update user medias")
+        self._invalidate(CACHE_USER, "userid", [user_id])
         return result["userids"][0]
 
     def create_host(self, host_name, host_group_id, host_template_id):
@@ -359,10 +415,24 @@ class ZabbixController:
         Output:
           * host_id: created host id
         """
+        return self.create_hosts([host_name], host_group_id, host_template_id)[0]
+
+    def create_hosts(self, host_names, host_group_id, host_template_id):
+        """
+        Create many hosts in one call, if one of them can't be created none
+        is.
+
+        Input:
+          * host_names: a list of host names
+          * host_group_id: host group id
+          * host_template_id: host template id
+        Output:
+          * host_ids: the created host ids, in the order of host_names
+        """
         request_method = "host.create"
-        data = {"jsonrpc": zabbix_config.ZABBIX_JSONRPC_VERSION,
-                "method": request_method,
-                "params": [{"host": host_name,
+        params = []
+        for host_name in host_names:
+            params.append({"host": host_name,
                     "interfaces": [{"type": 1,
                         "main": 1,
                         "useip": 1,
@@ -370,30 +440,11 @@ class ZabbixController:
                         "dns": "",
                         "port":"10050"}],
                     "groups": [{"groupid": host_group_id}],
-                    "templates": [{"templateid": host_template_id}]}],
-                "id": 1,
-                "auth": self.auth}
-        headers = {'Content-Type':'application/json'}
-        try:
-            rsp = requests.post(zabbix_config.ZABBIX_URL,
-                                headers=headers,
-                                json=data)
-        except Exception as e:
-            logger.error("zabbix create host failure: %s" % e.message)
-            raise
-        if rsp.status_code != ZABBIX_HTTP_SUCCESS:
-            logger.error("zabbix create host failure: code(%d), "
-                    "reason: %s" % (rsp.status_code, rsp.reason))
-            raise ZabbixException(rsp.reason)
-        if rsp.json().has_key(ZABBIX_RESPONSE_KEY_ERROR):
-            error = rsp.json()[ZABBIX_RESPONSE_KEY_ERROR]
-            reason = error['message'] + " " + error['data']
-            logger.error("zabbix create host failure: code(%d), "
-                    "reason: %s" % (error['code'], reason))
-            raise ZabbixException(reason)
-
-        result = rsp.json()[ZABBIX_RESPONSE_KEY_RESULT]
-        return result["hostids"][0]
+                    "templates": [{"templateid": host_template_id}]})
+        result = self._call(request_method, params, "create host")
+        for host_name in host_names:
+            self.cache.delete(CACHE_HOST, host_name)
+        return result["hostids"]
 
     def delete_hosts(self, host_ids):
         """
@@ -405,31 +456,11 @@ class ZabbixController:
           * host_id: deleted host ids
         """
         request_method = "host.delete"
-        data = {"jsonrpc": zabbix_config.ZABBIX_JSONRPC_VERSION,
-                "method": request_method,
-                "params": host_ids,
-                "id": 1,
-                "auth": self.auth}
-        headers = {'Content-Type':'application/json'}
-        try:
-            rsp = requests.post(zabbix_config.ZABBIX_URL,
-                                headers=headers,
-                                json=data)
-        except Exception as e:
-            logger.error("zabbix delete host failure: %s" % e.message)
-            raise
-        if rsp.status_code != ZABBIX_HTTP_SUCCESS:
-            logger.error("zabbix delete host failure: code(%d), "
-                    "reason: %s" % (rsp.status_code, rsp.reason))
-            raise ZabbixException(rsp.reason)
-        if rsp.json().has_key(ZABBIX_RESPONSE_KEY_ERROR):
-            error = rsp.json()[ZABBIX_RESPONSE_KEY_ERROR]
-            reason = error['message'] + " " + error['data']
-            logger.error("zabbix delete host failure: code(%d), "
-                    "reason: %s" % (error['code'], reason))
-            raise ZabbixException(reason)
-
-        result = rsp.json()[ZABBIX_RESPONSE_KEY_RESULT]
+        params = host_ids
+        result = self._call(request_method, params, "delete host")
+        self._invalidate(CACHE_HOST, "hostid", host_ids)
+        # zabbix removes the conditions on the deleted hosts from the actions
+        self.cache.clear(CACHE_ACTIONS)
         return result["hostids"]
 
     def get_hosts(self, host_names):
@@ -449,33 +480,28 @@ class ZabbixController:
           *** name: host name
           ......
         """
-        request_method = "host.get"
-        data = {"jsonrpc": zabbix_config.ZABBIX_JSONRPC_VERSION,
-                "method": request_method,
-                "params": {"output":"extend",
-                    "filter": {"host":host_names}},
-                "id": 1,
-                "auth": self.auth}
-        headers = {'Content-Type':'application/json'}
-        try:
-            rsp = requests.post(zabbix_config.ZABBIX_URL,
-                                headers=headers,
-                                json=data)
-        except Exception as e:
-            logger.error("zabbix get hosts by host names failure: %s" % e.message)
-            raise
-        if rsp.status_code != ZABBIX_HTTP_SUCCESS:
-            logger.error("zabbix get hosts by host names failure: code(%d), "
-                    "reason: %s" % (rsp.status_code, rsp.reason))
-            raise ZabbixException(rsp.reason)
-        if rsp.json().has_key(ZABBIX_RESPONSE_KEY_ERROR):
-            error = rsp.json()[ZABBIX_RESPONSE_KEY_ERROR]
-            reason = error['message'] + " " + error['data']
-            logger.error("zabbix get hosts by host names failure: code(%d), "
-                    "reason: %s" % (error['code'], reason))
-            raise ZabbixException(reason)
-
-        result = rsp.json()[ZABBIX_RESPONSE_KEY_RESULT]
+        result = []
+        missing = []
+        for host_name in host_names:
+            found, host = self.cache.find(CACHE_HOST, host_name)
+            if not found:
+                missing.append(host_name)
+            elif host:
+                result.append(host)
+        if missing:
+            generation = self.cache.generation(CACHE_HOST)
+            request_method = "host.get"
+            params = {"output":"extend",
+                    "filter": {"host":missing}}
+            loaded = self._call(request_method, params, "get hosts by host names")
+            not_existing = set(missing)
+            for host in loaded:
+                not_existing.discard(host["host"])
+                self.cache.add(CACHE_HOST, host["host"], host, generation)
+                self.cache.add(CACHE_HOST, ("hostid", host["hostid"]), host["host"], generation)
+            for host_name in not_existing:
+                self.cache.add(CACHE_HOST, host_name, None, generation)
+            result.extend(loaded)
         hosts = None
         if len(result) > 0:
             hosts = result
@@ -492,13 +518,25 @@ class ZabbixController:
         Output:
           * actionid: created action id
         """
-        action_name = "%s`s device occur %s exception action" % (user_name, item_name)
-        conditions = pack_action_conditions(host_ids, item_name, None)
+        return self.create_actions([item_name], host_ids, user_name, user_id, notification_mode)[0]
+
+    def create_actions(self, item_names, host_ids, user_name, user_id, notification_mode=NOTIFICATION_MODE_SMS):
+        """
+        Create the actions of many monitoring items of the same user and
+        hosts in one call, see create_action().
+
+        Input:
+          * item_names: a list of monitoring item names
+        Output:
+          * actionids: the created action ids, in the order of item_names
+        """
         operations = pack_action_operations(user_id, notification_mode)
         request_method = "action.create"
-        data = {"jsonrpc": zabbix_config.ZABBIX_JSONRPC_VERSION,
-                "method": request_method,
-                "params": [{"name": action_name,
+        params = []
+        for item_name in item_names:
+            action_name = "%s`s device occur %s exception action" % (user_name, item_name)
+            conditions = pack_action_conditions(host_ids, item_name, None)
+            params.append({"name": action_name,
                     "eventsource": 0,
                     "status": 0,
                     "esc_period": 120,
@@ -506,30 +544,10 @@ class ZabbixController:
                     "def_longdata": NOTIFICATION_MESSAGE,
                     "filter": {"evaltype": "0",
                         "conditions": conditions},
-                    "operations": operations}],
-                "id": 1,
-                "auth": self.auth}
-        headers = {'Content-Type':'application/json'}
-        try:
-            rsp = requests.post(zabbix_config.ZABBIX_URL,
-                                headers=headers,
-                                json=data)
-        except Exception as e:
-            logger.error("zabbix create action failure: %s" % e.message)
-            raise
-        if rsp.status_code != ZABBIX_HTTP_SUCCESS:
-            logger.error("zabbix create action failure: code(%d), "
-                    "reason: %s" % (rsp.status_code, rsp.reason))
-            raise ZabbixException(rsp.reason)
-        if rsp.json().has_key(ZABBIX_RESPONSE_KEY_ERROR):
-            error = rsp.json()[ZABBIX_RESPONSE_KEY_ERROR]
-            reason = error['message'] + " " + error['data']
-            logger.error("zabbix create action failure: code(%d), "
-                    "reason: %s" % (error['code'], reason))
-            raise ZabbixException(reason)
-
-        result = rsp.json()[ZABBIX_RESPONSE_KEY_RESULT]
-        return result["actionids"][0]
+                    "operations": operations})
+        result = self._call(request_method, params, "create action")
+        self.cache.delete(CACHE_ACTIONS, user_id)
+        return result["actionids"]
 
     def delete_actions(self, action_ids):
         """
@@ -541,31 +559,9 @@ class ZabbixController:
           * action_ids: deleted action ids
         """
         request_method = "action.delete"
-        data = {"jsonrpc": zabbix_config.ZABBIX_JSONRPC_VERSION,
-                "method": request_method,
-                "params": action_ids,
-                "id": 1,
-                "auth": self.auth}
-        headers = {'Content-Type':'application/json'}
-        try:
-            rsp = requests.post(zabbix_config.ZABBIX_URL,
-                                headers=headers,
-                                json=data)
-        except Exception as e:
-            logger.error("zabbix delete action failure: %s" % e.message)
-            raise
-        if rsp.status_code != ZABBIX_HTTP_SUCCESS:
-            logger.error("zabbix delete action failure: code(%d), "
-                    "reason: %s" % (rsp.status_code, rsp.reason))
-            raise ZabbixException(rsp.reason)
-        if rsp.json().has_key(ZABBIX_RESPONSE_KEY_ERROR):
-            error = rsp.json()[ZABBIX_RESPONSE_KEY_ERROR]
-            reason = error['message'] + " " + error['data']
-            logger.error("zabbix delete action failure: code(%d), "
-                    "reason: %s" % (error['code'], reason))
-            raise ZabbixException(reason)
-
-        result = rsp.json()[ZABBIX_RESPONSE_KEY_RESULT]
+        params = action_ids
+        result = self._call(request_method, params, "delete action")
+        self._invalidate(CACHE_ACTIONS, "actionid", action_ids)
         return result["actionids"]
 
     def get_actions_by_userid(self, user_id):
@@ -580,37 +576,21 @@ class ZabbixController:
         Output:
           * actions: is a list of action json format
         """
+        found, result = self.cache.find(CACHE_ACTIONS, user_id)
+        if found:
+            return result
+        generation = self.cache.generation(CACHE_ACTIONS)
         request_method = "action.get"
-        data = {"jsonrpc": zabbix_config.ZABBIX_JSONRPC_VERSION,
-                "method": request_method,
-                "params": {"output":"extend",
-                    "selectOperations":"extend",
-                    "selectRecoveryOperations":"extend",
-                    "selectFilter":"extend",
-                    "userids": [user_id],
-                    "filter": {"eventsource": 0}},
-                "id": 1,
-                "auth": self.auth}
-        headers = {'Content-Type':'application/json'}
-        try:
-            rsp = requests.post(zabbix_config.ZABBIX_URL,
-                                headers=headers,
-                                json=data)
-        except Exception as e:
-            logger.error("zabbix get actions by user id failure: %s" % e.message)
-            raise
-        if rsp.status_code != ZABBIX_HTTP_SUCCESS:
-            logger.error("zabbix get actions by user id failure: code(%d), "
-                    "reason: %s" % (rsp.status_code, rsp.reason))
-            raise ZabbixException(rsp.reason)
-        if rsp.json().has_key(ZABBIX_RESPONSE_KEY_ERROR):
-            error = rsp.json()[ZABBIX_RESPONSE_KEY_ERROR]
-            reason = error['message'] + " " + error['data']
-            logger.error("zabbix get actions by user id failure: code(%d), "
-                    "reason: %s" % (error['code'], reason))
-            raise ZabbixException(reason)
-
-        result = rsp.json()[ZABBIX_RESPONSE_KEY_RESULT]
+        params = {"output":"extend",
+                "selectOperations":"extend",
+                "selectRecoveryOperations":"extend",
+                "selectFilter":"extend",
+                "userids": [user_id],
+                "filter": {"eventsource": 0}}
+        result = self._call(request_method, params, "get actions by user id")
+        self.cache.add(CACHE_ACTIONS, user_id, result, generation)
+        for action in result:
+            self.cache.add(CACHE_ACTIONS, ("actionid", action["actionid"]), user_id, generation)
         return result
 
     def get_actions_by_hostid(self, host_id):
@@ -626,36 +606,32 @@ class ZabbixController:
           * actions: is a list of action json format
         """
         request_method = "action.get"
-        data = {"jsonrpc": zabbix_config.ZABBIX_JSONRPC_VERSION,
-                "method": request_method,
-                "params": {"output":"extend",
-                    "selectOperations":"extend",
-                    "selectRecoveryOperations":"extend",
-                    "selectFilter":"extend",
-                    "hostids": [host_id],
-                    "filter": {"eventsource": 0}},
-                "id": 1,
-                "auth": self.auth}
-        headers = {'Content-Type':'application/json'}
-        try:
-            rsp = requests.post(zabbix_config.ZABBIX_URL,
-                                headers=headers,
-                                json=data)
-        except Exception as e:
-            logger.error("zabbix get actions by host id failure: %s" % e.message)
-            raise
-        if rsp.status_code != ZABBIX_HTTP_SUCCESS:
-            logger.error("zabbix get actions by host id failure: code(%d), "
-                    "reason: %s" % (rsp.status_code, rsp.reason))
-            raise ZabbixException(rsp.reason)
-        if rsp.json().has_key(ZABBIX_RESPONSE_KEY_ERROR):
-            error = rsp.json()[ZABBIX_RESPONSE_KEY_ERROR]
-            reason = error['message'] + " " + error['data']
-            logger.error("zabbix get actions by host id failure: code(%d), "
-                    "reason: %s" % (error['code'], reason))
-            raise ZabbixException(reason)
+        params = {"output":"extend",
+                "selectOperations":"extend",
+                "selectRecoveryOperations":"extend",
+                "selectFilter":"extend",
+                "hostids": [host_id],
+                "filter": {"eventsource": 0}}
+        result = self._call(request_method, params, "get actions by host id")
+        return result
 
-        result = rsp.json()[ZABBIX_RESPONSE_KEY_RESULT]
+    def get_actions_by_hostids(self, host_ids):
+        """
+        Get the actions with a condition on any of many hosts in one call.
+
+        Input:
+          * host_ids: host id list
+        Output:
+          * actions: is a list of action json format
+        """
+        request_method = "action.get"
+        params = {"output":"extend",
+                "selectOperations":"extend",
+                "selectRecoveryOperations":"extend",
+                "selectFilter":"extend",
+                "hostids": host_ids,
+                "filter": {"eventsource": 0}}
+        result = self._call(request_method, params, "get actions by host ids")
         return result
 
     def update_action_condition(self, action_id, conditions):
@@ -668,35 +644,27 @@ class ZabbixController:
         Output:
           * actionid: created action id
         """
+        return self.update_action_conditions([(action_id, conditions)])[0]
+
+    def update_action_conditions(self, action_conditions):
+        """
+        Update the conditions of many actions in one call.
+
+        Input:
+          * action_conditions: a list of (action_id, conditions)
+        Output:
+          * actionids: the updated action ids
+        """
         request_method = "action.update"
-        data = {"jsonrpc": zabbix_config.ZABBIX_JSONRPC_VERSION,
-                "method": request_method,
-                "params": {"actionid": action_id,
+        params = []
+        for action_id, conditions in action_conditions:
+            params.append({"actionid": action_id,
                     "filter": {"evaltype": "0",
-                        "conditions": conditions}},
-                "id": 1,
-                "auth": self.auth}
-        headers = {'Content-Type':'application/json'}
-        try:
-            rsp = requests.post(zabbix_config.ZABBIX_URL,
-                                headers=headers,
-                                json=data)
-        except Exception as e:
-            logger.error("zabbix update action condition failure: %s" % e.message)
-            raise
-        if rsp.status_code != ZABBIX_HTTP_SUCCESS:
-            logger.error("zabbix update action condition failure: code(%d), "
-                    "reason: %s" % (rsp.status_code, rsp.reason))
-            raise ZabbixException(rsp.reason)
-        if rsp.json().has_key(ZABBIX_RESPONSE_KEY_ERROR):
-            error = rsp.json()[ZABBIX_RESPONSE_KEY_ERROR]
-            reason = error['message'] + " " + error['data']
-            logger.error("zabbix update action condition failure: code(%d), "
-                    "reason: %s" % (error['code'], reason))
-            raise ZabbixException(reason)
-
-        result = rsp.json()[ZABBIX_RESPONSE_KEY_RESULT]
-        return result["actionids"][0]
+                        "conditions": conditions}})
+        result = self._call(request_method, params, "update action condition")
+        self._invalidate(CACHE_ACTIONS, "actionid",
+                         [action_id for action_id, conditions in action_conditions])
+        return result["actionids"]
 
     def update_action_operation(self, action_id, operations):
         """
@@ -709,32 +677,11 @@ class ZabbixController:
           * actionid: created action id
         """
         request_method = "action.update"
-        data = {"jsonrpc": zabbix_config.ZABBIX_JSONRPC_VERSION,
-                "method": request_method,
-                "params": {"actionid": action_id,
-                    "operations": operations},
-                "id": 1,
-                "auth": self.auth}
-        headers = {'Content-Type':'application/json'}
-        try:
-            rsp = requests.post(zabbix_config.ZABBIX_URL,
-                                headers=headers,
-                                json=data)
-        except Exception as e:
-            logger.error("zabbix update action operation failure: %s" % e.message)
-            raise
-        if rsp.status_code != ZABBIX_HTTP_SUCCESS:
-            logger.error("zabbix update action operation failure: code(%d), "
-                    "reason: %s" % (rsp.status_code, rsp.reason))
-            raise ZabbixException(rsp.reason)
-        if rsp.json().has_key(ZABBIX_RESPONSE_KEY_ERROR):
-            error = rsp.json()[ZABBIX_RESPONSE_KEY_ERROR]
-            reason = error['message'] + " " + error['data']
-            logger.error("zabbix update action operation failure: code(%d), "
-                    "reason: %s" % (error['code'], reason))
-            raise ZabbixException(reason)
-
-        result = rsp.json()[ZABBIX_RESPONSE_KEY_RESULT]
+        params = {"actionid": action_id,
+                "operations": operations}
+        result = self._call(request_method, params, "update action operation")
+        # the operations choose the users the action is listed for
+        self.cache.clear(CACHE_ACTIONS)
         return result["actionids"][0]
 
     def get_device_controller(self):
@@ -786,9 +733,7 @@ class TahoeDeviceController:
           ** status: the execution status. bool
           ** message: the failure message on failure
         """
-        if not (logical_address != None and logical_address.strip()!="" and \
-                username != None and username.strip()!="" and \
-                isinstance(smss, list) and isinstance(emails, list)):
+        if not self._check_setup_parameters(logical_address, username, smss, emails):
             message = "Input parameters format is wrong"
             logger.error("zabbix device first setup failure: %s" % message)
             return (False, message)
@@ -848,6 +793,141 @@ class TahoeDeviceController:
             ret = (False, message)
         return ret
 
+    def _check_setup_parameters(self, logical_address, username, smss, emails):
+        return logical_address != None and logical_address.strip()!="" and \
+                username != None and username.strip()!="" and \
+                isinstance(smss, list) and isinstance(emails, list)
+
+    def devices_first_setup(self, devices):
+        """
+        Set up many devices, the devices of the same user share its user
+        and action calls:
+        1. get the hosts of the devices, the existing ones fail
+        2. create the hosts of the other devices, ZABBIX_BULK_SIZE hosts per
+           call, if a call fails all the hosts of the call fail
+        3. get the user info of all the usernames
+        4. for each user:
+           if user is None, create user, if user, update user medias, by the
+           smss and emails of the user's last device
+           get actions by userid
+           create the actions of the monitoring items without one, with all
+           the user's new hosts, in one call
+           add all the user's new hosts to the conditions of the other
+           actions, one merged update per action, in one call
+
+        Input:
+          * devices: a list of (logical_address, username, smss, emails)
+            tuples, see device_first_setup()
+        Output:
+          * results: a list of (status, message) tuples, one per device in
+            the order of devices, see device_first_setup()
+        """
+        results = [None] * len(devices)
+        pending = []
+        logical_addresses = set()
+        for index, (logical_address, username, smss, emails) in enumerate(devices):
+            if not self._check_setup_parameters(logical_address, username, smss, emails):
+                results[index] = (False, "Input parameters format is wrong")
+            elif logical_address in logical_addresses:
+                results[index] = (False, "host[%s] already existing." % logical_address)
+            else:
+                logical_addresses.add(logical_address)
+                pending.append(index)
+
+        # (index, host_id) of the created hosts
+        created = []
+        for start in range(0, len(pending), zabbix_config.ZABBIX_BULK_SIZE):
+            chunk = pending[start:start + zabbix_config.ZABBIX_BULK_SIZE]
+            try:
+                logger.info("Get hosts of %d devices." % len(chunk))
+                hosts = self.zabbix_controller.get_hosts([devices[index][0] for index in chunk])
+                existing = set(host["host"] for host in hosts or [])
+                new = []
+                for index in chunk:
+                    if devices[index][0] in existing:
+                        results[index] = (False, "host[%s] already existing." % devices[index][0])
+                    else:
+                        new.append(index)
+                if new:
+                    logger.info("Create %d hosts." % len(new))
+                    host_ids = self.zabbix_controller.create_hosts([devices[index][0] for index in new],
+                                                                   self.host_group_id, self.host_template_id)
+                    created.extend(zip(new, host_ids))
+            except Exception as e:
+                message = "zabbix device first setup failure: %s" % e.message
+                logger.error(message)
+                for index in chunk:
+                    if results[index] is None:
+                        results[index] = (False, message)
+
+        # username -> [(index, host_id)], in the order of devices
+        user_devices = {}
+        for index, host_id in created:
+            user_devices.setdefault(devices[index][1], []).append((index, host_id))
+        users = {}
+        usernames = user_devices.keys()
+        for start in range(0, len(usernames), zabbix_config.ZABBIX_BULK_SIZE):
+            chunk = usernames[start:start + zabbix_config.ZABBIX_BULK_SIZE]
+            try:
+                logger.info("Get user info of %d users." % len(chunk))
+                users.update(self.zabbix_controller.get_userinfos_by_names(chunk))
+            except Exception as e:
+                message = "zabbix device first setup failure: %s" % e.message
+                logger.error(message)
+                for username in chunk:
+                    for index, host_id in user_devices.pop(username):
+                        results[index] = (False, message)
+
+        for username, members in user_devices.items():
+            smss, emails = devices[members[-1][0]][2:4]
+            host_ids = [host_id for index, host_id in members]
+            try:
+                ret = self._setup_user_devices(username, users.get(username), smss, emails, host_ids)
+            except Exception as e:
+                message = "zabbix device first setup failure: %s" % e.message
+                logger.error(message)
+                ret = (False, message)
+            for index, host_id in members:
+                results[index] = ret
+        return results
+
+    def _setup_user_devices(self, username, user, smss, emails, host_ids):
+        """
+        Step 4 of devices_first_setup() for the new hosts 'host_ids' of
+        user 'username', 'user' is its user info, None if it doesn't exist.
+        """
+        if user:
+            user_id = user["userid"]
+            logger.info("Update user medias by user_id[%s]." % user_id)
+            self.zabbix_controller.update_user_medias(user_id, smss, emails)
+        else:
+            logger.info("Create user by username[%s], user_group_id[%s]." % (username, self.user_group_id))
+            user_id = self.zabbix_controller.create_user(username, self.user_group_id, smss, emails)
+        if not user_id:
+            return (False, "create user Failure")
+
+        logger.info("Get actions by user_id[%s]." % user_id)
+        actions = self.zabbix_controller.get_actions_by_userid(user_id) or []
+        items = []
+        # action id -> conditions with the new hosts
+        updates = {}
+        for item in TahoeDeviceController.MONITORING_ITEMS:
+            for action in actions:
+                if item in action["name"]:
+                    if action["actionid"] not in updates:
+                        old_coditions = action["filter"]["conditions"]
+                        updates[action["actionid"]] = pack_action_conditions(host_ids, None, old_coditions)
+                    break
+            else:
+                items.append(item)
+        if items:
+            logger.info("Create actions by monitoring items%s, username[%s]." % (items, username))
+            self.zabbix_controller.create_actions(items, host_ids, username, user_id)
+        if updates:
+            logger.info("Update %d actions of username[%s]." % (len(updates), username))
+            self.zabbix_controller.update_action_conditions(updates.items())
+        return (True, "succeed")
+
     def remove_device_host(self, logical_address):
         """
         1. get host by device logical address, return host
@@ -865,7 +945,7 @@ class TahoeDeviceController:
           ** status: the execution status. bool
           ** message: the failure message on failure
         """
-        if logical_address == None and logical_address.strip() == "":
+        if not self._check_remove_parameters(logical_address):
             message = "Input parameters format is wrong"
             logger.error("zabbix remove device host failure: %s" % message)
             return (False, message)
@@ -887,8 +967,7 @@ class TahoeDeviceController:
                     # update action conditions to remove host_id
                     old_coditions = action["filter"]["conditions"]
                     conditions = remove_action_conditions(host_id, old_coditions)
-                    if len(conditions) == 0 or (len(conditions) == 1 and \
-                            conditions[0]["conditiontype"]=="3" and conditions[0]["operator"]=="2"):
+                    if self._without_host_conditions(conditions):
                         #remove this action by action_id
                         action_id = action["actionid"]
                         logger.info("Remove action[%s] by action_id[%s]." % (action["name"], action_id))
@@ -907,6 +986,118 @@ class TahoeDeviceController:
             ret = (False, message)
         return ret
 
+    def _check_remove_parameters(self, logical_address):
+        return logical_address != None and logical_address.strip() != ""
+
+    def _without_host_conditions(self, conditions):
+        """
+        Whether the action conditions have no host left, only the item name
+        filter. Such an action is removed.
+        """
+        return len(conditions) == 0 or (len(conditions) == 1 and \
+                conditions[0]["conditiontype"]=="3" and conditions[0]["operator"]=="2")
+
+    def remove_device_hosts(self, logical_addresses):
+        """
+        Remove many devices, every action is rewritten once for all of them:
+        1. get the hosts of the devices, ZABBIX_BULK_SIZE per call, the
+           missing ones fail
+        2. get the actions of all the hosts
+        3. remove all the hosts from the conditions of each action at once
+           if the action conditions only remain item_name filter, the
+           actions are deleted in one call, the others updated in one call
+        4. delete the hosts, ZABBIX_BULK_SIZE per call
+        If the actions can't be rewritten no host is deleted.
+
+        Input:
+          * logical_addresses: a list of device logical addresses
+        Output:
+          * results: a list of (status, message) tuples, one per device in
+            the order of logical_addresses, see remove_device_host()
+        """
+        results = [None] * len(logical_addresses)
+        pending = []
+        seen = set()
+        for index, logical_address in enumerate(logical_addresses):
+            if not self._check_remove_parameters(logical_address):
+                results[index] = (False, "Input parameters format is wrong")
+            elif logical_address in seen:
+                results[index] = (False, "host[%s] not existing." % logical_address)
+            else:
+                seen.add(logical_address)
+                pending.append(index)
+
+        # (index, host_id) of the existing hosts
+        found = []
+        for start in range(0, len(pending), zabbix_config.ZABBIX_BULK_SIZE):
+            chunk = pending[start:start + zabbix_config.ZABBIX_BULK_SIZE]
+            try:
+                logger.info("Get hosts of %d devices." % len(chunk))
+                hosts = self.zabbix_controller.get_hosts([logical_addresses[index] for index in chunk])
+                host_ids = dict((host["host"], host["hostid"]) for host in hosts or [])
+                for index in chunk:
+                    if logical_addresses[index] in host_ids:
+                        found.append((index, host_ids[logical_addresses[index]]))
+                    else:
+                        results[index] = (False, "host[%s] not existing." % logical_addresses[index])
+            except Exception as e:
+                message = "zabbix remove device host failure: %s" % e.message
+                logger.error(message)
+                for index in chunk:
+                    results[index] = (False, message)
+
+        try:
+            self._remove_hosts_from_actions([host_id for index, host_id in found])
+        except Exception as e:
+            message = "zabbix remove device host failure: %s" % e.message
+            logger.error(message)
+            for index, host_id in found:
+                results[index] = (False, message)
+            return results
+
+        for start in range(0, len(found), zabbix_config.ZABBIX_BULK_SIZE):
+            chunk = found[start:start + zabbix_config.ZABBIX_BULK_SIZE]
+            try:
+                logger.info("Remove %d hosts." % len(chunk))
+                self.zabbix_controller.delete_hosts([host_id for index, host_id in chunk])
+                ret = (True, "succeed")
+            except Exception as e:
+                ret = (False, "zabbix remove device host failure: %s" % e.message)
+                logger.error(ret[1])
+            for index, host_id in chunk:
+                results[index] = ret
+        return results
+
+    def _remove_hosts_from_actions(self, host_ids):
+        """
+        Steps 2 and 3 of remove_device_hosts().
+        """
+        # action id -> action
+        actions = {}
+        for start in range(0, len(host_ids), zabbix_config.ZABBIX_BULK_SIZE):
+            chunk = host_ids[start:start + zabbix_config.ZABBIX_BULK_SIZE]
+            logger.info("Get actions of %d hosts." % len(chunk))
+            for action in self.zabbix_controller.get_actions_by_hostids(chunk) or []:
+                actions[action["actionid"]] = action
+
+        removed = set(host_ids)
+        deletes = []
+        updates = []
+        for action_id, action in actions.items():
+            conditions = [condition for condition in action["filter"]["conditions"] \
+                          if not (condition["conditiontype"]=="1" and condition["operator"]=="0" \
+                                  and condition["value"] in removed)]
+            if self._without_host_conditions(conditions):
+                deletes.append(action_id)
+            else:
+                updates.append((action_id, conditions))
+        if updates:
+            logger.info("Update %d actions." % len(updates))
+            self.zabbix_controller.update_action_conditions(updates)
+        if deletes:
+            logger.info("Remove %d actions." % len(deletes))
+            self.zabbix_controller.delete_actions(deletes)
+
     def update_event_notification(self, host_names, username, smss, emails):
         """
         when through the page setup.
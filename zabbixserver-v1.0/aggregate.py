@@ -0,0 +1,170 @@
+import config
+import heapq
+import time
+
+from threading import Event, Lock, Thread
+from utils import get_logger
+from sender import get_sender_buffer
+
+########################################
+# Aggregator
+########################################
+
+logger = get_logger()
+
+AGGREGATE_SUFFIXES = ("min", "max", "avg", "count", "last")
+
+class Aggregator(Thread):
+    """
+    Downsample the values of some item keys over fixed windows instead of
+    forwarding every sample. 'windows' maps an item key to its window in
+    seconds, windows are aligned to the epoch and a sample goes to the
+    window of its clock, of its arrival if it has none.
+
+    A window is closed 'lateness' seconds after its end, then the
+    '<item key>.min', '.max', '.avg', '.count' and '.last' values of each
+    device are added to 'sender_buffer', stamped with the window end.
+    Samples arriving after that are sent as another aggregate of the same
+    window.
+    """
+    def __init__(self, windows, sender_buffer, tick=1, lateness=0):
+        Thread.__init__(self, name="Aggregator")
+        self.setDaemon(True)
+        self.windows = windows
+        self.sender_buffer = sender_buffer
+        self.tick = tick
+        self.lateness = lateness
+        self.lock = Lock()
+        # (window end, host, item key) -> [min, max, sum, count, last]
+        self.states = {}
+        # heap of the keys of 'states', the first window to close first
+        self.deadlines = []
+        self.stop_event = Event()
+
+    def split(self, values):
+        """
+        Tell the values of the aggregated item keys from the others,
+        without aggregating them.
+
+        Input:
+        * values: a list of item values, see sender.pack_sender_data()
+
+        Output:
+        * (aggregated, rest): the values add() would aggregate, and the
+          others
+        """
+        aggregated = []
+        rest = []
+        for value in values:
+            if value[1] in self.windows and isinstance(value[2], (int, long, float)):
+                aggregated.append(value)
+            else:
+                rest.append(value)
+        return (aggregated, rest)
+
+    def add(self, values):
+        """
+        Aggregate the values of the aggregated item keys, the others are
+        ignored.
+
+        Input:
+        * values: a list of item values, see split()
+        """
+        now = time.time()
+        self.lock.acquire()
+        try:
+            for value in values:
+                host_name, item_key, sample = value[0], value[1], value[2]
+                window = self.windows.get(item_key)
+                if window is None or not isinstance(sample, (int, long, float)):
+                    continue
+                clock = value[3] if len(value) > 3 and value[3] is not None else now
+                key = ((int(clock) / window + 1) * window, host_name, item_key)
+                state = self.states.get(key)
+                if state is None:
+                    self.states[key] = [sample, sample, sample, 1, sample]
+                    heapq.heappush(self.deadlines, key)
+                    continue
+                if sample < state[0]:
+                    state[0] = sample
+                if sample > state[1]:
+                    state[1] = sample
+                state[2] += sample
+                state[3] += 1
+                state[4] = sample
+        finally:
+            self.lock.release()
+
+    def flush(self, now=None):
+        """
+        Emit the aggregates of the windows closed at 'now', of all windows
+        if 'now' is None.
+        """
+        closed = []
+        self.lock.acquire()
+        try:
+            if now is None:
+                closed = self.states.items()
+                self.states = {}
+                self.deadlines = []
+            else:
+                # only the windows due are visited
+                deadline = now - self.lateness
+                while self.deadlines and self.deadlines[0][0] <= deadline:
+                    key = heapq.heappop(self.deadlines)
+                    closed.append((key, self.states.pop(key)))
+        finally:
+            self.lock.release()
+        if closed:
+            self._emit(closed)
+
+    def _emit(self, closed):
+        values = []
+        for (window_end, host_name, item_key), state in closed:
+            minimum, maximum, total, count, last = state
+            aggregates = (minimum, maximum, float(total) / count, count, last)
+            for suffix, aggregate in zip(AGGREGATE_SUFFIXES, aggregates):
+                values.append((host_name, "%s.%s" % (item_key, suffix), aggregate, window_end))
+        if self.sender_buffer.add(values):
+            return
+        if self.sender_buffer.spool is not None:
+            self.sender_buffer.spool.append(values)
+        else:
+            logger.error("Sender buffer is full, dropped %d aggregated values" % len(values))
+
+    def run(self):
+        logger.info("Aggregator started")
+        while not self.stop_event.is_set():
+            self.stop_event.wait(self.tick)
+            self.flush(time.time())
+        logger.info("Aggregator stopped")
+
+    def stop(self):
+        """
+        Stop and emit the windows still open.
+        """
+        self.stop_event.set()
+        if self.is_alive():
+            self.join()
+        self.flush()
+
+# single instance
+aggregator_instance = None
+aggregator_lock = Lock()
+
+def get_aggregator():
+    """
+    Get the global aggregator instance, None if no item key is aggregated.
+    """
+    if not config.AGGREGATION_WINDOWS:
+        return None
+    aggregator_lock.acquire()
+    global aggregator_instance
+    if aggregator_instance == None:
+        aggregator_instance = Aggregator(config.AGGREGATION_WINDOWS, get_sender_buffer(),
+                                         lateness=config.AGGREGATION_LATENESS)
+    aggregator_lock.release()
+    return aggregator_instance
+########################################
+# Aggregator section end
+########################################
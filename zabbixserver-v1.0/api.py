@@ -1,9 +1,10 @@
-import os
+import tornado.httpserver
 import tornado.ioloop
 import tornado.web
 import tornado.gen
-import tornado.concurrent
-import json
+import tornado.locks
+import datetime
+import time
 
 import config
 
@@ -11,14 +12,29 @@ from concurrent.futures import ThreadPoolExecutor
 from threading import Thread
 from utils import get_logger
 from db import get_device_store
-from exception import InvalidParameterException
+from sender import get_sender_buffer, new_spool_replayer
+from spool import get_spool
+from stream import JsonArrayStreamParser, NdjsonStreamParser
+from aggregate import get_aggregator
+from deadband import get_deadband_filter
+from mapping import get_item_mapping, get_record_clock
+from profiler import get_profiler, PROFILE_MODES, PROFILE_MODE_SAMPLE
+from codec import get_decoder, CONTENT_TYPE_JSON, CONTENT_TYPE_MSGPACK
+from metrics import REGISTRY, REQUESTS, REQUEST_SECONDS, STAGE_SECONDS, \
+                    CONTENT_TYPE_METRICS, Gauge, StatsGauge
+from exception import InvalidPacketException, InvalidParameterException, DBException
 
 
 API_VERSION = "v1"
 BASE_URL = "/zabbix/api/%s" % API_VERSION
 
 
-EXECUTOR = ThreadPoolExecutor(max_workers=10)
+# blocking work (DB lookups) is run on the executor, the IOLoop only waits
+# for its result
+EXECUTOR = ThreadPoolExecutor(max_workers=config.EXECUTOR_MAX_WORKERS)
+
+# the maximum number of uploads being processed at the same time
+INGEST_SEMAPHORE = tornado.locks.Semaphore(config.INGEST_MAX_CONCURRENCY)
 
 RSP_KEY_STATUS = 'status'
 RSP_KEY_MESSAGE = 'message'
@@ -32,8 +48,20 @@ RSP_STATUS_INVALID_PARAMETER = 2
 RSP_MESSAGE_SUCCESS = 'success'
 RSP_MESSAGE_FAILURE = 'failure'
 
+HTTP_ACCEPTED = 202
+HTTP_BAD_REQUEST = 400
+HTTP_FORBIDDEN = 403
+HTTP_CONFLICT = 409
+HTTP_UNSUPPORTED_MEDIA_TYPE = 415
+HTTP_TOO_MANY_REQUESTS = 429
+HTTP_SERVICE_UNAVAILABLE = 503
+# httplib of python 2 doesn't know all of them
+HTTP_REASONS = {HTTP_TOO_MANY_REQUESTS: "Too Many Requests",
+                HTTP_SERVICE_UNAVAILABLE: "Service Unavailable"}
+
 HEADER_CONTENT_TYPE = "Content-Type"
-CONTENT_TYPE_JSON = "application/json"
+HEADER_RETRY_AFTER = "Retry-After"
+CONTENT_TYPE_NDJSON = "application/x-ndjson"
 
 logger = get_logger()
 
@@ -45,15 +73,25 @@ class BaseHandler(tornado.web.RequestHandler):
         try:
             content_type = self.request.headers.get(HEADER_CONTENT_TYPE)
             if content_type != None and \
-                    content_type.lower().startswith(CONTENT_TYPE_JSON):
-                if self.request.body.strip() != "":
-                    self.json_args = json.loads(self.request.body)
-                else:
-                    self.json_args = None
+                    content_type.lower().startswith(CONTENT_TYPE_MSGPACK) and \
+                    get_decoder(content_type) is None:
+                message = "Unsupported content type: %s, msgpack is not installed" % content_type
+                logger.error(message)
+                self.set_status(HTTP_UNSUPPORTED_MEDIA_TYPE)
+                self.finish(self.make_response(RSP_STATUS_INVALID_PARAMETER, message))
+                return
+            decoder = get_decoder(content_type)
+            if decoder != None and self.request.body.strip() != "":
+                started = time.time()
+                self.json_args = decoder(self.request.body, self.request.headers)
+                STAGE_SECONDS.observe(time.time() - started, ("decode",))
             else:
                 self.json_args = None
-        except ValueError:
-            message = "Invalid request: %s" % self.request.body
+        except (ValueError, InvalidPacketException) as e:
+            if isinstance(e, InvalidPacketException):
+                message = "Invalid request: %s" % e.message
+            else:
+                message = "Invalid request: %s" % self.request.body
             log_message = "[%s] %s:%s, %s" % (self.request.remote_ip, \
                                               self.request.method, \
                                               self.request.path, \
@@ -70,6 +108,11 @@ class BaseHandler(tornado.web.RequestHandler):
             logger.info(log_message)
             raise
 
+    def on_finish(self):
+        handler = self.__class__.__name__
+        REQUESTS.inc((handler, str(self.get_status())))
+        REQUEST_SECONDS.observe(self.request.request_time(), (handler,))
+
     def make_response(self, status, message="", data=None):
         if not isinstance(status, int) or status < 0:
             raise InvalidParameterException("status")
@@ -93,6 +136,73 @@ class BaseHandler(tornado.web.RequestHandler):
 
         return response
 
+    def refuse(self, status_code, message):
+        """
+        Refuse the request as retryable, the client is asked to retry after
+        INGEST_RETRY_AFTER seconds.
+        """
+        logger.error("[%s] %s:%s refused, %s" % (self.request.remote_ip, \
+                                                 self.request.method, \
+                                                 self.request.path, \
+                                                 message))
+        self.set_status(status_code, HTTP_REASONS.get(status_code))
+        self.set_header(HEADER_RETRY_AFTER, "%d" % config.INGEST_RETRY_AFTER)
+        self.finish(self.make_response(RSP_STATUS_FAILURE, message))
+
+    @tornado.gen.coroutine
+    def acquire_ingest_slot(self):
+        """
+        Wait up to INGEST_ACQUIRE_TIMEOUT seconds for an ingest slot.
+
+        Output:
+        * slot: context manager releasing the slot, None if the request has
+          been refused
+        """
+        if get_sender_buffer().is_overloaded():
+            self.refuse(HTTP_SERVICE_UNAVAILABLE, "Ingest queue is full")
+            raise tornado.gen.Return(None)
+        try:
+            timeout = datetime.timedelta(seconds=config.INGEST_ACQUIRE_TIMEOUT)
+            slot = yield INGEST_SEMAPHORE.acquire(timeout)
+        except tornado.gen.TimeoutError:
+            self.refuse(HTTP_TOO_MANY_REQUESTS, "Too many uploads in progress")
+            raise tornado.gen.Return(None)
+        raise tornado.gen.Return(slot)
+
+    def queue_values(self, values):
+        """
+        Queue item values to be sent to zabbix together with other devices'
+        values. Values of aggregated item keys are only sent as window
+        aggregates, values the deadband filter finds unchanged are dropped.
+        Refused values leave no trace, the client retries them.
+
+        Output:
+        * accepted: False if the ingest queue is full
+        """
+        started = time.time()
+        try:
+            sender_buffer = get_sender_buffer()
+            if sender_buffer.is_overloaded():
+                return False
+            aggregated = []
+            aggregator = get_aggregator()
+            if aggregator is not None:
+                aggregated, values = aggregator.split(values)
+            deadband_filter = get_deadband_filter()
+            if deadband_filter is not None:
+                values = deadband_filter.filter(values)
+            if not sender_buffer.add(values):
+                if deadband_filter is not None:
+                    deadband_filter.forget(values)
+                return False
+            # samples are only aggregated once the upload is accepted, so
+            # a retried upload isn't counted twice
+            if aggregated:
+                aggregator.add(aggregated)
+            return True
+        finally:
+            STAGE_SECONDS.observe(time.time() - started, ("queue",))
+
     def log_request(self):
         if self.json_args:
             log_message = "[%s] %s:%s, %s" % (self.request.remote_ip, \
@@ -112,18 +222,11 @@ class DeviceDataHandler(BaseHandler):
     POST_REQUEST_KEY_EVENT = 'event'
     POST_REQUEST_KEY_ENDPOINTKEYHASH = 'endpointKeyHash'
 
-    ITEM_KEY_TDS = "device.tds"
-    ITEM_KEY_RUNNING_STATUS = "device.running_status"
-    ITEM_KEY_WATER_PURIFIED = "device.water_purified"
-    ITEM_KEY_FILTER1_LIFE_PERCENT = "device.filter1_life_percent"
-    ITEM_KEY_FILTER2_LIFE_PERCENT = "device.filter2_life_percent"
-    ITEM_KEY_FILTER3_LIFE_PERCENT = "device.filter3_life_percent"
-    ITEM_KEY_FILTER4_LIFE_PERCENT = "device.filter4_life_percent"
-    ITEM_KEY_FILTER5_LIFE_PERCENT = "device.filter5_life_percent"
-    ITEM_KEY_COLD_WATER_TEMP = "device.cold_water_temp"
-    ITEM_KEY_HOT_WATER_TEMP = "device.hot_water_temp"
-
-    @tornado.concurrent.run_on_executor
+    @staticmethod
+    def get_endpoint_key_hash(header_map):
+        return header_map[DeviceDataHandler.POST_REQUEST_KEY_ENDPOINTKEYHASH][DeviceDataHandler.DATA_TYPE_STRING]
+
+    @tornado.gen.coroutine
     def post(self):
         """
         Description: Receive and parse kaa device's data
@@ -131,6 +234,9 @@ class DeviceDataHandler(BaseHandler):
         Method: POST
         Header:
           Content-Type = application/json
+          Content-Type = application/x-msgpack, the same record as MessagePack
+          Content-Type = avro/binary, the kaa log record in avro binary
+            encoding, X-Log-Schema-Version = the record's logSchemaVersion
         Request:
         {
             "header": {
@@ -211,72 +317,331 @@ class DeviceDataHandler(BaseHandler):
           '{ "header" : { "endpointKeyHash" : { "string" : "xEmn1GGIK/AYOz8zMQFMWWmsLD4=" }, "applicationToken" : { "string" : "14020583516186638298" }, "headerVersion" : { "int" : 1 }, "timestamp" : { "long" : 1476940343424 }, "logSchemaVersion" : { "int" : 10 } }, "event" : { "inletTDS" : 150, "outletTDS" : 8, "hotWaterTemp" : 98, "coldWaterTemp" : 23, "waterPurified" : 105, "workingStatus" : 1, "failureStatus" : 0, "filterStatus" : { "filterCount" : 5, "filterList" : [ { "life" : 100, "base" : 360 }, { "life" : 200, "base" : 720 }, { "life" : 250, "base" : 720 }, { "life" : 789, "base" : 1440 }, { "life" : 567, "base" : 720 } ] }, "deviceConfig" : { "leaseConfig" : { "type" : 1, "periodStartTime" : -1, "periodEndTime" : 31535999, "volumeStart" : 0, "volumeTotal" : 100 }, "monitorPolicy" : { "periodInfo" : 0, "periodWarning" : 0, "periodCritical" : 0, "volumeInfo" : 0, "volumeWarning" : 0, "volumeCritical" : 0 }, "dataUploadInterval" : 60, "timestamp" : 1472030058 }, "timestamp" : -1 } }'
           http://localhost:11011/zabbix/api/v1/data
         """
-        def zabbix_send_data(host_name, item_key, data):
-            sender_command = "/bin/zabbix_sender -z %s -s '%s' -k %s -o %s" % (config.ZABBIX_SERVER_HOST, host_name, item_key, data)
-            logger.info("zabbix sender command: %s" % sender_command)
-            val = os.system(sender_command)
-            return val
-        def parse_data(data_map):
-            item_key_values = []
-            outletTDS = int(data_map["outletTDS"])
-            item_key_values.append({"key":DeviceDataHandler.ITEM_KEY_TDS,"value":outletTDS})
-            hotWaterTemp = int(data_map["hotWaterTemp"])
-            item_key_values.append({"key":DeviceDataHandler.ITEM_KEY_HOT_WATER_TEMP,"value":hotWaterTemp})
-            coldWaterTemp = int(data_map["coldWaterTemp"])
-            item_key_values.append({"key":DeviceDataHandler.ITEM_KEY_COLD_WATER_TEMP,"value":coldWaterTemp})
-            waterPurified = int(data_map["waterPurified"])
-            item_key_values.append({"key":DeviceDataHandler.ITEM_KEY_WATER_PURIFIED,"value":waterPurified})
-            failureStatus = int(data_map["failureStatus"])
-            item_key_values.append({"key":DeviceDataHandler.ITEM_KEY_RUNNING_STATUS,"value":failureStatus})
-
-            filter_list = data_map["filterStatus"]["filterList"]
-            filter_life_percents = []
-            for filter_one in filter_list:
-                filter_life_percent = filter_one["life"]*100/filter_one["base"]
-                filter_life_percents.append(filter_life_percent)
-            if len(filter_life_percents) == 5:
-                item_key_values.append({"key":DeviceDataHandler.ITEM_KEY_FILTER1_LIFE_PERCENT,"value":filter_life_percents[0]})
-                item_key_values.append({"key":DeviceDataHandler.ITEM_KEY_FILTER2_LIFE_PERCENT,"value":filter_life_percents[1]})
-                item_key_values.append({"key":DeviceDataHandler.ITEM_KEY_FILTER3_LIFE_PERCENT,"value":filter_life_percents[2]})
-                item_key_values.append({"key":DeviceDataHandler.ITEM_KEY_FILTER4_LIFE_PERCENT,"value":filter_life_percents[3]})
-                item_key_values.append({"key":DeviceDataHandler.ITEM_KEY_FILTER5_LIFE_PERCENT,"value":filter_life_percents[4]})
-            return item_key_values
+        def get_logical_address(hashkey):
+            started = time.time()
+            device_store = get_device_store()
+            logical_address = device_store.get_logical_address_by_hashkey(hashkey)
+            STAGE_SECONDS.observe(time.time() - started, ("lookup",))
+            return logical_address
 
         self.log_request()
 
+        slot = yield self.acquire_ingest_slot()
+        if slot is None:
+            return
+        with slot:
+            try:
+                header_map = self.json_args[DeviceDataHandler.POST_REQUEST_KEY_HEADER]
+                event_map = self.json_args[DeviceDataHandler.POST_REQUEST_KEY_EVENT]
+                endpointKeyHash = DeviceDataHandler.get_endpoint_key_hash(header_map)
+                extract = get_item_mapping().get_extractor(header_map)
+                try:
+                    logical_address = yield self.executor.submit(get_logical_address, endpointKeyHash)
+                except DBException as e:
+                    # not the device's fault, the client retries
+                    self.refuse(HTTP_SERVICE_UNAVAILABLE, "Device lookup failure: %s" % e.message)
+                    return
+                if logical_address is None:
+                    message = "Device[%s] doesn't exist" % endpointKeyHash
+                    self.finish(self.make_response(RSP_STATUS_FAILURE, message))
+                    return
+                device_host_name = logical_address
+                values = []
+                started = time.time()
+                extract(event_map, device_host_name, values, get_record_clock(header_map))
+                STAGE_SECONDS.observe(time.time() - started, ("map",))
+            except Exception as e:
+                message = "Receive and parse kaa device's data failure: %s" % e.message
+                logger.error(message)
+                self.finish(self.make_response(RSP_STATUS_FAILURE, message))
+                return
+
+            # queue data, it is sent to zabbix together with other devices' data
+            if not self.queue_values(values):
+                self.refuse(HTTP_SERVICE_UNAVAILABLE, "Ingest queue is full")
+                return
+
+        self.set_status(HTTP_ACCEPTED)
+        self.finish(self.make_response(RSP_STATUS_SUCCESS))
+
+@tornado.web.stream_request_body
+class DeviceDataBatchHandler(BaseHandler):
+    def prepare(self):
+        self.json_args = None
+        self.request.connection.set_max_body_size(config.BATCH_MAX_BODY_SIZE)
+        content_type = self.request.headers.get(HEADER_CONTENT_TYPE, "").lower()
+        if content_type.startswith(CONTENT_TYPE_NDJSON):
+            self.parser = NdjsonStreamParser()
+        elif content_type.startswith(CONTENT_TYPE_JSON):
+            self.parser = JsonArrayStreamParser()
+        else:
+            self.parser = None
+        self.error = None
+        # seconds spent decoding the body chunks
+        self.decode_time = 0.0
+        # list of (hashkey, extract, event_map, clock, error)
+        self.records = []
+
+    def data_received(self, chunk):
+        if self.parser is None or self.error is not None:
+            return
+        started = time.time()
         try:
-            header_map = self.json_args[DeviceDataHandler.POST_REQUEST_KEY_HEADER]
-            event_map = self.json_args[DeviceDataHandler.POST_REQUEST_KEY_EVENT]
-            device_store = get_device_store()
-            endpointKeyHash = header_map[DeviceDataHandler.POST_REQUEST_KEY_ENDPOINTKEYHASH][DeviceDataHandler.DATA_TYPE_STRING]
-            logical_address = device_store.get_logical_address_by_hashkey(endpointKeyHash)
-            item_key_values = parse_data(event_map)
+            for record, error in self.parser.feed(chunk):
+                self.add_record(record, error)
         except Exception as e:
-            message = "Receive and parse kaa device's data failure: %s" % e.message
+            self.error = e.message
+        self.decode_time += time.time() - started
+
+    def add_record(self, record, error):
+        if error is None:
+            try:
+                header_map = record[DeviceDataHandler.POST_REQUEST_KEY_HEADER]
+                event_map = record[DeviceDataHandler.POST_REQUEST_KEY_EVENT]
+                hashkey = DeviceDataHandler.get_endpoint_key_hash(header_map)
+                extract = get_item_mapping().get_extractor(header_map)
+                clock = get_record_clock(header_map)
+                self.records.append((hashkey, extract, event_map, clock, None))
+                return
+            except Exception as e:
+                error = e
+        self.records.append((None, None, None, None, "Parse kaa device's data failure: %s" % error.message))
+
+    @tornado.gen.coroutine
+    def post(self):
+        """
+        Description: Receive and parse a batch of kaa device's data
+        URL: {base_url}/data/batch
+        Method: POST
+        Header:
+          Content-Type = application/json, a JSON array of records
+          Content-Type = application/x-ndjson, one record per line
+        Request:
+          records in the same format as {base_url}/data, the body is parsed
+          while it is being received
+        Response:
+        {
+            "status": 0,
+            "message": "success",
+            "data": {
+                "total": 2,
+                "accepted": 1,
+                "results": [
+                    {"status": 0, "message": "success"},
+                    {"status": 1, "message": "Device[xEmn1GGIK/AYOz8zMQFMWWmsLD4=] doesn't exist"}
+                ]
+            }
+        }
+
+        Example:
+          curl -v -X POST -H "Content-type: application/x-ndjson" --data-binary @records.ndjson
+          http://localhost:11011/zabbix/api/v1/data/batch
+        """
+        def get_logical_addresses(hashkeys):
+            started = time.time()
+            device_store = get_device_store()
+            logical_addresses = device_store.get_logical_addresses_by_hashkeys(hashkeys)
+            STAGE_SECONDS.observe(time.time() - started, ("lookup",))
+            return logical_addresses
+
+        self.log_request()
+
+        if self.parser is None:
+            message = "Unsupported content type"
+            self.finish(self.make_response(RSP_STATUS_INVALID_PARAMETER, message))
+            return
+        if self.error is None:
+            started = time.time()
+            try:
+                for record, error in self.parser.close():
+                    self.add_record(record, error)
+            except Exception as e:
+                self.error = e.message
+            self.decode_time += time.time() - started
+        STAGE_SECONDS.observe(self.decode_time, ("decode",))
+        if self.error is not None:
+            message = "Receive kaa device's data batch failure: %s" % self.error
             logger.error(message)
+            self.finish(self.make_response(RSP_STATUS_INVALID_PARAMETER, message))
+            return
+
+        slot = yield self.acquire_ingest_slot()
+        if slot is None:
             return
+        with slot:
+            hashkeys = set(hashkey for hashkey, _, _, _, error in self.records if error is None)
+            try:
+                logical_addresses = yield self.executor.submit(get_logical_addresses, hashkeys)
+            except DBException as e:
+                self.refuse(HTTP_SERVICE_UNAVAILABLE, "Device lookup failure: %s" % e.message)
+                return
+            except Exception as e:
+                message = "Get devices' logical_address failure: %s" % e.message
+                logger.error(message)
+                self.finish(self.make_response(RSP_STATUS_FAILURE, message))
+                return
+
+            values = []
+            results = []
+            accepted = 0
+            started = time.time()
+            for hashkey, extract, event_map, clock, error in self.records:
+                if error is None and not logical_addresses.has_key(hashkey):
+                    error = "Device[%s] doesn't exist" % hashkey
+                if error is None:
+                    start = len(values)
+                    try:
+                        extract(event_map, logical_addresses[hashkey], values, clock)
+                    except Exception as e:
+                        del values[start:]
+                        error = "Parse kaa device's data failure: %s" % e.message
+                if error is not None:
+                    results.append({RSP_KEY_STATUS: RSP_STATUS_FAILURE, RSP_KEY_MESSAGE: error})
+                    continue
+                results.append({RSP_KEY_STATUS: RSP_STATUS_SUCCESS, RSP_KEY_MESSAGE: RSP_MESSAGE_SUCCESS})
+                accepted += 1
+            STAGE_SECONDS.observe(time.time() - started, ("map",))
+            if not self.queue_values(values):
+                self.refuse(HTTP_SERVICE_UNAVAILABLE, "Ingest queue is full")
+                return
+
+        logger.info("Receive kaa device's data batch: %d of %d records accepted" % \
+                    (accepted, len(results)))
+        data = {"total": len(results), "accepted": accepted, "results": results}
+        self.set_status(HTTP_ACCEPTED)
+        self.finish(self.make_response(RSP_STATUS_SUCCESS, data=data))
+
+class MetricsHandler(tornado.web.RequestHandler):
+    def get(self):
+        """
+        Description: Export the service metrics for prometheus
+        URL: /metrics
+        Method: GET
+        """
+        self.set_header(HEADER_CONTENT_TYPE, CONTENT_TYPE_METRICS)
+        self.finish(REGISTRY.render())
+
+class ProfileHandler(BaseHandler):
+    def prepare(self):
+        if self.request.remote_ip not in config.PROFILE_ADMIN_ALLOWED_IPS:
+            logger.error("[%s] %s:%s forbidden" % (self.request.remote_ip, \
+                                                   self.request.method, \
+                                                   self.request.path))
+            self.set_status(HTTP_FORBIDDEN)
+            self.finish(self.make_response(RSP_STATUS_FAILURE, "Forbidden"))
+
+    def get(self):
+        """
+        Description: The running profile
+        URL: /admin/profile
+        Method: GET
+        Response:
+          {"status": 0, "message": "success",
+           "data": {"mode": "sample", "duration": 30.0, "file": ".profile/sample-1234-20161020-131000.collapsed",
+                    "until": 1476940373.4}}
+          data is null when no profile is running
+        """
+        self.finish(self.make_response(RSP_STATUS_SUCCESS, data=get_profiler().running()))
 
-        # send data
-        device_host_name = logical_address
-        for item_key_value in item_key_values:
-            item_key = item_key_value["key"]
-            item_value = item_key_value["value"]
-            val = zabbix_send_data(device_host_name, item_key, item_value)
+    def post(self):
+        """
+        Description: Profile the service for a bounded window, without
+        stopping it. The output file is written when the window ends.
+        URL: /admin/profile?mode=sample&duration=30
+        Method: POST
+        Arguments:
+          * mode: 'sample' (default) samples the stacks of all threads to a
+            collapsed stack file, 'cprofile' runs cProfile on the IOLoop
+            thread to a pstats file
+          * duration: seconds, PROFILE_DEFAULT_DURATION by default, at most
+            PROFILE_MAX_DURATION
+        Response:
+          202 with the started profile, see GET; 409 if a profile is
+          already running
+        Example:
+          curl -X POST "http://127.0.0.1:1111/admin/profile?mode=cprofile&duration=60"
+        """
+        mode = self.get_argument("mode", PROFILE_MODE_SAMPLE)
+        duration = self.get_argument("duration", None)
+        try:
+            if mode not in PROFILE_MODES:
+                raise ValueError("mode must be one of %s" % ", ".join(PROFILE_MODES))
+            if duration is not None:
+                duration = float(duration)
+            status = get_profiler().start(mode, duration)
+        except ValueError as e:
+            self.set_status(HTTP_BAD_REQUEST)
+            self.finish(self.make_response(RSP_STATUS_INVALID_PARAMETER, "Invalid parameter: %s" % e))
+            return
+        if status is None:
+            self.set_status(HTTP_CONFLICT)
+            self.finish(self.make_response(RSP_STATUS_EEXIST, "A profile is already running",
+                                           data=get_profiler().running()))
+            return
+        self.set_status(HTTP_ACCEPTED)
+        self.finish(self.make_response(RSP_STATUS_SUCCESS, data=status))
+
+def register_service_metrics():
+    """
+    Register the gauges reading the state of the service components.
+    """
+    REGISTRY.register(Gauge("zabbix_ingest_executor_queue_depth",
+                            "Blocking tasks waiting for an executor thread",
+                            lambda: EXECUTOR._work_queue.qsize()))
+    REGISTRY.register(Gauge("zabbix_ingest_slots_in_use", "Uploads being processed",
+                            lambda: config.INGEST_MAX_CONCURRENCY - INGEST_SEMAPHORE._value))
+    REGISTRY.register(Gauge("zabbix_ingest_queue_depth", "Item values waiting to be sent",
+                            lambda: get_sender_buffer().size()))
+    REGISTRY.register(Gauge("zabbix_ingest_queue_overloaded", "1 while uploads are refused",
+                            lambda: int(get_sender_buffer().is_overloaded())))
+    REGISTRY.register(StatsGauge("zabbix_db_pool", "DB connection pool",
+                                 lambda: get_device_store().pool.stats()))
+    REGISTRY.register(StatsGauge("zabbix_device_cache", "Device cache",
+                                 lambda: get_device_store().cache_stats()))
+    REGISTRY.register(StatsGauge("zabbix_spool", "Spool of unsent values",
+                                 lambda: get_spool().stats()))
+    if get_deadband_filter() is not None:
+        REGISTRY.register(StatsGauge("zabbix_deadband", "Deadband filter",
+                                     lambda: get_deadband_filter().stats()))
+
+register_service_metrics()
 
 app = tornado.web.Application([
+    (r"^/metrics$", MetricsHandler),
+    (r"^/admin/profile$", ProfileHandler),
     (r"^%s/data$" % BASE_URL, DeviceDataHandler),
+    (r"^%s/data/batch$" % BASE_URL, DeviceDataBatchHandler),
     ])
 
 class APIService(Thread):
-    def __init__(self, host, port):
+    def __init__(self, host, port, sockets=None):
+        """
+        Input:
+        * host, port: the address to listen on
+        * sockets: already bound listening sockets to serve instead, they
+          are shared by the worker processes in prefork mode
+        """
         Thread.__init__(self)
         self.host = host
         self.port = port
+        self.sockets = sockets
         self.running = False
+        self.spool_replayer = new_spool_replayer()
 
     def run(self):
         logger.info("API service started")
-        app.listen(self.port, self.host)
+        # load the devices and compile the item mappings before serving uploads
+        get_device_store()
+        get_item_mapping()
+        get_sender_buffer().start()
+        if get_aggregator() is not None:
+            get_aggregator().start()
+        self.spool_replayer.start()
+        if self.sockets:
+            server = tornado.httpserver.HTTPServer(app)
+            server.add_sockets(self.sockets)
+        else:
+            app.listen(self.port, self.host)
         tornado.ioloop.IOLoop.instance().start()
 
     def start(self):
@@ -291,6 +656,11 @@ class APIService(Thread):
         self.running = False
         logger.info("Stopping API service")
         tornado.ioloop.IOLoop.instance().stop()
+        if get_aggregator() is not None:
+            get_aggregator().stop()
+        get_sender_buffer().stop()
+        self.spool_replayer.stop()
+        get_device_store().stop()
         logger.info("API service stopped")
 
 def test_myhandler():
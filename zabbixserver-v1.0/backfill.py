@@ -0,0 +1,245 @@
+import config
+import gzip
+import heapq
+import marshal
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+from utils import logger
+from api import DeviceDataHandler
+from db import get_device_store
+from mapping import get_item_mapping, get_record_clock
+from sender import get_zabbix_sender
+from stream import JsonArrayStreamParser, NdjsonStreamParser
+from exception import ZabbixSenderException
+
+READ_CHUNK_SIZE = 1024 * 1024
+SEND_RETRIES = 3
+
+class Backfill(object):
+    """
+    Load archived kaa log records into zabbix with their device timestamps.
+
+    Each file is mapped to item values like uploads are, the values are
+    sorted by time and sent in batches of 'batch_size' values, at no more
+    than 'rate' values per second. Files are streamed: the values of every
+    'run_size' records are sorted in memory and written to a temporary
+    file, and the sorted runs are merged while sending.
+    """
+    def __init__(self, sender, device_store, batch_size, rate, run_size):
+        self.sender = sender
+        self.device_store = device_store
+        self.batch_size = batch_size
+        self.rate = rate
+        self.run_size = run_size
+        self.records = 0
+        self.skipped = 0
+        self.processed = 0
+        self.failed = 0
+
+    def read_records(self, path):
+        """
+        Stream the records of an archive file, a JSON array or NDJSON if the
+        name ends with '.ndjson', optionally gzipped.
+
+        Output:
+        * records: generator of (hashkey, extract, event_map, clock)
+        """
+        name = path[:-3] if path.endswith(".gz") else path
+        if name.endswith(".ndjson"):
+            parser = NdjsonStreamParser()
+        else:
+            parser = JsonArrayStreamParser()
+        if path.endswith(".gz"):
+            fd = gzip.open(path, "rb")
+        else:
+            fd = open(path, "rb")
+        try:
+            while True:
+                chunk = fd.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                for record, error in parser.feed(chunk):
+                    record = self.check_record(record, error)
+                    if record is not None:
+                        yield record
+            for record, error in parser.close():
+                record = self.check_record(record, error)
+                if record is not None:
+                    yield record
+        finally:
+            fd.close()
+
+    def check_record(self, record, error):
+        """
+        Output:
+        * record: (hashkey, extract, event_map, clock), None if the record
+          is skipped
+        """
+        self.records += 1
+        if error is None:
+            try:
+                header_map = record[DeviceDataHandler.POST_REQUEST_KEY_HEADER]
+                event_map = record[DeviceDataHandler.POST_REQUEST_KEY_EVENT]
+                hashkey = DeviceDataHandler.get_endpoint_key_hash(header_map)
+                extract = get_item_mapping().get_extractor(header_map)
+                clock = get_record_clock(header_map)
+                if clock is not None:
+                    return (hashkey, extract, event_map, clock)
+                error = "record has no valid timestamp"
+            except Exception as e:
+                error = e.message
+        self.skipped += 1
+        logger.debug("Skip backfill record: %s" % error)
+        return None
+
+    def map_values(self, records):
+        """
+        Map records to item values.
+
+        Output:
+        * values: list of (host_name, item_key, value, clock), sorted by
+          clock
+        """
+        hashkeys = set(hashkey for hashkey, _, _, _ in records)
+        logical_addresses = self.device_store.get_logical_addresses_by_hashkeys(hashkeys)
+        values = []
+        for hashkey, extract, event_map, clock in records:
+            if not logical_addresses.has_key(hashkey):
+                self.skipped += 1
+                continue
+            start = len(values)
+            try:
+                extract(event_map, logical_addresses[hashkey], values, clock)
+            except Exception as e:
+                del values[start:]
+                self.skipped += 1
+                logger.debug("Skip backfill record: %s" % e.message)
+        values.sort(key=lambda value: value[3])
+        return values
+
+    def write_run(self, values):
+        """
+        Write sorted values to a temporary file, read back by read_run().
+        """
+        fd = tempfile.TemporaryFile()
+        for value in values:
+            marshal.dump((value[3], tuple(value)), fd)
+        fd.seek(0)
+        return fd
+
+    def read_run(self, fd):
+        """
+        Output:
+        * values: generator of (clock, value) of the run, in order
+        """
+        while True:
+            try:
+                yield marshal.load(fd)
+            except EOFError:
+                return
+
+    def sorted_values(self, path):
+        """
+        Output:
+        * values: generator of the item values of an archive file, sorted
+          by clock, at most 'run_size' records are held in memory
+        """
+        records = []
+        runs = []
+        try:
+            for record in self.read_records(path):
+                records.append(record)
+                if len(records) >= self.run_size:
+                    runs.append(self.write_run(self.map_values(records)))
+                    records = []
+            values = self.map_values(records)
+            records = []
+            if not runs:
+                for value in values:
+                    yield value
+                return
+            if values:
+                runs.append(self.write_run(values))
+            values = None
+            logger.info("Backfill [%s]: merging %d sorted runs" % (path, len(runs)))
+            for clock, value in heapq.merge(*[self.read_run(fd) for fd in runs]):
+                yield value
+        finally:
+            for fd in runs:
+                fd.close()
+
+    def load(self, path):
+        records = self.records
+        sent = 0
+        batch = []
+        for value in self.sorted_values(path):
+            batch.append(value)
+            if len(batch) >= self.batch_size:
+                self.send_batch(batch)
+                sent += len(batch)
+                batch = []
+        if batch:
+            self.send_batch(batch)
+            sent += len(batch)
+        logger.info("Backfill [%s]: %d values from %d records" % (path, sent, self.records - records))
+
+    def send_batch(self, batch):
+        started = time.time()
+        self.send(batch)
+        delay = float(len(batch)) / self.rate - (time.time() - started)
+        if delay > 0:
+            time.sleep(delay)
+
+    def send(self, batch):
+        for attempt in range(SEND_RETRIES):
+            try:
+                processed, failed, total = self.sender.send(batch)
+                self.processed += processed
+                self.failed += failed
+                return
+            except ZabbixSenderException as e:
+                logger.error("Backfill %d values failure: %s" % (len(batch), e.message))
+                if attempt < SEND_RETRIES - 1:
+                    time.sleep(config.SPOOL_RETRY_INTERVAL)
+        raise ZabbixSenderException("gave up after %d attempts" % SEND_RETRIES)
+
+def parse_command_line():
+    usage = "usage: %prog [options] file..."
+    parser = OptionParser(usage=usage)
+    parser.add_option("-b", "--batch-size", type="int", dest="batch_size",
+                      default=config.BACKFILL_BATCH_SIZE,
+                      help="Number of values sent to zabbix in one packet.")
+    parser.add_option("-r", "--rate", type="int", dest="rate",
+                      default=config.BACKFILL_RATE,
+                      help="Maximum number of values sent per second.")
+    parser.add_option("-s", "--run-size", type="int", dest="run_size",
+                      default=config.BACKFILL_RUN_SIZE,
+                      help="Number of records sorted in memory at a time.")
+
+    (options, args) = parser.parse_args()
+    if not args:
+        parser.error("no archive file given")
+    return (options, args)
+
+def main():
+    options, paths = parse_command_line()
+    backfill = Backfill(get_zabbix_sender(), get_device_store(),
+                        options.batch_size, options.rate, options.run_size)
+    status = 0
+    try:
+        # archives are named in time order
+        for path in sorted(paths):
+            backfill.load(path)
+    except Exception as e:
+        logger.error("Backfill failure: %s" % e.message)
+        status = 1
+    finally:
+        get_device_store().stop()
+    print "records: %d, skipped: %d, values processed: %d, failed: %d" % \
+          (backfill.records, backfill.skipped, backfill.processed, backfill.failed)
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""
+Avro binary writer of kaa log records, for the benchmarks: the server only
+decodes avro.
+"""
+import os
+import sys
+
+from threading import Lock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+
+from codec import load_avro_schemas, avro_type_name, FLOAT, DOUBLE
+
+class AvroEncoder(object):
+    def __init__(self):
+        self.chunks = []
+
+    def write_long(self, n):
+        n = (n << 1) ^ (n >> 63)
+        chunk = []
+        while n & ~0x7f:
+            chunk.append(chr((n & 0x7f) | 0x80))
+            n >>= 7
+        chunk.append(chr(n))
+        self.chunks.append("".join(chunk))
+
+    def write(self, data):
+        self.chunks.append(data)
+
+    def getvalue(self):
+        return "".join(self.chunks)
+
+def compile_avro_writer(schema, names=None):
+    """
+    Compile an avro schema into a function writing one datum to an
+    AvroEncoder. Union values are taken in the avro JSON form.
+    """
+    if names is None:
+        names = {}
+    if isinstance(schema, basestring) and names.has_key(schema):
+        return lambda encoder, datum: names[schema][0](encoder, datum)
+    if isinstance(schema, list):
+        branches = [(avro_type_name(branch), compile_avro_writer(branch, names)) for branch in schema]
+        def write_union(encoder, datum):
+            for index, (name, write_branch) in enumerate(branches):
+                if datum is None and name == "null":
+                    encoder.write_long(index)
+                    return
+                if isinstance(datum, dict) and datum.keys() == [name]:
+                    encoder.write_long(index)
+                    write_branch(encoder, datum[name])
+                    return
+            raise ValueError("no union branch for %s" % repr(datum))
+        return write_union
+    if isinstance(schema, dict):
+        schema_type = schema["type"]
+        if schema_type == "record":
+            holder = [None]
+            names[schema["name"]] = holder
+            fields = [(field["name"], compile_avro_writer(field["type"], names)) \
+                      for field in schema["fields"]]
+            def write_record(encoder, datum):
+                for name, write_field in fields:
+                    write_field(encoder, datum.get(name))
+            holder[0] = write_record
+            return write_record
+        if schema_type == "enum":
+            symbols = schema["symbols"]
+            names[schema["name"]] = [lambda encoder, datum: encoder.write_long(symbols.index(datum))]
+            return names[schema["name"]][0]
+        if schema_type == "fixed":
+            names[schema["name"]] = [lambda encoder, datum: encoder.write(datum)]
+            return names[schema["name"]][0]
+        if schema_type in ("array", "map"):
+            is_map = schema_type == "map"
+            write_item = compile_avro_writer(schema["items"] if not is_map else schema["values"], names)
+            def write_blocks(encoder, datum):
+                if datum:
+                    encoder.write_long(len(datum))
+                    if is_map:
+                        for key, value in datum.items():
+                            key = key.encode("utf-8")
+                            encoder.write_long(len(key))
+                            encoder.write(key)
+                            write_item(encoder, value)
+                    else:
+                        for item in datum:
+                            write_item(encoder, item)
+                encoder.write_long(0)
+            return write_blocks
+        return compile_avro_writer(schema_type, names)
+    if schema == "null":
+        return lambda encoder, datum: None
+    if schema == "boolean":
+        return lambda encoder, datum: encoder.write("\x01" if datum else "\x00")
+    if schema in ("int", "long"):
+        return lambda encoder, datum: encoder.write_long(datum)
+    if schema == "float":
+        return lambda encoder, datum: encoder.write(FLOAT.pack(datum))
+    if schema == "double":
+        return lambda encoder, datum: encoder.write(DOUBLE.pack(datum))
+    if schema in ("bytes", "string"):
+        def write_string(encoder, datum):
+            if isinstance(datum, unicode):
+                datum = datum.encode("utf-8")
+            encoder.write_long(len(datum))
+            encoder.write(datum)
+        return write_string
+    raise ValueError("unsupported avro type: %s" % schema)
+
+# log schema version -> compiled writer
+writers = None
+writers_lock = Lock()
+
+def encode_avro(record, version):
+    """
+    Encode a kaa log record with the AVRO_SCHEMA_DIR schema of 'version'.
+    """
+    writers_lock.acquire()
+    global writers
+    if writers == None:
+        writers = dict((schema_version, compile_avro_writer(schema)) for schema_version, schema \
+                       in load_avro_schemas(config.AVRO_SCHEMA_DIR).items())
+    writers_lock.release()
+    write_record = writers.get(version)
+    if write_record is None:
+        raise ValueError("unknown log schema version %s" % version)
+    encoder = AvroEncoder()
+    write_record(encoder, record)
+    return encoder.getvalue()
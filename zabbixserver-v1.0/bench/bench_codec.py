@@ -0,0 +1,51 @@
+"""
+Compare the decode cost per record of the upload payload codecs.
+
+Usage:
+  python bench/bench_codec.py [-n records]
+"""
+import json
+import os
+import sys
+import time
+
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import codec
+
+from avro_writer import encode_avro
+from payload import SAMPLE_RECORD
+
+def bench(name, decode, body, headers, records):
+    decode(body, headers)
+    start = time.time()
+    for i in xrange(records):
+        decode(body, headers)
+    elapsed = time.time() - start
+    print "%-10s %6d bytes %10.2f us/record %10d records/s" % \
+          (name, len(body), elapsed * 1000000 / records, records / elapsed)
+
+def main():
+    parser = OptionParser(usage="usage: %prog [-n records]")
+    parser.add_option("-n", "--records", type="int", dest="records", default=100000,
+                      help="the number of records decoded by each codec")
+    (options, args) = parser.parse_args()
+
+    version = SAMPLE_RECORD["header"]["logSchemaVersion"]["int"]
+    headers = {codec.HEADER_LOG_SCHEMA_VERSION: str(version)}
+    bench("json", codec.decode_json, json.dumps(SAMPLE_RECORD), headers, options.records)
+    avro_body = encode_avro(SAMPLE_RECORD, version)
+    if codec.decode_avro(avro_body, headers) != SAMPLE_RECORD:
+        print "avro round trip doesn't match the sample record"
+        sys.exit(1)
+    bench("avro", codec.decode_avro, avro_body, headers, options.records)
+    if codec.msgpack is not None:
+        bench("msgpack", codec.decode_msgpack, codec.msgpack.packb(SAMPLE_RECORD), headers,
+              options.records)
+    else:
+        print "msgpack is not installed, skipped"
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+"""
+Load the ingest service with simulated devices and report throughput,
+latency and server CPU per request.
+
+The service runs in a child process with a SQLite device table and a
+local fake zabbix trapper, the load is generated open loop: requests are
+scheduled at the devices' upload rate and their latency counts from the
+scheduled time, so a slow service can't slow the load down.
+
+Usage:
+  python bench/bench_ingest.py [options]
+"""
+import json
+import multiprocessing
+import os
+import re
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+
+from payload import FORMATS, PayloadGenerator
+from fake_trapper import FakeTrapper
+
+TICK = 0.01
+
+STAGE_PATTERN = re.compile(r'^zabbix_ingest_stage_seconds_(sum|count)\{stage="(\w+)"\} (\S+)$')
+
+def run_service(options, workdir, trapper_port, pipe):
+    """
+    The service process, it answers 'usage' and 'stop' commands on 'pipe'
+    with its CPU seconds.
+    """
+    import logging
+    import utils
+    utils.get_logger()
+    utils.set_log_level(logging.WARNING)
+
+    import fake_db
+    config.ZABBIX_SERVER_HOST = "127.0.0.1"
+    config.ZABBIX_SERVER_PORT = trapper_port
+    config.SPOOL_DIR = os.path.join(workdir, "spool")
+    config.DEVICE_STORE_MODE = options.store_mode
+    config.DEVICE_MIRROR_SNAPSHOT_FILE = os.path.join(workdir, "snapshot")
+    config.DEADBAND_ENABLED = options.deadband
+    fake_db.install(os.path.join(workdir, "device.db"), options.devices, config.DB_POOL_SIZE)
+
+    import api
+    service = api.APIService("127.0.0.1", options.port)
+    service.setDaemon(True)
+    service.start()
+    while True:
+        command = pipe.recv()
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        if command == "stop":
+            service.stop()
+            pipe.send(usage.ru_utime + usage.ru_stime)
+            return
+        pipe.send(usage.ru_utime + usage.ru_stime)
+
+def wait_for_service(port, timeout=30):
+    import socket
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), 1).close()
+            return
+        except socket.error:
+            time.sleep(0.1)
+    raise Exception("the service didn't start in %d seconds" % timeout)
+
+class LoadGenerator(object):
+    def __init__(self, options):
+        import tornado.httpclient
+        import tornado.ioloop
+        self.options = options
+        self.ioloop = tornado.ioloop.IOLoop.instance()
+        self.client = tornado.httpclient.AsyncHTTPClient(max_clients=options.concurrency)
+        self.generator = PayloadGenerator(options.devices)
+        self.records = max(options.batch, 1)
+        # requests per second
+        self.rate = float(options.devices) / options.interval / self.records
+        if options.batch:
+            self.url = "http://127.0.0.1:%d/zabbix/api/v1/data/batch" % options.port
+        else:
+            self.url = "http://127.0.0.1:%d/zabbix/api/v1/data" % options.port
+        self.next_device = 0
+        self.scheduled = 0
+        self.in_flight = 0
+        self.recording = False
+        self.latencies = []
+        self.codes = {}
+
+    def request(self, scheduled_time):
+        import tornado.httpclient
+        records = []
+        for i in range(self.records):
+            records.append(self.generator.record(self.next_device))
+            self.next_device = (self.next_device + 1) % self.options.devices
+        if self.options.batch:
+            body, headers = self.generator.encode_batch(records)
+        else:
+            body, headers = self.generator.encode(records[0], self.options.format)
+        request = tornado.httpclient.HTTPRequest(self.url, method="POST", body=body,
+                                                 headers=headers, request_timeout=60)
+        recording = self.recording
+        self.in_flight += 1
+
+        def done(response):
+            self.in_flight -= 1
+            if recording:
+                self.latencies.append(time.time() - scheduled_time)
+                self.codes[response.code] = self.codes.get(response.code, 0) + 1
+        self.client.fetch(request, done, raise_error=False)
+
+    def run(self, warmup, duration, on_record):
+        """
+        Schedule requests for 'warmup' seconds, then for 'duration' seconds
+        recording them, 'on_record' is called when the recording starts.
+
+        Output:
+        * elapsed: seconds the recorded requests were scheduled over
+        """
+        start = time.time()
+        state = {"recording_start": start + warmup}
+
+        def tick():
+            now = time.time()
+            if not self.recording and now >= state["recording_start"]:
+                self.recording = True
+                state["recording_start"] = now
+                on_record()
+            if now >= state["recording_start"] + duration and self.recording:
+                self.recording = False
+                state["recording_end"] = now
+                self.ioloop.add_callback(drain)
+                return
+            due = int((now - start) * self.rate)
+            while self.scheduled < due:
+                self.scheduled += 1
+                self.request(start + self.scheduled / self.rate)
+            self.ioloop.call_later(TICK, tick)
+
+        def drain():
+            if self.in_flight == 0 or time.time() > state["recording_end"] + 60:
+                self.ioloop.stop()
+                return
+            self.ioloop.call_later(TICK, drain)
+
+        self.ioloop.add_callback(tick)
+        self.ioloop.start()
+        return state["recording_end"] - state["recording_start"]
+
+def fetch_stage_times(port):
+    """
+    Output:
+    * stages: {stage: (count, mean seconds)} from the service metrics
+    """
+    import urllib2
+    sums = {}
+    counts = {}
+    text = urllib2.urlopen("http://127.0.0.1:%d/metrics" % port, timeout=10).read()
+    for line in text.splitlines():
+        match = STAGE_PATTERN.match(line)
+        if match:
+            kind, stage, value = match.groups()
+            if kind == "sum":
+                sums[stage] = float(value)
+            else:
+                counts[stage] = int(value)
+    return dict((stage, (counts[stage], sums[stage] / counts[stage])) \
+                for stage in counts if counts[stage])
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+def parse_command_line():
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option("-n", "--devices", type="int", dest="devices", default=1000,
+                      help="number of simulated devices")
+    parser.add_option("-i", "--interval", type="float", dest="interval", default=10,
+                      help="seconds between two uploads of a device")
+    parser.add_option("-t", "--duration", type="float", dest="duration", default=30,
+                      help="seconds of recorded load")
+    parser.add_option("-w", "--warmup", type="float", dest="warmup", default=3,
+                      help="seconds of load before recording")
+    parser.add_option("-c", "--concurrency", type="int", dest="concurrency", default=100,
+                      help="maximum requests in flight")
+    parser.add_option("-b", "--batch", type="int", dest="batch", default=0,
+                      help="records per /data/batch request, 0 posts single records to /data")
+    parser.add_option("-f", "--format", dest="format", default="json",
+                      help="single record body format: %s" % ", ".join(FORMATS))
+    parser.add_option("-s", "--store-mode", dest="store_mode", default=config.DEVICE_STORE_MODE,
+                      help="device store mode: cache or mirror")
+    parser.add_option("--deadband", action="store_true", dest="deadband",
+                      default=config.DEADBAND_ENABLED,
+                      help="drop the values the deadband filter finds unchanged")
+    parser.add_option("-p", "--port", type="int", dest="port", default=18011,
+                      help="port of the benchmarked service")
+    parser.add_option("-o", "--output", dest="output",
+                      help="also write the results as JSON to this file")
+    (options, args) = parser.parse_args()
+    if options.format not in FORMATS:
+        parser.error("unknown format %s" % options.format)
+    if options.batch and options.format != "json":
+        parser.error("batches are NDJSON only")
+    return options
+
+def main():
+    options = parse_command_line()
+    workdir = tempfile.mkdtemp(prefix="bench-ingest-")
+    trapper = FakeTrapper()
+    trapper.start()
+    pipe, child_pipe = multiprocessing.Pipe()
+    service = multiprocessing.Process(target=run_service,
+                                      args=(options, workdir, trapper.port, child_pipe))
+    service.start()
+    try:
+        wait_for_service(options.port)
+        load = LoadGenerator(options)
+        usage = {}
+
+        def on_record():
+            pipe.send("usage")
+            usage["start"] = pipe.recv()
+            usage["values"] = trapper.value_count
+            usage["client"] = cpu_seconds()
+        elapsed = load.run(options.warmup, options.duration, on_record)
+        client_cpu = cpu_seconds() - usage["client"]
+        stages = fetch_stage_times(options.port)
+        pipe.send("usage")
+        cpu = pipe.recv() - usage["start"]
+        values = trapper.value_count - usage["values"]
+        pipe.send("stop")
+        pipe.recv()
+    finally:
+        service.join(30)
+        if service.is_alive():
+            service.terminate()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    latencies = sorted(load.latencies)
+    requests = len(latencies)
+    succeeded = sum(count for code, count in load.codes.items() if 200 <= code < 300)
+    results = {"devices": options.devices,
+               "interval": options.interval,
+               "batch": options.batch,
+               "format": options.format,
+               "offered_rate": load.rate,
+               "requests": requests,
+               "succeeded": succeeded,
+               "codes": dict((str(code), count) for code, count in load.codes.items()),
+               "throughput": requests / elapsed,
+               "records_per_second": requests * load.records / elapsed,
+               "values_per_second": values / elapsed,
+               "latency_p50": percentile(latencies, 0.5),
+               "latency_p99": percentile(latencies, 0.99),
+               "latency_max": latencies[-1] if latencies else 0.0,
+               "cpu_seconds": cpu,
+               "cpu_utilization": cpu / elapsed,
+               "cpu_per_request": cpu / requests if requests else 0.0,
+               "client_cpu_utilization": client_cpu / elapsed,
+               "stages": stages}
+
+    print "offered:      %.1f req/s (%d devices every %gs, %d records/request)" % \
+          (load.rate, options.devices, options.interval, load.records)
+    print "requests:     %d, succeeded: %d, codes: %s" % \
+          (requests, succeeded, results["codes"])
+    print "throughput:   %.1f req/s, %.1f records/s, %.1f values/s to zabbix" % \
+          (results["throughput"], results["records_per_second"], results["values_per_second"])
+    print "latency:      p50 %.2f ms, p99 %.2f ms, max %.2f ms" % \
+          (results["latency_p50"] * 1000, results["latency_p99"] * 1000,
+           results["latency_max"] * 1000)
+    print "server cpu:   %.2f s, %.0f%% of a core, %.3f ms/request" % \
+          (cpu, results["cpu_utilization"] * 100, results["cpu_per_request"] * 1000)
+    print "client cpu:   %.0f%% of a core" % (results["client_cpu_utilization"] * 100)
+    if results["cpu_utilization"] + results["client_cpu_utilization"] > 0.8 * multiprocessing.cpu_count():
+        print "warning:      client and service compete for %d cpu(s), latencies include " \
+              "cpu queueing" % multiprocessing.cpu_count()
+    # whole run, warmup included
+    for stage, (count, mean) in sorted(stages.items()):
+        print "stage %-7s %8d times, mean %.3f ms" % (stage + ":", count, mean * 1000)
+    if options.output:
+        fd = open(options.output, "w")
+        json.dump(results, fd, indent=4, sort_keys=True)
+        fd.close()
+
+if __name__ == "__main__":
+    main()
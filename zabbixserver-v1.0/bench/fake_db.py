@@ -0,0 +1,71 @@
+"""
+A SQLite stand-in for the MySQL 'device' table. The connection pool keeps
+its checkout logic, only the connections are SQLite ones, so the device
+store and its cache run unchanged.
+"""
+import sqlite3
+import time
+
+import db
+
+from payload import device_hashkey, device_logical_address
+
+class SqliteCursor(object):
+    def __init__(self, conn):
+        self.cursor = conn.cursor()
+
+    def execute(self, operation, params=None):
+        self.cursor.execute(operation.replace("%s", "?"), params or ())
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def close(self):
+        self.cursor.close()
+
+class SqliteConnection(object):
+    def __init__(self, path):
+        # a pool connection is used by one thread at a time
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+
+    def cursor(self, prepared=False):
+        return SqliteCursor(self.conn)
+
+    def commit(self):
+        self.conn.commit()
+
+    def is_connected(self):
+        return True
+
+    def close(self):
+        self.conn.close()
+
+class SqlitePool(db.ConnectionPool):
+    def __init__(self, path, size):
+        db.ConnectionPool.__init__(self, size, 5, 30, 1, 60)
+        self.path = path
+
+    def _connect(self):
+        return SqliteConnection(self.path)
+
+def create_device_table(path, devices):
+    """
+    Create the 'device' table with 'devices' online devices.
+    """
+    conn = sqlite3.connect(path)
+    conn.execute("drop table if exists device")
+    conn.execute("create table device (device_hash_key text primary key, "
+                 "logical_address text, status integer, update_time integer)")
+    now = int(time.time())
+    conn.executemany("insert into device values (?, ?, ?, ?)",
+                     ((device_hashkey(i), device_logical_address(i), db.DEVICE_STATUS_ONLINE, now) \
+                      for i in xrange(devices)))
+    conn.commit()
+    conn.close()
+
+def install(path, devices, pool_size):
+    """
+    Make the device store use a SQLite device table of 'devices' devices.
+    """
+    create_device_table(path, devices)
+    db.db_pool = SqlitePool(path, pool_size)
@@ -0,0 +1,94 @@
+"""
+A local stand-in for the zabbix trapper: it acknowledges every sender data
+packet as processed and counts what it received.
+
+Usage:
+  python bench/fake_trapper.py [-p port]
+"""
+import json
+import os
+import socket
+import struct
+import sys
+import time
+
+from optparse import OptionParser
+from threading import Lock, Thread
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sender import ZBX_HEADER, ZBX_HEADER_LENGTH
+
+class FakeTrapper(Thread):
+    def __init__(self, host="127.0.0.1", port=0, keep_packets=False):
+        Thread.__init__(self, name="FakeTrapper")
+        self.setDaemon(True)
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen(128)
+        self.port = self.server.getsockname()[1]
+        self.keep_packets = keep_packets
+        self.lock = Lock()
+        self.packets = []
+        self.packet_count = 0
+        self.value_count = 0
+
+    def run(self):
+        while True:
+            conn, address = self.server.accept()
+            handler = Thread(target=self.handle, args=(conn,))
+            handler.setDaemon(True)
+            handler.start()
+
+    def handle(self, conn):
+        try:
+            header = self._recv_exactly(conn, ZBX_HEADER_LENGTH)
+            if not header.startswith(ZBX_HEADER):
+                return
+            length = struct.unpack("<Q", header[len(ZBX_HEADER):])[0]
+            request = json.loads(self._recv_exactly(conn, length))
+            count = len(request.get("data", []))
+            self.lock.acquire()
+            self.packet_count += 1
+            self.value_count += count
+            if self.keep_packets:
+                self.packets.append(request)
+            self.lock.release()
+            body = json.dumps({"response": "success",
+                               "info": "processed: %d; failed: 0; total: %d; seconds spent: 0.000001" % \
+                                       (count, count)})
+            conn.sendall(ZBX_HEADER + struct.pack("<Q", len(body)) + body)
+        except (socket.error, ValueError):
+            pass
+        finally:
+            conn.close()
+
+    def _recv_exactly(self, conn, length):
+        chunks = []
+        received = 0
+        while received < length:
+            chunk = conn.recv(length - received)
+            if not chunk:
+                raise socket.error("connection closed")
+            chunks.append(chunk)
+            received += len(chunk)
+        return "".join(chunks)
+
+def main():
+    parser = OptionParser(usage="usage: %prog [-p port]")
+    parser.add_option("-p", "--port", type="int", dest="port", default=10051,
+                      help="the port to listen on")
+    (options, args) = parser.parse_args()
+    trapper = FakeTrapper("0.0.0.0", options.port)
+    trapper.start()
+    print "Fake trapper listening on %d" % trapper.port
+    try:
+        while True:
+            time.sleep(10)
+            print "packets: %d, values: %d" % (trapper.packet_count, trapper.value_count)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Synthetic kaa log records of simulated devices.
+"""
+import copy
+import json
+import random
+import time
+
+import codec
+
+from avro_writer import encode_avro
+
+SAMPLE_RECORD = {
+    "header": {
+        "endpointKeyHash": {"string": "xEmn1GGIK/AYOz8zMQFMWWmsLD4="},
+        "applicationToken": {"string": "14020583516186638298"},
+        "headerVersion": {"int": 1},
+        "timestamp": {"long": 1476940343424},
+        "logSchemaVersion": {"int": 10}
+    },
+    "event": {
+        "inletTDS": 150,
+        "outletTDS": 8,
+        "hotWaterTemp": 98,
+        "coldWaterTemp": 23,
+        "waterPurified": 105,
+        "workingStatus": 1,
+        "failureStatus": 0,
+        "filterStatus": {
+            "filterCount": 5,
+            "filterList": [
+                {"life": 100, "base": 360},
+                {"life": 200, "base": 720},
+                {"life": 250, "base": 720},
+                {"life": 789, "base": 1440},
+                {"life": 567, "base": 720}
+            ]
+        },
+        "deviceConfig": {
+            "leaseConfig": {
+                "type": 1,
+                "periodStartTime": -1,
+                "periodEndTime": 31535999,
+                "volumeStart": 0,
+                "volumeTotal": 100
+            },
+            "monitorPolicy": {
+                "periodInfo": 0,
+                "periodWarning": 0,
+                "periodCritical": 0,
+                "volumeInfo": 0,
+                "volumeWarning": 0,
+                "volumeCritical": 0
+            },
+            "dataUploadInterval": 60,
+            "timestamp": 1472030058
+        },
+        "timestamp": -1
+    }
+}
+
+FORMATS = ("json", "msgpack", "avro")
+
+CONTENT_TYPES = {"json": codec.CONTENT_TYPE_JSON,
+                 "msgpack": codec.CONTENT_TYPE_MSGPACK,
+                 "avro": codec.CONTENT_TYPE_AVRO}
+
+def device_hashkey(index):
+    return "bench-device-%08d" % index
+
+def device_logical_address(index):
+    return "BENCH-%08d" % index
+
+class PayloadGenerator(object):
+    """
+    Records of 'devices' simulated devices. Readings drift a little
+    between uploads of the same device, like real ones do.
+    """
+    def __init__(self, devices, seed=0):
+        self.devices = devices
+        self.random = random.Random(seed)
+        # device index -> its last event
+        self.events = {}
+
+    def record(self, index):
+        event = self.events.get(index)
+        if event is None:
+            event = copy.deepcopy(SAMPLE_RECORD["event"])
+            event["outletTDS"] = self.random.randint(5, 20)
+            self.events[index] = event
+        elif self.random.random() < 0.3:
+            event["outletTDS"] = max(0, event["outletTDS"] + self.random.randint(-2, 2))
+            event["hotWaterTemp"] = self.random.randint(90, 99)
+            event["coldWaterTemp"] = self.random.randint(15, 25)
+            event["waterPurified"] += self.random.randint(0, 3)
+            for element in event["filterStatus"]["filterList"]:
+                element["life"] = max(0, element["life"] - self.random.randint(0, 1))
+        header = dict(SAMPLE_RECORD["header"])
+        header["endpointKeyHash"] = {"string": device_hashkey(index)}
+        header["timestamp"] = {"long": int(time.time() * 1000)}
+        return {"header": header, "event": event}
+
+    def encode(self, record, format):
+        """
+        Output:
+        * (body, headers): the request body and headers of 'record'
+        """
+        headers = {"Content-Type": CONTENT_TYPES[format]}
+        if format == "json":
+            return (json.dumps(record), headers)
+        if format == "msgpack":
+            return (codec.msgpack.packb(record), headers)
+        version = record["header"]["logSchemaVersion"]["int"]
+        headers[codec.HEADER_LOG_SCHEMA_VERSION] = str(version)
+        return (encode_avro(record, version), headers)
+
+    def encode_batch(self, records):
+        return ("\n".join(json.dumps(record) for record in records),
+                {"Content-Type": "application/x-ndjson"})
@@ -0,0 +1,266 @@
+import config
+import json
+import os
+import re
+import struct
+
+from threading import Lock
+from utils import get_logger
+from exception import InvalidPacketException
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+########################################
+# Payload codecs
+########################################
+
+logger = get_logger()
+
+CONTENT_TYPE_JSON = "application/json"
+CONTENT_TYPE_MSGPACK = "application/x-msgpack"
+CONTENT_TYPE_AVRO = "avro/binary"
+
+# the avro binary encoding doesn't carry its schema
+HEADER_LOG_SCHEMA_VERSION = "X-Log-Schema-Version"
+
+AVRO_SCHEMA_FILE_PATTERN = re.compile(r"^(\d+)\.avsc$")
+
+FLOAT = struct.Struct("<f")
+DOUBLE = struct.Struct("<d")
+
+class AvroDecoder(object):
+    def __init__(self, data):
+        self.data = data
+        # indexing a bytearray gives ints, no ord() per byte
+        self.octets = bytearray(data)
+        self.pos = 0
+
+    def read_long(self):
+        pos = self.pos
+        b = self.octets[pos]
+        if b < 0x80:
+            # most values fit in one byte
+            self.pos = pos + 1
+            return (b >> 1) ^ -(b & 1)
+        octets = self.octets
+        n = b & 0x7f
+        shift = 7
+        while b & 0x80:
+            pos += 1
+            b = octets[pos]
+            n |= (b & 0x7f) << shift
+            shift += 7
+        self.pos = pos + 1
+        return (n >> 1) ^ -(n & 1)
+
+    def read(self, length):
+        if length < 0:
+            raise InvalidPacketException("negative avro length %d" % length)
+        start = self.pos
+        self.pos += length
+        if self.pos > len(self.data):
+            raise InvalidPacketException("truncated avro data")
+        return self.data[start:self.pos]
+
+def avro_type_name(schema):
+    if isinstance(schema, dict):
+        if schema.has_key("name"):
+            return schema["name"]
+        return schema["type"]
+    if isinstance(schema, list):
+        return "union"
+    return schema
+
+def compile_avro_reader(schema, names=None):
+    """
+    Compile an avro schema into a function reading one datum from an
+    AvroDecoder. Union values are wrapped as {type name: value} like the
+    avro JSON encoding, so decoded kaa records look the same as the JSON
+    ones.
+    """
+    if names is None:
+        names = {}
+    if isinstance(schema, basestring) and names.has_key(schema):
+        return lambda decoder: names[schema][0](decoder)
+    if isinstance(schema, list):
+        branches = [(avro_type_name(branch), compile_avro_reader(branch, names)) for branch in schema]
+        def read_union(decoder):
+            index = decoder.read_long()
+            if not 0 <= index < len(branches):
+                raise InvalidPacketException("invalid avro union index %d" % index)
+            name, read_branch = branches[index]
+            value = read_branch(decoder)
+            if name == "null":
+                return None
+            return {name: value}
+        return read_union
+    if isinstance(schema, dict):
+        schema_type = schema["type"]
+        if schema_type == "record":
+            # register first, a record may refer to itself
+            holder = [None]
+            names[schema["name"]] = holder
+            fields = [(field["name"], compile_avro_reader(field["type"], names)) \
+                      for field in schema["fields"]]
+            def read_record(decoder):
+                record = {}
+                for name, read_field in fields:
+                    record[name] = read_field(decoder)
+                return record
+            holder[0] = read_record
+            return read_record
+        if schema_type == "enum":
+            symbols = schema["symbols"]
+            def read_enum(decoder):
+                index = decoder.read_long()
+                if not 0 <= index < len(symbols):
+                    raise InvalidPacketException("invalid avro enum index %d" % index)
+                return symbols[index]
+            names[schema["name"]] = [read_enum]
+            return read_enum
+        if schema_type == "fixed":
+            size = schema["size"]
+            names[schema["name"]] = [lambda decoder: decoder.read(size)]
+            return names[schema["name"]][0]
+        if schema_type in ("array", "map"):
+            is_map = schema_type == "map"
+            read_item = compile_avro_reader(schema["items"] if not is_map else schema["values"], names)
+            def read_blocks(decoder):
+                items = {} if is_map else []
+                count = decoder.read_long()
+                while count != 0:
+                    if count < 0:
+                        count = -count
+                        # block size in bytes, not needed
+                        decoder.read_long()
+                    # each item takes at least one byte, a bigger count
+                    # can't be honest
+                    if count > len(decoder.data) - decoder.pos:
+                        raise InvalidPacketException("avro block of %d items in %d bytes" % \
+                                                     (count, len(decoder.data) - decoder.pos))
+                    for i in xrange(count):
+                        if is_map:
+                            key = decoder.read(decoder.read_long()).decode("utf-8")
+                            items[key] = read_item(decoder)
+                        else:
+                            items.append(read_item(decoder))
+                    count = decoder.read_long()
+                return items
+            return read_blocks
+        return compile_avro_reader(schema_type, names)
+    if schema == "null":
+        return lambda decoder: None
+    if schema == "boolean":
+        return lambda decoder: decoder.read(1) != "\x00"
+    if schema in ("int", "long"):
+        return AvroDecoder.read_long
+    if schema == "float":
+        return lambda decoder: FLOAT.unpack(decoder.read(4))[0]
+    if schema == "double":
+        return lambda decoder: DOUBLE.unpack(decoder.read(8))[0]
+    if schema == "bytes":
+        return lambda decoder: decoder.read(decoder.read_long())
+    if schema == "string":
+        return lambda decoder: decoder.read(decoder.read_long()).decode("utf-8")
+    raise InvalidPacketException("unsupported avro type: %s" % schema)
+
+def load_avro_schemas(directory):
+    """
+    Input:
+    * directory: the directory of the '<logSchemaVersion>.avsc' files,
+      relative to the server directory if not absolute
+
+    Output:
+    * schemas: dict of log schema version to the parsed schema
+    """
+    schemas = {}
+    if not os.path.isabs(directory):
+        directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), directory)
+    for name in sorted(os.listdir(directory)):
+        match = AVRO_SCHEMA_FILE_PATTERN.match(name)
+        if not match:
+            continue
+        fd = open(os.path.join(directory, name), "r")
+        schemas[int(match.group(1))] = json.load(fd)
+        fd.close()
+    return schemas
+
+class AvroSchemas(object):
+    """
+    The kaa log record schemas, one '<logSchemaVersion>.avsc' file each,
+    compiled once at load.
+    """
+    def __init__(self, directory):
+        self.readers = {}
+        for version, schema in load_avro_schemas(directory).items():
+            self.readers[version] = compile_avro_reader(schema)
+        logger.debug("Avro log schemas loaded: %s" % sorted(self.readers.keys()))
+
+    def decode(self, data, version):
+        read_record = self.readers.get(version)
+        if read_record is None:
+            raise InvalidPacketException("unknown log schema version %s" % version)
+        decoder = AvroDecoder(data)
+        try:
+            record = read_record(decoder)
+        except IndexError:
+            raise InvalidPacketException("truncated avro data")
+        if decoder.pos != len(data):
+            raise InvalidPacketException("%d bytes of extra data after the avro record" % \
+                                         (len(data) - decoder.pos))
+        return record
+
+# single instance
+avro_schemas_instance = None
+avro_schemas_lock = Lock()
+
+def get_avro_schemas():
+    """
+    Get the global avro log schemas instance.
+    """
+    avro_schemas_lock.acquire()
+    global avro_schemas_instance
+    if avro_schemas_instance == None:
+        avro_schemas_instance = AvroSchemas(config.AVRO_SCHEMA_DIR)
+    avro_schemas_lock.release()
+    return avro_schemas_instance
+
+def decode_json(body, headers):
+    return json.loads(body)
+
+def decode_msgpack(body, headers):
+    try:
+        return msgpack.unpackb(body)
+    except Exception as e:
+        raise InvalidPacketException(str(e))
+
+def decode_avro(body, headers):
+    try:
+        version = int(headers.get(HEADER_LOG_SCHEMA_VERSION))
+    except (TypeError, ValueError):
+        raise InvalidPacketException("missing %s header" % HEADER_LOG_SCHEMA_VERSION)
+    return get_avro_schemas().decode(body, version)
+
+DECODERS = {CONTENT_TYPE_JSON: decode_json,
+            CONTENT_TYPE_AVRO: decode_avro}
+if msgpack is not None:
+    DECODERS[CONTENT_TYPE_MSGPACK] = decode_msgpack
+
+def get_decoder(content_type):
+    """
+    Input:
+    * content_type: the request content type
+
+    Output:
+    * decoder: function(body, headers) returning the decoded record, None
+      if the content type isn't supported
+    """
+    if content_type is None:
+        return None
+    return DECODERS.get(content_type.split(";")[0].strip().lower())
+########################################
+# Payload codecs section end
+########################################
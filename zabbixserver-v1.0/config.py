@@ -7,8 +7,122 @@ LOG_SYSERR_FORMAT = '%(asctime)s: %(message)s'
 
 WEB_SERVICE_HOST = ""
 WEB_SERVICE_PORT = 1111
+# worker processes sharing the listening socket, 1 runs the service in the
+# server process itself
+WEB_SERVICE_WORKERS = 1
+# seconds to wait before restarting a worker that died
+WORKER_RESTART_DELAY = 1
+
+# ingest: at most INGEST_MAX_CONCURRENCY uploads are processed at the same
+# time, blocking DB lookups run on EXECUTOR_MAX_WORKERS threads
+INGEST_MAX_CONCURRENCY = 5000
+EXECUTOR_MAX_WORKERS = 10
+# seconds an upload waits for a free ingest slot before it's refused with 429
+INGEST_ACQUIRE_TIMEOUT = 1
+
+# ingest queue between request parsing and sending to zabbix, in values.
+# Uploads are refused with 503 once HIGH_WATERMARK values are queued, until
+# the queue has drained below LOW_WATERMARK
+INGEST_QUEUE_CAPACITY = 200000
+INGEST_QUEUE_HIGH_WATERMARK = 150000
+INGEST_QUEUE_LOW_WATERMARK = 100000
+# seconds a refused client is asked to wait before retrying
+INGEST_RETRY_AFTER = 5
+
+# the maximum body size of a batch upload, in bytes
+BATCH_MAX_BODY_SIZE = 64 * 1024 * 1024
+# the maximum size of one record of a batch upload, in bytes
+BATCH_MAX_RECORD_SIZE = 1024 * 1024
+
+# the avro schemas of kaa log records, '<logSchemaVersion>.avsc' files,
+# relative to the server directory
+AVRO_SCHEMA_DIR = 'schemas'
+
+# kaa event fields sent to zabbix as items, by logSchemaVersion
+# * key: the zabbix item key
+# * field: the dotted path of the event field
+# * percent: (part, base) fields of each element of a list field, the
+#   item key then has a '%d' for the element's position, from 1
+ITEM_MAPPINGS = {
+    10: [
+        {"key": "device.tds", "field": "outletTDS"},
+        {"key": "device.hot_water_temp", "field": "hotWaterTemp"},
+        {"key": "device.cold_water_temp", "field": "coldWaterTemp"},
+        {"key": "device.water_purified", "field": "waterPurified"},
+        {"key": "device.running_status", "field": "failureStatus"},
+        {"key": "device.filter%d_life_percent", "field": "filterStatus.filterList",
+         "percent": ("life", "base")},
+    ],
+}
+
+# forward an item value to zabbix only when it changed by more than the
+# absolute or relative deadband since the last forwarded value of the same
+# device item, or after HEARTBEAT seconds without forwarding it. With both
+# deadbands 0 any change is forwarded. Each worker process has its own
+# last values, so in prefork mode the heartbeat bounds a missed change.
+# Off by default: once enabled, unchanged values are no longer sent, so
+# zabbix nodata() triggers shorter than HEARTBEAT fire on quiet devices.
+DEADBAND_ENABLED = False
+DEADBAND_ABSOLUTE = 0
+DEADBAND_RELATIVE = 0.0
+DEADBAND_HEARTBEAT = 300
+# per item key deadbands: {"device.tds": (absolute, relative)}
+DEADBAND_ITEMS = {}
+
+# values are stored in zabbix with the kaa record's header.timestamp, unless
+# the device clock is more than this many seconds ahead
+DEVICE_CLOCK_MAX_SKEW = 300
+
+# item keys downsampled over a window of seconds instead of forwarded as raw
+# samples: {"device.tds": 60}. At window close '<item key>.min', '.max',
+# '.avg', '.count' and '.last' are sent, these items must exist in zabbix.
+# Each worker process aggregates the samples it received, by their device
+# clock.
+AGGREGATION_WINDOWS = {}
+# seconds a window stays open after its end for late samples, the later
+# ones are sent as another aggregate of the window
+AGGREGATION_LATENESS = 5
 
 ZABBIX_SERVER_HOST = '192.168.1.1'
+ZABBIX_SERVER_PORT = 10051
+# seconds
+ZABBIX_SENDER_TIMEOUT = 5
+
+# sender buffer: flush one packet every FLUSH_INTERVAL milliseconds or
+# FLUSH_SIZE values, whichever comes first
+SENDER_BUFFER_FLUSH_SIZE = 1000
+SENDER_BUFFER_FLUSH_INTERVAL = 200
+SENDER_BUFFER_MAX_IN_FLIGHT = 4
+
+# spool of values that failed to be sent, replayed once zabbix is back
+SPOOL_DIR = '.spool'
+SPOOL_SEGMENT_SIZE = 16 * 1024 * 1024
+SPOOL_MAX_SIZE = 1024 * 1024 * 1024
+# values per second
+SPOOL_REPLAY_RATE = 5000
+# seconds
+SPOOL_RETRY_INTERVAL = 10
+# sends of a spooled record the trapper doesn't accept, e.g. a 'failed'
+# response, before it is dropped. Unreachable trappers are retried forever
+SPOOL_REPLAY_MAX_ATTEMPTS = 3
+
+# backfill.py: values per trapper packet, and values sent per second
+BACKFILL_BATCH_SIZE = 5000
+BACKFILL_RATE = 20000
+# backfill.py: records sorted in memory at a time, bigger files are sorted
+# in runs of this many records merged from temporary files
+BACKFILL_RUN_SIZE = 100000
+
+# on demand profiling, started by SIGUSR2 or a POST to /admin/profile. The
+# output files go to PROFILE_DIR: collapsed stacks of all threads sampled
+# every SAMPLE_INTERVAL milliseconds, or cProfile stats of the IOLoop thread.
+# Durations in seconds
+PROFILE_DIR = '.profile'
+PROFILE_DEFAULT_DURATION = 30
+PROFILE_MAX_DURATION = 600
+PROFILE_SAMPLE_INTERVAL = 10
+# remote addresses allowed to use /admin/profile
+PROFILE_ADMIN_ALLOWED_IPS = ['127.0.0.1', '::1']
 
 # DB
 MYSQL_HOST='127.0.0.1'
@@ -16,6 +130,33 @@ MYSQL_PORT=3306
 MYSQL_USER='user'
 MYSQL_PASSWORD='password'
 MYSQL_DB_NAME='demoDB'
+# connection pool, timeouts and delays in seconds
+DB_POOL_SIZE = 10
+DB_POOL_CHECKOUT_TIMEOUT = 5
+DB_POOL_HEALTH_CHECK_INTERVAL = 30
+DB_POOL_RECONNECT_MIN_DELAY = 1
+DB_POOL_RECONNECT_MAX_DELAY = 60
+
+# device cache: device hash key -> logical address, ttl in seconds. Unknown
+# devices are cached for NEGATIVE_TTL so they don't hammer the DB
+DEVICE_CACHE_SIZE = 100000
+DEVICE_CACHE_TTL = 600
+DEVICE_CACHE_NEGATIVE_TTL = 30
+# hash keys resolved by one query of a batched lookup
+DEVICE_LOOKUP_CHUNK_SIZE = 200
+
+# 'cache' looks devices up in the DB through the device cache, 'mirror'
+# keeps all online devices in memory and syncs the changes in background
+DEVICE_STORE_MODE = 'cache'
+# a column increasing on every change of a device row, e.g. an update
+# timestamp. An auto increment id only picks up new devices
+DEVICE_MIRROR_SYNC_COLUMN = 'update_time'
+# seconds
+DEVICE_MIRROR_SYNC_INTERVAL = 10
+# devices deleted from the table, rather than set offline, are served
+# until the next full sync
+DEVICE_MIRROR_FULL_SYNC_INTERVAL = 3600
+DEVICE_MIRROR_SNAPSHOT_FILE = '.device_snapshot'
 
 
 #PID_FILE='/var/run/zabbix/pid'
@@ -1,8 +1,11 @@
 import config
+import os
+import pickle
 import time
 import mysql.connector
-from threading import Lock
-from utils import get_logger, timestamp_to_str, datetime_to_timestamp
+from threading import Condition, Event, Lock, Thread
+from utils import get_logger, timestamp_to_str, datetime_to_timestamp, LRUCache
+from exception import DBException
 
 ########################################
 # MysqlDB
@@ -10,58 +13,218 @@ from utils import get_logger, timestamp_to_str, datetime_to_timestamp
 
 logger = get_logger()
 
-db_lock = Lock()
+class ConnectionPool(object):
+    """
+    A pool of at most 'size' MySQL connections.
 
-db_connection = None
+    A checkout waits up to 'checkout_timeout' seconds for a free
+    connection. Connections idle for more than 'health_check_interval'
+    seconds are pinged before they are handed out, and broken ones are
+    replaced. While MySQL can't be reached new connections are attempted
+    with an exponential backoff between 'reconnect_min_delay' and
+    'reconnect_max_delay' seconds.
+    """
+    def __init__(self, size, checkout_timeout, health_check_interval,
+                 reconnect_min_delay, reconnect_max_delay):
+        self.size = size
+        self.checkout_timeout = checkout_timeout
+        self.health_check_interval = health_check_interval
+        self.reconnect_min_delay = reconnect_min_delay
+        self.reconnect_max_delay = reconnect_max_delay
+        self.condition = Condition(Lock())
+        # (connection, last used time) of the idle connections
+        self.idle = []
+        # connection -> {operation: prepared cursor}
+        self.statements = {}
+        self.created = 0
+        self.in_use = 0
+        self.reconnect_delay = reconnect_min_delay
+        self.next_connect_time = 0
+        # statistics
+        self.checkouts = 0
+        self.timeouts = 0
+        self.connect_failures = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
 
-# setup DB connection
-def get_db_connection():
-    logger.debug("Getting DB connection")
-    db_lock.acquire()
-    global db_connection
-    if db_connection != None:
-        db_lock.release()
-        logger.debug("DB connection successfully get")
-        return db_connection
-    try:
-        db_connection = mysql.connector.connect(user=config.MYSQL_USER, \
-                                          password=config.MYSQL_PASSWORD, \
-                                          host=config.MYSQL_HOST, \
-                                          port=config.MYSQL_PORT, \
-                                          database=config.MYSQL_DB_NAME)
-    except mysql.connector.Error, e:
-        logger.error("Connecting to DB [%s] connection failed: %s" % \
-                     (config.MYSQL_DB_NAME, str(e)))
-    except Exception, e:
-        logger.error("Connecting to DB [%s] connection failed: %s" % \
-                     (config.MYSQL_DB_NAME, e.message))
-    db_lock.release()
-    logger.debug("DB connection successfully get")
+    def _connect(self):
+        self.condition.acquire()
+        try:
+            started = time.time()
+            if started < self.next_connect_time:
+                raise DBException("reconnecting in %.1f seconds" % (self.next_connect_time - started))
+        finally:
+            self.condition.release()
+        try:
+            conn = mysql.connector.connect(user=config.MYSQL_USER, \
+                                           password=config.MYSQL_PASSWORD, \
+                                           host=config.MYSQL_HOST, \
+                                           port=config.MYSQL_PORT, \
+                                           database=config.MYSQL_DB_NAME)
+        except Exception as e:
+            self.condition.acquire()
+            self.connect_failures += 1
+            # the attempts started in the same round back off once
+            if self.next_connect_time <= started:
+                self.next_connect_time = time.time() + self.reconnect_delay
+                self.reconnect_delay = min(self.reconnect_delay * 2, self.reconnect_max_delay)
+            self.condition.release()
+            logger.error("Connecting to DB [%s] connection failed: %s" % \
+                         (config.MYSQL_DB_NAME, str(e)))
+            raise DBException(str(e))
+        self.condition.acquire()
+        self.reconnect_delay = self.reconnect_min_delay
+        self.condition.release()
+        logger.debug("DB connection created")
+        return conn
+
+    def acquire(self):
+        """
+        Check out a connection, it must be given back with release().
+        """
+        start = time.time()
+        deadline = start + self.checkout_timeout
+        conn = None
+        last_used = None
+        self.condition.acquire()
+        try:
+            while True:
+                if self.idle:
+                    conn, last_used = self.idle.pop()
+                    break
+                if self.created < self.size:
+                    # reserve the slot, connect outside of the lock
+                    self.created += 1
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise DBException("no free DB connection in %d seconds" % self.checkout_timeout)
+                self.condition.wait(remaining)
+            self.in_use += 1
+            self.checkouts += 1
+            wait_time = time.time() - start
+            self.wait_time_total += wait_time
+            self.wait_time_max = max(self.wait_time_max, wait_time)
+        finally:
+            self.condition.release()
+
+        try:
+            if conn is not None and time.time() - last_used > self.health_check_interval \
+                    and not conn.is_connected():
+                logger.debug("Replace broken DB connection")
+                self._close(conn)
+                conn = None
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            self.condition.acquire()
+            self.created -= 1
+            self.in_use -= 1
+            self.condition.notify()
+            self.condition.release()
+            raise
+        return conn
+
+    def release(self, conn, broken=False):
+        """
+        Give back a connection, a broken one is closed and replaced later.
+        """
+        self.condition.acquire()
+        self.in_use -= 1
+        if broken:
+            self.created -= 1
+        else:
+            self.idle.append((conn, time.time()))
+        self.condition.notify()
+        self.condition.release()
+        if broken:
+            self._close(conn)
+
+    def prepared_cursor(self, conn, operation):
+        """
+        Get a cursor with 'operation' prepared on the server. A statement is
+        prepared once per connection and reused by later checkouts, as long
+        as the same 'operation' string object is passed.
+        """
+        cursors = self.statements.setdefault(conn, {})
+        cursor = cursors.get(operation)
+        if cursor is None:
+            cursor = conn.cursor(prepared=True)
+            cursors[operation] = cursor
+        return cursor
+
+    def _close(self, conn):
+        self.statements.pop(conn, None)
+        try:
+            conn.close()
+        except Exception:
+            pass
 
-    return db_connection
+    def close(self):
+        logger.debug("Closing DB")
+        self.condition.acquire()
+        idle = self.idle
+        self.idle = []
+        self.created -= len(idle)
+        self.condition.release()
+        for conn, last_used in idle:
+            self._close(conn)
+        logger.debug("DB closed")
 
-def db_close(conn):
-    logger.debug("Closing DB")
-    db_lock.acquire()
-    if conn:
-        conn.close()
-    db_lock.release()
-    logger.debug("DB closed")
+    def stats(self):
+        self.condition.acquire()
+        try:
+            checkouts = self.checkouts
+            return {"size": self.size,
+                    "created": self.created,
+                    "in_use": self.in_use,
+                    "idle": len(self.idle),
+                    "utilization": float(self.in_use) / self.size,
+                    "checkouts": checkouts,
+                    "timeouts": self.timeouts,
+                    "connect_failures": self.connect_failures,
+                    "wait_time_avg": self.wait_time_total / checkouts if checkouts else 0.0,
+                    "wait_time_max": self.wait_time_max}
+        finally:
+            self.condition.release()
 
-def db_execute(conn, operation, params=None):
+db_pool = None
+db_pool_lock = Lock()
+
+def get_db_pool():
+    """
+    Get the global DB connection pool.
+    """
+    db_pool_lock.acquire()
+    global db_pool
+    if db_pool == None:
+        db_pool = ConnectionPool(config.DB_POOL_SIZE,
+                                 config.DB_POOL_CHECKOUT_TIMEOUT,
+                                 config.DB_POOL_HEALTH_CHECK_INTERVAL,
+                                 config.DB_POOL_RECONNECT_MIN_DELAY,
+                                 config.DB_POOL_RECONNECT_MAX_DELAY)
+    db_pool_lock.release()
+    return db_pool
+
+def is_connection_error(e):
+    return isinstance(e, (mysql.connector.errors.InterfaceError,
+                          mysql.connector.errors.OperationalError))
+
+def db_execute(pool, operation, params=None):
     result = False
+    conn = None
     cursor = None
+    broken = False
     logger.debug("Executing DB command: %s" % operation)
-    db_lock.acquire()
     try:
-        if not conn.is_connected():
-            logger.debug("Reconnect DB")
-            conn.reconnect()
+        conn = pool.acquire()
         cursor = conn.cursor()
         cursor.execute(operation, params=params)
         conn.commit()
         result = True
     except mysql.connector.Error, e:
+        broken = is_connection_error(e)
         logger.error("Error executing DB command: %s, error: %s" % \
                      (operation, str(e)))
     except Exception, e:
@@ -70,33 +233,69 @@ def db_execute(conn, operation, params=None):
         result = False
     finally:
         if cursor:
-            cursor.close()
-    db_lock.release()
+            try:
+                cursor.close()
+            except Exception:
+                broken = True
+        if conn:
+            pool.release(conn, broken)
     return result
 
-def db_query(conn, query, params=None):
+def db_query(pool, query, params=None, prepared=False):
+    """
+    Input:
+    * pool: the connection pool
+    * query: the query, with %s placeholders for the params
+    * params: the query params
+    * prepared: run the query as server-side prepared statement, cached
+      per connection, the query should be a constant string
+
+    Output:
+    * result: list of rows
+
+    Raise DBException if the query fails, e.g. no connection can be
+    checked out of the pool: a failure isn't an empty result.
+    """
     result = []
+    conn = None
     cursor = None
+    broken = False
     logger.debug("Executing DB query: %s" % query)
-    db_lock.acquire()
     try:
-        if not conn.is_connected():
-            logger.debug("Reconnect DB")
-            conn.reconnect()
-        cursor = conn.cursor()
-        cursor.execute(query, params=params)
+        conn = pool.acquire()
+        if prepared:
+            cursor = pool.prepared_cursor(conn, query)
+            cursor.execute(query, params)
+        else:
+            cursor = conn.cursor()
+            cursor.execute(query, params=params)
         result = cursor.fetchall()
         conn.commit()
+        if prepared:
+            # the cursor is kept open for the next execution
+            cursor = None
+    except DBException, e:
+        logger.error("Error querying DB: %s, error: %s" % \
+                     (query, e.message))
+        raise
     except mysql.connector.Error, e:
+        # a failed prepared statement is dropped with its connection
+        broken = prepared or is_connection_error(e)
         logger.error("Connecting to DB [%s] connection failed: %s" % \
                      (query, str(e)))
+        raise DBException(str(e))
     except Exception, e:
         logger.error("Error querying DB: %s, error: %s" % \
                      (query, e.message))
+        raise DBException(e.message)
     finally:
         if cursor:
-            cursor.close()
-    db_lock.release()
+            try:
+                cursor.close()
+            except Exception:
+                broken = True
+        if conn:
+            pool.release(conn, broken)
     return result
 ########################################
 # MysqlDB section end
@@ -108,34 +307,273 @@ def db_query(conn, query, params=None):
 
 DEVICE_STATUS_ONLINE = 3
 
+DEVICE_STORE_MODE_CACHE = "cache"
+DEVICE_STORE_MODE_MIRROR = "mirror"
+
+QUERY_LOGICAL_ADDRESS = "select logical_address from device where device_hash_key=%s and status=%s"
+
+class DeviceMirror(Thread):
+    """
+    In-memory copy of the online devices of the device table.
+
+    The whole table is loaded at start, then only the rows whose
+    'sync_column' (an update timestamp or an auto increment id) is not
+    below the last one seen are polled every 'sync_interval' seconds.
+    Deleted rows are only noticed by the full reload done every
+    'full_sync_interval' seconds. The index is saved to 'snapshot_file'
+    so a restart can serve lookups before MySQL answers.
+    """
+    def __init__(self, pool, sync_column, sync_interval, full_sync_interval, snapshot_file):
+        Thread.__init__(self, name="DeviceMirror")
+        self.setDaemon(True)
+        self.pool = pool
+        self.sync_column = sync_column
+        self.sync_interval = sync_interval
+        self.full_sync_interval = full_sync_interval
+        self.snapshot_file = snapshot_file
+        # device hash key -> logical address
+        self.index = {}
+        self.last_sync_value = None
+        self.last_full_sync = 0
+        self.stop_event = Event()
+
+    def find(self, hashkey):
+        return self.index.get(hashkey)
+
+    def size(self):
+        return len(self.index)
+
+    def load_snapshot(self):
+        if not os.path.exists(self.snapshot_file):
+            return False
+        try:
+            fd = open(self.snapshot_file, "rb")
+            self.last_sync_value, self.index = pickle.load(fd)
+            fd.close()
+        except Exception as e:
+            logger.error("Load device snapshot [%s] failure: %s" % (self.snapshot_file, str(e)))
+            return False
+        logger.info("Device mirror warmed with %d devices from snapshot" % len(self.index))
+        return True
+
+    def save_snapshot(self):
+        try:
+            # prefork workers share the snapshot and save it at the same
+            # time, each writes its own file and the last rename wins
+            tmp_file = "%s.%d.tmp" % (self.snapshot_file, os.getpid())
+            fd = open(tmp_file, "wb")
+            pickle.dump((self.last_sync_value, self.index), fd, pickle.HIGHEST_PROTOCOL)
+            fd.close()
+            os.rename(tmp_file, self.snapshot_file)
+        except Exception as e:
+            logger.error("Save device snapshot [%s] failure: %s" % (self.snapshot_file, str(e)))
+
+    def full_sync(self):
+        query_cmd = "select device_hash_key, logical_address, %s from device where status=%%s" % \
+                    self.sync_column
+        result = db_query(self.pool, query_cmd, (DEVICE_STATUS_ONLINE,))
+        index = {}
+        last_sync_value = None
+        for hashkey, logical_address, sync_value in result:
+            index[hashkey] = logical_address
+            if last_sync_value is None or sync_value > last_sync_value:
+                last_sync_value = sync_value
+        self.index = index
+        self.last_sync_value = last_sync_value
+        self.last_full_sync = time.time()
+        logger.info("Device mirror loaded %d devices" % len(index))
+        return True
+
+    def delta_sync(self):
+        """
+        Apply the rows changed since the last sync. The rows at the last
+        sync value come back on every poll, so that rows sharing it aren't
+        missed, they only count as changed if they change the index.
+        Rows deleted from the table aren't seen, they stay in the index
+        until the next full sync.
+
+        Output:
+        * changed: True if the index or the last sync value changed
+        """
+        query_cmd = "select device_hash_key, logical_address, status, %s from device where %s>=%%s" % \
+                    (self.sync_column, self.sync_column)
+        result = db_query(self.pool, query_cmd, (self.last_sync_value,))
+        changed = 0
+        last_sync_value = self.last_sync_value
+        for hashkey, logical_address, status, sync_value in result:
+            old_logical_address = self.index.get(hashkey)
+            if status == DEVICE_STATUS_ONLINE:
+                self.index[hashkey] = logical_address
+                if old_logical_address != logical_address:
+                    changed += 1
+            elif old_logical_address is not None:
+                del self.index[hashkey]
+                changed += 1
+            if sync_value > self.last_sync_value:
+                self.last_sync_value = sync_value
+        if changed:
+            logger.debug("Device mirror synced %d changed devices" % changed)
+        return changed > 0 or self.last_sync_value != last_sync_value
+
+    def sync(self):
+        if self.last_sync_value is None or \
+                time.time() - self.last_full_sync >= self.full_sync_interval:
+            changed = self.full_sync()
+        else:
+            changed = self.delta_sync()
+        if changed:
+            self.save_snapshot()
+
+    def start(self):
+        """
+        Warm the index from the snapshot if there is one, otherwise load
+        the whole table before serving lookups.
+        """
+        if not self.load_snapshot():
+            try:
+                self.sync()
+            except Exception as e:
+                logger.error("Device mirror sync failure: %s" % str(e))
+        Thread.start(self)
+
+    def run(self):
+        logger.info("Device mirror started")
+        while not self.stop_event.wait(self.sync_interval):
+            try:
+                self.sync()
+            except Exception as e:
+                logger.error("Device mirror sync failure: %s" % str(e))
+        logger.info("Device mirror stopped")
+
+    def stop(self):
+        self.stop_event.set()
+        if self.is_alive():
+            self.join()
+
 class DeviceStore(object):
     def __init__(self):
         logger.debug("initialize DeviceStore")
-        self.conn = get_db_connection()
+        self.pool = get_db_pool()
+        # device hash key -> logical address, None for unknown devices
+        self.cache = LRUCache(config.DEVICE_CACHE_SIZE, config.DEVICE_CACHE_TTL)
+        # batched lookups always bind 'lookup_chunk_size' hash keys so a
+        # single prepared statement serves all of them
+        self.lookup_chunk_size = config.DEVICE_LOOKUP_CHUNK_SIZE
+        self.query_logical_addresses = "select device_hash_key, logical_address from device where device_hash_key in (%s) and status=%%s" % \
+                                       ", ".join(["%s"] * self.lookup_chunk_size)
+        self.mirror = None
+        if config.DEVICE_STORE_MODE == DEVICE_STORE_MODE_MIRROR:
+            self.mirror = DeviceMirror(self.pool,
+                                       config.DEVICE_MIRROR_SYNC_COLUMN,
+                                       config.DEVICE_MIRROR_SYNC_INTERVAL,
+                                       config.DEVICE_MIRROR_FULL_SYNC_INTERVAL,
+                                       config.DEVICE_MIRROR_SNAPSHOT_FILE)
+            self.mirror.start()
+
+    def stop(self):
+        if self.mirror is not None:
+            self.mirror.stop()
 
     def get_logical_address_by_hashkey(self, hashkey):
         """
-        Get the device logical address from the DB.
+        Get the device logical address from the cache, or the DB on a miss.
 
         Input:
         * hashkey: device hash key.
 
         Output:
-        * logical_address: device logical address
+        * logical_address: device logical address, None if the device
+          doesn't exist or isn't online
+
+        Raise DBException if the DB can't be queried, nothing is cached then.
         """
         logger.debug("Executing get()")
-        device = None
-        query_cmd="select logical_address from device where device_hash_key='%s' and status=%d" % (hashkey, DEVICE_STATUS_ONLINE)
-        result = db_query(self.conn, query_cmd)
+        if self.mirror is not None:
+            logical_address = self.mirror.find(hashkey)
+            if logical_address is not None:
+                return logical_address
+        # devices added since the last mirror sync fall back to the DB
+        found, logical_address = self.cache.find(hashkey)
+        if found:
+            return logical_address
+
+        result = db_query(self.pool, QUERY_LOGICAL_ADDRESS, (hashkey, DEVICE_STATUS_ONLINE), prepared=True)
 
         if result:
             logical_address = result[0][0]
+            self.cache.add(hashkey, logical_address)
             logger.info("Get device logical_address by device_hash_key[%s] query succeed" % hashkey)
         else:
-            logger.error("Get device logical_address by device_hash_key[%s] query failed" % hashkey)
+            self.cache.add(hashkey, None, config.DEVICE_CACHE_NEGATIVE_TTL)
+            logger.error("Device[%s] doesn't exist or isn't online" % hashkey)
 
         return logical_address
 
+    def get_logical_addresses_by_hashkeys(self, hashkeys):
+        """
+        Get the logical addresses of many devices, the ones not cached are
+        queried 'lookup_chunk_size' hash keys at a time.
+
+        Input:
+        * hashkeys: device hash key list.
+
+        Output:
+        * logical_addresses: dict of device hash key to logical address,
+          unknown or offline devices are left out
+
+        Raise DBException if the DB can't be queried, no device is cached
+        as unknown then.
+        """
+        logger.debug("Executing get_logical_addresses_by_hashkeys()")
+        logical_addresses = {}
+        missed_hashkeys = []
+        for hashkey in hashkeys:
+            if self.mirror is not None:
+                logical_address = self.mirror.find(hashkey)
+                if logical_address is not None:
+                    logical_addresses[hashkey] = logical_address
+                    continue
+            found, logical_address = self.cache.find(hashkey)
+            if not found:
+                missed_hashkeys.append(hashkey)
+            elif logical_address is not None:
+                logical_addresses[hashkey] = logical_address
+        if not missed_hashkeys:
+            return logical_addresses
+
+        found_hashkeys = {}
+        for i in range(0, len(missed_hashkeys), self.lookup_chunk_size):
+            chunk = missed_hashkeys[i:i + self.lookup_chunk_size]
+            # pad the last chunk, repeated hash keys don't change the result
+            chunk += [chunk[-1]] * (self.lookup_chunk_size - len(chunk))
+            result = db_query(self.pool, self.query_logical_addresses,
+                              tuple(chunk) + (DEVICE_STATUS_ONLINE,), prepared=True)
+            for hashkey, logical_address in result:
+                found_hashkeys[hashkey] = logical_address
+                self.cache.add(hashkey, logical_address)
+        for hashkey in missed_hashkeys:
+            if not found_hashkeys.has_key(hashkey):
+                self.cache.add(hashkey, None, config.DEVICE_CACHE_NEGATIVE_TTL)
+        logical_addresses.update(found_hashkeys)
+        logger.info("Get %d of %d devices' logical_address by device_hash_key query" % \
+                    (len(found_hashkeys), len(missed_hashkeys)))
+        return logical_addresses
+
+    def invalidate(self, hashkey=None):
+        """
+        Drop a device from the cache, e.g. after its mapping has changed.
+
+        Input:
+        * hashkey: device hash key, None to drop all devices.
+        """
+        if hashkey is None:
+            self.cache.clear()
+        else:
+            self.cache.delete(hashkey)
+
+    def cache_stats(self):
+        return self.cache.stats()
+
 # single instance
 device_store_instance = None
 device_store_lock = Lock()
@@ -0,0 +1,124 @@
+import config
+import time
+
+from threading import Lock
+from utils import get_logger
+
+########################################
+# Deadband filter
+########################################
+
+logger = get_logger()
+
+class DeadbandFilter(object):
+    """
+    Forward an item value only when it differs from the last forwarded
+    value of the same (host, item key) by more than the absolute or the
+    relative deadband, or when nothing has been forwarded for 'heartbeat'
+    seconds. With no deadband set, any change is forwarded.
+
+    'items' overrides the deadband of some item keys:
+    {item key: (absolute, relative)}.
+    """
+    def __init__(self, absolute, relative, heartbeat, items=None):
+        self.lock = Lock()
+        self.deadband = (absolute, relative)
+        self.heartbeat = heartbeat
+        self.items = items or {}
+        # (host, item key) -> (last forwarded value, forwarded time)
+        self.last_values = {}
+        self.next_purge = time.time() + heartbeat
+        self.forwarded = 0
+        self.suppressed = 0
+
+    def changed(self, item_key, old_value, new_value):
+        if old_value == new_value:
+            return False
+        absolute, relative = self.items.get(item_key, self.deadband)
+        if not absolute and not relative:
+            return True
+        try:
+            difference = abs(float(new_value) - float(old_value))
+        except (TypeError, ValueError):
+            return True
+        if absolute and difference > absolute:
+            return True
+        if relative and difference > relative * abs(float(old_value)):
+            return True
+        return False
+
+    def filter(self, values):
+        """
+        Input:
+        * values: a list of item values, see sender.pack_sender_data()
+
+        Output:
+        * values: the values to forward, they are recorded as forwarded
+        """
+        now = time.time()
+        forwarded = []
+        self.lock.acquire()
+        try:
+            if now >= self.next_purge:
+                self._purge(now)
+            last_values = self.last_values
+            expired = now - self.heartbeat
+            for value in values:
+                host_name, item_key, new_value = value[0], value[1], value[2]
+                last = last_values.get((host_name, item_key))
+                if last is not None and last[1] > expired and \
+                        not self.changed(item_key, last[0], new_value):
+                    continue
+                last_values[(host_name, item_key)] = (new_value, now)
+                forwarded.append(value)
+            self.forwarded += len(forwarded)
+            self.suppressed += len(values) - len(forwarded)
+        finally:
+            self.lock.release()
+        return forwarded
+
+    def forget(self, values):
+        """
+        Forget values which were filtered but could not be forwarded, so
+        they aren't suppressed next time.
+        """
+        self.lock.acquire()
+        for value in values:
+            self.last_values.pop(value[:2], None)
+        self.lock.release()
+
+    def _purge(self, now):
+        # entries past the heartbeat are forwarded anyway, drop them so
+        # devices gone silent don't stay in the table
+        expired = now - self.heartbeat
+        for key in [key for key, last in self.last_values.iteritems() if last[1] <= expired]:
+            del self.last_values[key]
+        self.next_purge = now + self.heartbeat
+
+    def stats(self):
+        return {"size": len(self.last_values),
+                "forwarded": self.forwarded,
+                "suppressed": self.suppressed}
+
+# single instance
+deadband_filter_instance = None
+deadband_filter_lock = Lock()
+
+def get_deadband_filter():
+    """
+    Get the global deadband filter instance, None if it is disabled.
+    """
+    if not config.DEADBAND_ENABLED:
+        return None
+    deadband_filter_lock.acquire()
+    global deadband_filter_instance
+    if deadband_filter_instance == None:
+        deadband_filter_instance = DeadbandFilter(config.DEADBAND_ABSOLUTE,
+                                                  config.DEADBAND_RELATIVE,
+                                                  config.DEADBAND_HEARTBEAT,
+                                                  config.DEADBAND_ITEMS)
+    deadband_filter_lock.release()
+    return deadband_filter_instance
+########################################
+# Deadband filter section end
+########################################
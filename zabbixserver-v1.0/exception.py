@@ -20,3 +20,23 @@ class InvalidParameterException(Exception):
             Exception.__init__(self, "Invalid parameter: %s" % reason)
         else:
             Exception.__init__(self, "Invalid parameter")
+
+class ZabbixSenderException(Exception):
+    def __init__(self, reason=""):
+        if reason != "":
+            Exception.__init__(self, "Zabbix sender failure: %s" % reason)
+        else:
+            Exception.__init__(self, "Zabbix sender failure")
+
+class ZabbixSenderConnectionException(ZabbixSenderException):
+    """
+    The trapper couldn't be reached, rather than refusing the data.
+    """
+    pass
+
+class DBException(Exception):
+    def __init__(self, reason=""):
+        if reason != "":
+            Exception.__init__(self, "DB failure: %s" % reason)
+        else:
+            Exception.__init__(self, "DB failure")
@@ -0,0 +1,119 @@
+import config
+import time
+
+from threading import Lock
+from utils import get_logger
+from exception import InvalidPacketException, InvalidParameterException
+
+########################################
+# Item mapping
+########################################
+
+logger = get_logger()
+
+HEADER_KEY_LOG_SCHEMA_VERSION = "logSchemaVersion"
+HEADER_KEY_TIMESTAMP = "timestamp"
+
+# item keys of list elements are built once for the first positions
+LIST_KEYS_PRECOMPUTED = 16
+
+def compile_extractor(version, items):
+    """
+    Compile the item mapping of one log schema version into a function
+    appending the items of an event to a list of item values.
+
+    Input:
+    * version: the logSchemaVersion the mapping is for
+    * items: list of item mappings, see config.ITEM_MAPPINGS
+
+    Output:
+    * extract: function(event, host_name, values, clock=None) appending
+      (host_name, item_key, value, clock) tuples to 'values'
+    """
+    namespace = {}
+    lines = ["def extract(event, host_name, values, clock=None):",
+             "    append = values.append"]
+    for i, item in enumerate(items):
+        if not item.has_key("key") or not item.has_key("field"):
+            raise InvalidParameterException("item mapping %d of log schema %d" % (i, version))
+        field = "event" + "".join("[%r]" % name for name in item["field"].split("."))
+        if item.has_key("percent"):
+            part, base = item["percent"]
+            keys = "KEYS_%d" % i
+            namespace[keys] = tuple(item["key"] % (position + 1) \
+                                    for position in range(LIST_KEYS_PRECOMPUTED))
+            lines.append("    for position, element in enumerate(%s):" % field)
+            lines.append("        key = %s[position] if position < %d else %r %% (position + 1)" % \
+                         (keys, LIST_KEYS_PRECOMPUTED, item["key"]))
+            lines.append("        append((host_name, key, int(element[%r]) * 100 / int(element[%r]), clock))" % \
+                         (part, base))
+        else:
+            lines.append("    append((host_name, %r, int(%s), clock))" % (item["key"], field))
+    source = "\n".join(lines) + "\n"
+    exec compile(source, "<item mapping %d>" % version, "exec") in namespace
+    return namespace["extract"]
+
+class ItemMapping(object):
+    """
+    The kaa event to zabbix item mappings of all known log schema versions,
+    compiled once into one extractor function per version.
+    """
+    def __init__(self, mappings):
+        self.extractors = {}
+        for version, items in mappings.items():
+            self.extractors[version] = compile_extractor(version, items)
+        logger.debug("Item mappings compiled for log schemas: %s" % sorted(self.extractors.keys()))
+
+    def get_extractor(self, header_map):
+        """
+        Input:
+        * header_map: the 'header' part of the kaa log record
+
+        Output:
+        * extract: the extractor of the record's log schema version
+        """
+        version = header_map.get(HEADER_KEY_LOG_SCHEMA_VERSION)
+        if isinstance(version, dict):
+            version = version.get("int")
+        extract = self.extractors.get(version)
+        if extract is None:
+            raise InvalidPacketException("unknown log schema version %s" % version)
+        return extract
+
+def get_record_clock(header_map):
+    """
+    Input:
+    * header_map: the 'header' part of the kaa log record
+
+    Output:
+    * clock: the record's timestamp in seconds, None if the record has
+      none or it is more than DEVICE_CLOCK_MAX_SKEW seconds ahead, the
+      values then get zabbix' receive time
+    """
+    timestamp = header_map.get(HEADER_KEY_TIMESTAMP)
+    if isinstance(timestamp, dict):
+        timestamp = timestamp.get("long")
+    if not isinstance(timestamp, (int, long)) or timestamp <= 0:
+        return None
+    clock = timestamp / 1000.0
+    if clock > time.time() + config.DEVICE_CLOCK_MAX_SKEW:
+        return None
+    return clock
+
+# single instance
+item_mapping_instance = None
+item_mapping_lock = Lock()
+
+def get_item_mapping():
+    """
+    Get the global item mapping instance.
+    """
+    item_mapping_lock.acquire()
+    global item_mapping_instance
+    if item_mapping_instance == None:
+        item_mapping_instance = ItemMapping(config.ITEM_MAPPINGS)
+    item_mapping_lock.release()
+    return item_mapping_instance
+########################################
+# Item mapping section end
+########################################
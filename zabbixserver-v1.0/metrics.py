@@ -0,0 +1,211 @@
+import bisect
+import threading
+
+from threading import Lock
+from utils import get_logger
+
+########################################
+# Metrics
+########################################
+
+logger = get_logger()
+
+CONTENT_TYPE_METRICS = "text/plain; version=0.0.4"
+
+# seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def format_labels(names, values, extra=None):
+    pairs = zip(names, values)
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"')) \
+                             for name, value in pairs)
+
+def format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+class ShardedMetric(object):
+    """
+    Base of the metrics updated on the hot path. Each thread updates its
+    own shard without locking, the shards are only summed up when the
+    metrics are rendered. The lock is taken once per thread, to register
+    its shard.
+    """
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.local = threading.local()
+        self.shards = []
+        self.shards_lock = Lock()
+
+    def shard(self):
+        try:
+            return self.local.shard
+        except AttributeError:
+            shard = {}
+            self.local.shard = shard
+            self.shards_lock.acquire()
+            self.shards.append(shard)
+            self.shards_lock.release()
+            return shard
+
+    def collect_shards(self):
+        self.shards_lock.acquire()
+        shards = list(self.shards)
+        self.shards_lock.release()
+        # items() copies a shard at once, its thread may be adding to it
+        return [shard.items() for shard in shards]
+
+class Counter(ShardedMetric):
+    def inc(self, label_values=(), amount=1):
+        shard = self.shard()
+        shard[label_values] = shard.get(label_values, 0) + amount
+
+    def render(self):
+        totals = {}
+        for items in self.collect_shards():
+            for label_values, value in items:
+                totals[label_values] = totals.get(label_values, 0) + value
+        lines = ["# HELP %s %s" % (self.name, self.help),
+                 "# TYPE %s counter" % self.name]
+        for label_values, value in sorted(totals.items()):
+            lines.append("%s%s %s" % (self.name, format_labels(self.labels, label_values),
+                                      format_value(value)))
+        return lines
+
+class Histogram(ShardedMetric):
+    """
+    Shard values are [count of each bucket and +Inf..., sum].
+    """
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        ShardedMetric.__init__(self, name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, label_values=()):
+        shard = self.shard()
+        counts = shard.get(label_values)
+        if counts is None:
+            counts = [0] * (len(self.buckets) + 2)
+            shard[label_values] = counts
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def render(self):
+        totals = {}
+        for items in self.collect_shards():
+            for label_values, counts in items:
+                total = totals.setdefault(label_values, [0] * len(counts))
+                for i, count in enumerate(counts):
+                    total[i] += count
+        lines = ["# HELP %s %s" % (self.name, self.help),
+                 "# TYPE %s histogram" % self.name]
+        bounds = [format_value(bound) for bound in self.buckets] + ["+Inf"]
+        for label_values, total in sorted(totals.items()):
+            cumulative = 0
+            for bound, count in zip(bounds, total[:-1]):
+                cumulative += count
+                lines.append("%s_bucket%s %d" % \
+                             (self.name, format_labels(self.labels, label_values, ("le", bound)),
+                              cumulative))
+            labels = format_labels(self.labels, label_values)
+            lines.append("%s_sum%s %s" % (self.name, labels, format_value(total[-1])))
+            lines.append("%s_count%s %d" % (self.name, labels, cumulative))
+        return lines
+
+class Gauge(object):
+    """
+    A value read from 'callback' when the metrics are rendered, the
+    callback returns a number or {label values: number}.
+    """
+    def __init__(self, name, help, callback, labels=()):
+        self.name = name
+        self.help = help
+        self.callback = callback
+        self.labels = tuple(labels)
+
+    def render(self):
+        values = self.callback()
+        if not isinstance(values, dict):
+            values = {(): values}
+        lines = ["# HELP %s %s" % (self.name, self.help),
+                 "# TYPE %s gauge" % self.name]
+        for label_values, value in sorted(values.items()):
+            lines.append("%s%s %s" % (self.name, format_labels(self.labels, label_values),
+                                      format_value(value)))
+        return lines
+
+class StatsGauge(object):
+    """
+    Export the numbers of a stats() dict as '<prefix>_<key>' gauges.
+    """
+    def __init__(self, prefix, help, callback):
+        self.prefix = prefix
+        self.help = help
+        self.callback = callback
+
+    def render(self):
+        lines = []
+        for key, value in sorted(self.callback().items()):
+            if isinstance(value, bool) or not isinstance(value, (int, long, float)):
+                continue
+            name = "%s_%s" % (self.prefix, key)
+            lines.append("# HELP %s %s: %s" % (name, self.help, key))
+            lines.append("# TYPE %s gauge" % name)
+            lines.append("%s %s" % (name, format_value(value)))
+        return lines
+
+class MetricRegistry(object):
+    def __init__(self):
+        self.lock = Lock()
+        self.metrics = []
+
+    def register(self, metric):
+        self.lock.acquire()
+        self.metrics.append(metric)
+        self.lock.release()
+        return metric
+
+    def render(self):
+        """
+        Output:
+        * text: all metrics in the prometheus text exposition format
+        """
+        self.lock.acquire()
+        metrics = list(self.metrics)
+        self.lock.release()
+        lines = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                logger.error("Render metric %s failure: %s" % \
+                             (getattr(metric, "name", getattr(metric, "prefix", "")), e.message))
+        return "\n".join(lines) + "\n"
+
+REGISTRY = MetricRegistry()
+
+REQUESTS = REGISTRY.register(Counter(
+    "zabbix_ingest_requests_total", "HTTP requests by handler and status code",
+    ("handler", "code")))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "zabbix_ingest_request_seconds", "HTTP request latency by handler",
+    ("handler",)))
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "zabbix_ingest_stage_seconds", "Time spent in each ingest stage: "
+    "decode, lookup, map, queue, send", ("stage",)))
+SENDER_PACKETS = REGISTRY.register(Counter(
+    "zabbix_sender_packets_total", "Trapper packets by result: success, error",
+    ("result",)))
+SENDER_VALUES = REGISTRY.register(Counter(
+    "zabbix_sender_values_total", "Item values by result: processed, failed, spooled",
+    ("result",)))
+########################################
+# Metrics section end
+########################################
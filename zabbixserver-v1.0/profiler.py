@@ -0,0 +1,225 @@
+import cProfile
+import config
+import os
+import sys
+import thread
+import threading
+import time
+import tornado.ioloop
+
+from threading import Event, Lock, Thread
+from utils import get_logger
+
+########################################
+# Profiler
+########################################
+
+logger = get_logger()
+
+PROFILE_MODE_SAMPLE = "sample"
+PROFILE_MODE_CPROFILE = "cprofile"
+PROFILE_MODES = (PROFILE_MODE_SAMPLE, PROFILE_MODE_CPROFILE)
+
+PROFILE_FILE_EXTENSIONS = {PROFILE_MODE_SAMPLE: "collapsed",
+                           PROFILE_MODE_CPROFILE: "pstats"}
+
+def frame_name(frame):
+    code = frame.f_code
+    return "%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+class StackSampler(Thread):
+    """
+    Sample the stacks of all the other threads every 'interval' seconds for
+    'duration' seconds, and write them to 'path' in the collapsed stack
+    format of flame graph tools: one 'thread;outer;...;inner count' line
+    per distinct stack. Threads waiting on a lock or in select are sampled
+    too, their stacks end in the waiting call.
+    """
+    def __init__(self, interval, duration, path, on_finish):
+        Thread.__init__(self, name="StackSampler")
+        self.setDaemon(True)
+        self.interval = interval
+        self.duration = duration
+        self.path = path
+        self.on_finish = on_finish
+        self.stop_event = Event()
+
+    def run(self):
+        # collapsed stack -> number of samples
+        stacks = {}
+        samples = 0
+        me = thread.get_ident()
+        deadline = time.time() + self.duration
+        try:
+            while not self.stop_event.wait(self.interval) and time.time() < deadline:
+                names = dict((t.ident, t.name) for t in threading.enumerate())
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == me:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        stack.append(frame_name(frame))
+                        frame = frame.f_back
+                    stack.append(names.get(thread_id, "thread-%d" % thread_id))
+                    stack.reverse()
+                    key = ";".join(stack)
+                    stacks[key] = stacks.get(key, 0) + 1
+                samples += 1
+            fd = open(self.path, "w")
+            try:
+                for stack, count in sorted(stacks.items()):
+                    fd.write("%s %d\n" % (stack, count))
+            finally:
+                fd.close()
+            logger.info("Stack samples written to %s, %d samples" % (self.path, samples))
+        except Exception as e:
+            logger.error("Stack sampling failure: %s" % e)
+        finally:
+            self.on_finish()
+
+    def stop(self):
+        self.stop_event.set()
+
+class IOLoopProfile(object):
+    """
+    Run cProfile on the IOLoop thread for 'duration' seconds and write the
+    stats to 'path' in pstats format. cProfile only sees the thread it is
+    enabled in, blocking work on the executor threads is not included.
+    """
+    def __init__(self, duration, path, on_finish):
+        self.duration = duration
+        self.path = path
+        self.on_finish = on_finish
+        self.profile = cProfile.Profile()
+        self.ioloop = tornado.ioloop.IOLoop.instance()
+        self.timeout = None
+
+    def start(self):
+        self.ioloop.add_callback(self._enable)
+
+    def _enable(self):
+        self.profile.enable()
+        self.timeout = self.ioloop.call_later(self.duration, self._disable)
+
+    def _disable(self):
+        self.profile.disable()
+        try:
+            self.profile.dump_stats(self.path)
+            logger.info("IOLoop profile written to %s" % self.path)
+        except Exception as e:
+            logger.error("IOLoop profile failure: %s" % e)
+        finally:
+            self.on_finish()
+
+    def stop(self):
+        def stop_now():
+            if self.timeout is not None:
+                self.ioloop.remove_timeout(self.timeout)
+                self._disable()
+        self.ioloop.add_callback(stop_now)
+
+class Profiler(object):
+    """
+    Profile the running service on demand for a bounded window, one
+    profile at a time. The output files go to 'directory'.
+    """
+    def __init__(self, directory, default_duration, max_duration, sample_interval):
+        self.directory = directory
+        self.default_duration = default_duration
+        self.max_duration = max_duration
+        self.sample_interval = sample_interval
+        self.lock = Lock()
+        self.current = None
+        self.status = None
+
+    def start(self, mode=PROFILE_MODE_SAMPLE, duration=None):
+        """
+        Input:
+        * mode: PROFILE_MODE_SAMPLE samples the stacks of all threads,
+          PROFILE_MODE_CPROFILE runs cProfile on the IOLoop thread
+        * duration: seconds, the default duration if None, at most the
+          maximum duration
+
+        Output:
+        * status: a dict of 'mode', 'duration', 'file' and 'until' of the
+          started profile, None if a profile is already running
+        """
+        if mode not in PROFILE_MODES:
+            raise ValueError("unknown profile mode: %s" % mode)
+        if duration is None:
+            duration = self.default_duration
+        duration = min(float(duration), self.max_duration)
+        if duration <= 0:
+            raise ValueError("profile duration must be positive")
+        self.lock.acquire()
+        try:
+            if self.current is not None:
+                logger.info("A profile is already running, to %s" % self.status["file"])
+                return None
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            path = os.path.join(self.directory, "%s-%d-%s.%s" % \
+                                (mode, os.getpid(), time.strftime("%Y%m%d-%H%M%S"),
+                                 PROFILE_FILE_EXTENSIONS[mode]))
+            if mode == PROFILE_MODE_SAMPLE:
+                self.current = StackSampler(self.sample_interval, duration, path, self._finished)
+            else:
+                self.current = IOLoopProfile(duration, path, self._finished)
+            self.status = {"mode": mode, "duration": duration, "file": path,
+                           "until": time.time() + duration}
+            self.current.start()
+            logger.info("Profiling (%s) for %g seconds to %s" % (mode, duration, path))
+            return dict(self.status)
+        finally:
+            self.lock.release()
+
+    def stop(self):
+        """
+        End the running profile now, its output is still written.
+        """
+        self.lock.acquire()
+        current = self.current
+        self.lock.release()
+        if current is not None:
+            current.stop()
+
+    def running(self):
+        """
+        Output:
+        * status: the status of the running profile, see start(), None if
+          no profile is running
+        """
+        self.lock.acquire()
+        try:
+            if self.current is None:
+                return None
+            return dict(self.status)
+        finally:
+            self.lock.release()
+
+    def _finished(self):
+        self.lock.acquire()
+        self.current = None
+        self.status = None
+        self.lock.release()
+
+# single instance
+profiler_instance = None
+profiler_lock = Lock()
+
+def get_profiler():
+    """
+    Get the global profiler instance.
+    """
+    profiler_lock.acquire()
+    global profiler_instance
+    if profiler_instance == None:
+        profiler_instance = Profiler(config.PROFILE_DIR,
+                                     config.PROFILE_DEFAULT_DURATION,
+                                     config.PROFILE_MAX_DURATION,
+                                     config.PROFILE_SAMPLE_INTERVAL / 1000.0)
+    profiler_lock.release()
+    return profiler_instance
+########################################
+# Profiler section end
+########################################
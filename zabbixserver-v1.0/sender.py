@@ -0,0 +1,361 @@
+import config
+import json
+import re
+import socket
+import struct
+import time
+
+from threading import Condition, Lock, Thread
+from utils import get_logger
+from spool import get_spool, SpoolReplayer
+from metrics import SENDER_PACKETS, SENDER_VALUES, STAGE_SECONDS
+from exception import ZabbixSenderException, ZabbixSenderConnectionException
+
+########################################
+# Zabbix trapper protocol
+########################################
+
+logger = get_logger()
+
+ZBX_HEADER = "ZBXD\x01"
+ZBX_HEADER_LENGTH = len(ZBX_HEADER) + 8
+
+ZBX_REQUEST_SENDER_DATA = "sender data"
+ZBX_RESPONSE_SUCCESS = "success"
+
+ZBX_INFO_PATTERN = re.compile(r"processed:\s*(\d+);\s*failed:\s*(\d+);\s*total:\s*(\d+)")
+
+def split_clock(clock):
+    """
+    Split a timestamp in seconds into the trapper (clock, ns) fields.
+    """
+    # a float of the epoch in seconds is only precise to the microsecond
+    seconds, microseconds = divmod(int(round(clock * 1000000)), 1000000)
+    return (seconds, microseconds * 1000)
+
+def pack_sender_data(values):
+    """
+    Pack item values into one trapper packet.
+
+    Input:
+    * values: a list of (host_name, item_key, value) or
+      (host_name, item_key, value, clock) tuples, clock is the value's
+      timestamp in seconds, None for zabbix' receive time
+
+    Output:
+    * packet: the 'ZBXD\\x01' header followed by the json payload
+    """
+    data = []
+    clocked = False
+    for value in values:
+        item = {"host": value[0], "key": value[1], "value": str(value[2])}
+        if len(value) > 3 and value[3] is not None:
+            item["clock"], item["ns"] = split_clock(value[3])
+            clocked = True
+        data.append(item)
+    request = {"request": ZBX_REQUEST_SENDER_DATA, "data": data}
+    if clocked:
+        # lets zabbix correct the item clocks for our clock difference
+        request["clock"], request["ns"] = split_clock(time.time())
+    payload = json.dumps(request)
+    return ZBX_HEADER + struct.pack("<Q", len(payload)) + payload
+
+def unpack_sender_response(packet):
+    """
+    Parse the trapper response packet.
+
+    Input:
+    * packet: the full response including the header
+
+    Output:
+    * (processed, failed, total): tuple of counts reported by the trapper
+    """
+    if not packet.startswith(ZBX_HEADER) or len(packet) < ZBX_HEADER_LENGTH:
+        raise ZabbixSenderException("invalid response header")
+    body_length = struct.unpack("<Q", packet[len(ZBX_HEADER):ZBX_HEADER_LENGTH])[0]
+    body = packet[ZBX_HEADER_LENGTH:ZBX_HEADER_LENGTH + body_length]
+    try:
+        response = json.loads(body)
+    except ValueError:
+        raise ZabbixSenderException("invalid response body: %s" % body)
+    if response.get("response") != ZBX_RESPONSE_SUCCESS:
+        raise ZabbixSenderException("trapper refused data: %s" % body)
+    match = ZBX_INFO_PATTERN.search(response.get("info", ""))
+    if match is None:
+        raise ZabbixSenderException("invalid response info: %s" % body)
+    return tuple(int(count) for count in match.groups())
+
+class ZabbixSender(object):
+    def __init__(self, server_host, server_port, timeout):
+        self.server_host = server_host
+        self.server_port = server_port
+        self.timeout = timeout
+
+    def send(self, values):
+        """
+        Send item values to the zabbix trapper in a single packet.
+
+        Input:
+        * values: a list of item values, see pack_sender_data()
+
+        Output:
+        * (processed, failed, total): tuple of counts reported by the trapper
+
+        Raise ZabbixSenderConnectionException if the trapper can't be
+        reached, ZabbixSenderException if it doesn't accept the packet.
+        """
+        if not values:
+            return (0, 0, 0)
+        packet = pack_sender_data(values)
+        sock = None
+        started = time.time()
+        try:
+            sock = socket.create_connection((self.server_host, self.server_port),
+                                            self.timeout)
+            sock.sendall(packet)
+            response = self._recv_response(sock)
+        except socket.error as e:
+            logger.error("Send %d values to zabbix [%s:%d] failure: %s" % \
+                         (len(values), self.server_host, self.server_port, str(e)))
+            SENDER_PACKETS.inc(("error",))
+            raise ZabbixSenderConnectionException(str(e))
+        except ZabbixSenderException:
+            SENDER_PACKETS.inc(("error",))
+            raise
+        finally:
+            if sock:
+                sock.close()
+            STAGE_SECONDS.observe(time.time() - started, ("send",))
+
+        try:
+            result = unpack_sender_response(response)
+        except ZabbixSenderException:
+            SENDER_PACKETS.inc(("error",))
+            raise
+        SENDER_PACKETS.inc(("success",))
+        SENDER_VALUES.inc(("processed",), result[0])
+        SENDER_VALUES.inc(("failed",), result[1])
+        logger.debug("Send %d values to zabbix: processed %d, failed %d, total %d" % \
+                     ((len(values),) + result))
+        return result
+
+    def _recv_response(self, sock):
+        response = self._recv_exactly(sock, ZBX_HEADER_LENGTH)
+        body_length = struct.unpack("<Q", response[len(ZBX_HEADER):])[0]
+        return response + self._recv_exactly(sock, body_length)
+
+    def _recv_exactly(self, sock, length):
+        chunks = []
+        received = 0
+        while received < length:
+            chunk = sock.recv(length - received)
+            if not chunk:
+                raise ZabbixSenderConnectionException("connection closed by trapper")
+            chunks.append(chunk)
+            received += len(chunk)
+        return "".join(chunks)
+
+# single instance
+sender_instance = None
+sender_lock = Lock()
+
+def get_zabbix_sender():
+    """
+    Get the global zabbix sender instance.
+    """
+    sender_lock.acquire()
+    global sender_instance
+    if sender_instance == None:
+        sender_instance = ZabbixSender(config.ZABBIX_SERVER_HOST,
+                                       config.ZABBIX_SERVER_PORT,
+                                       config.ZABBIX_SENDER_TIMEOUT)
+    sender_lock.release()
+    return sender_instance
+########################################
+# Zabbix trapper protocol section end
+########################################
+
+########################################
+# SenderBuffer
+########################################
+
+class SenderBuffer(object):
+    """
+    Coalesce item values of many requests into multi-host trapper packets.
+
+    A packet is flushed as soon as 'flush_size' values are buffered, or
+    'flush_interval' milliseconds after the oldest buffered value arrived,
+    whichever comes first. Each flusher thread has at most one packet in
+    flight, so 'max_in_flight' flushers bound the concurrent packets.
+    Packets the trapper can't be reached for are appended to 'spool'.
+
+    The buffer holds at most 'capacity' values. Once 'high_watermark'
+    values are buffered it is overloaded and refuses new values until
+    the flushers have drained it below 'low_watermark'. A stopped buffer
+    refuses all values, nothing would send them.
+    """
+    def __init__(self, sender, flush_size, flush_interval, max_in_flight, spool=None,
+                 capacity=None, high_watermark=None, low_watermark=None):
+        self.sender = sender
+        self.spool = spool
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval / 1000.0
+        self.max_in_flight = max_in_flight
+        self.capacity = capacity
+        self.high_watermark = high_watermark or capacity
+        self.low_watermark = low_watermark or self.high_watermark
+        self.overloaded = False
+        self.condition = Condition(Lock())
+        self.values = []
+        self.deadline = None
+        self.running = False
+        self.stopped = False
+        self.flushers = []
+
+    def start(self):
+        self.condition.acquire()
+        try:
+            if self.running:
+                return
+            self.running = True
+            self.stopped = False
+            for i in range(self.max_in_flight):
+                flusher = Thread(target=self._flush_loop, name="SenderFlusher-%d" % i)
+                flusher.setDaemon(True)
+                flusher.start()
+                self.flushers.append(flusher)
+        finally:
+            self.condition.release()
+        logger.info("Sender buffer started with %d flushers" % self.max_in_flight)
+
+    def stop(self):
+        """
+        Stop the flushers after all buffered values have been sent.
+        """
+        self.condition.acquire()
+        self.running = False
+        self.stopped = True
+        self.condition.notify_all()
+        self.condition.release()
+        for flusher in self.flushers:
+            flusher.join()
+        self.flushers = []
+        logger.info("Sender buffer stopped")
+
+    def add(self, values):
+        """
+        Add item values to the buffer.
+
+        Input:
+        * values: a list of item values, see pack_sender_data()
+
+        Output:
+        * accepted: False if the buffer is stopped, overloaded or the
+          values don't fit into it, nothing is added then
+        """
+        if not values:
+            return True
+        self.condition.acquire()
+        try:
+            if self.stopped or self.overloaded or (self.capacity is not None and \
+                    len(self.values) + len(values) > self.capacity):
+                return False
+            if not self.values:
+                self.deadline = time.time() + self.flush_interval
+                self.condition.notify()
+            self.values.extend(values)
+            if len(self.values) >= self.flush_size:
+                self.condition.notify()
+            if self.high_watermark is not None and len(self.values) >= self.high_watermark:
+                self.overloaded = True
+                logger.error("Sender buffer is overloaded with %d values" % len(self.values))
+            return True
+        finally:
+            self.condition.release()
+
+    def size(self):
+        return len(self.values)
+
+    def is_overloaded(self):
+        return self.overloaded
+
+    def _take(self):
+        """
+        Wait until a packet is due and take it out of the buffer.
+        Return None when the buffer is stopped and drained.
+        """
+        self.condition.acquire()
+        try:
+            while self.running and len(self.values) < self.flush_size:
+                if not self.values:
+                    self.condition.wait()
+                    continue
+                remaining = self.deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            if not self.values:
+                return None
+            batch = self.values[:self.flush_size]
+            del self.values[:self.flush_size]
+            if self.overloaded and len(self.values) <= self.low_watermark:
+                self.overloaded = False
+                logger.info("Sender buffer drained to %d values" % len(self.values))
+            if self.values:
+                # the rest is at least as old as the batch just taken
+                self.condition.notify()
+            return batch
+        finally:
+            self.condition.release()
+
+    def _flush_loop(self):
+        while True:
+            batch = self._take()
+            if batch is None:
+                return
+            try:
+                processed, failed, total = self.sender.send(batch)
+                if failed > 0:
+                    logger.error("Zabbix failed to process %d of %d values" % \
+                                 (failed, total))
+            except Exception as e:
+                logger.error("Flush %d values to zabbix failure: %s" % \
+                             (len(batch), e.message))
+                if self.spool is not None:
+                    self.spool.append(batch)
+                    SENDER_VALUES.inc(("spooled",), len(batch))
+
+# single instance
+sender_buffer_instance = None
+sender_buffer_lock = Lock()
+
+def get_sender_buffer():
+    """
+    Get the global sender buffer instance.
+    """
+    sender_buffer_lock.acquire()
+    global sender_buffer_instance
+    if sender_buffer_instance == None:
+        sender_buffer_instance = SenderBuffer(get_zabbix_sender(),
+                                              config.SENDER_BUFFER_FLUSH_SIZE,
+                                              config.SENDER_BUFFER_FLUSH_INTERVAL,
+                                              config.SENDER_BUFFER_MAX_IN_FLIGHT,
+                                              get_spool(),
+                                              config.INGEST_QUEUE_CAPACITY,
+                                              config.INGEST_QUEUE_HIGH_WATERMARK,
+                                              config.INGEST_QUEUE_LOW_WATERMARK)
+    sender_buffer_lock.release()
+    return sender_buffer_instance
+
+def new_spool_replayer():
+    """
+    Create a replayer draining the global spool into zabbix.
+    """
+    return SpoolReplayer(get_spool(),
+                         get_zabbix_sender(),
+                         config.SPOOL_REPLAY_RATE,
+                         config.SPOOL_RETRY_INTERVAL,
+                         config.SPOOL_REPLAY_MAX_ATTEMPTS)
+########################################
+# SenderBuffer section end
+########################################
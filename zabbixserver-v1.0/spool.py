@@ -0,0 +1,382 @@
+import config
+import json
+import mmap
+import os
+import re
+import struct
+import time
+
+from threading import Event, Lock, Thread
+from utils import get_logger
+from exception import ZabbixSenderConnectionException
+
+########################################
+# Spool
+########################################
+
+logger = get_logger()
+
+# record: payload length, spooled time, json encoded list of item values
+SPOOL_RECORD_HEADER = struct.Struct("<Id")
+SPOOL_SEGMENT_PATTERN = re.compile(r"^segment-(\d+)\.dat$")
+SPOOL_SEGMENT_NAME = "segment-%010d.dat"
+SPOOL_CURSOR_NAME = "cursor"
+
+class Spool(object):
+    """
+    Append-only local spool of item values that could not be sent to zabbix.
+
+    Records are appended to the newest segment file and read back, oldest
+    first, from memory-mapped segments. When the spool grows beyond
+    'max_size' bytes the oldest segments are dropped. The read position is
+    kept in a cursor file so a restart doesn't replay values twice.
+    Records removed unsent, by drop() or with a dropped segment, are
+    counted in 'dropped'.
+    """
+    def __init__(self, directory, segment_size, max_size):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_size = max_size
+        self.lock = Lock()
+        # [seq, size] of each segment, oldest first
+        self.segments = []
+        self.read_offset = 0
+        self.records = 0
+        self.dropped = 0
+        self.writer = None
+        self._load()
+
+    def _segment_path(self, seq):
+        return os.path.join(self.directory, SPOOL_SEGMENT_NAME % seq)
+
+    def _cursor_path(self):
+        return os.path.join(self.directory, SPOOL_CURSOR_NAME)
+
+    def _load(self):
+        if not os.access(self.directory, os.R_OK|os.W_OK):
+            os.makedirs(self.directory)
+        for name in sorted(os.listdir(self.directory)):
+            match = SPOOL_SEGMENT_PATTERN.match(name)
+            if match:
+                seq = int(match.group(1))
+                self.segments.append([seq, os.path.getsize(self._segment_path(seq))])
+        try:
+            fd = open(self._cursor_path(), "r")
+            seq, offset = [int(i) for i in fd.read().split()]
+            fd.close()
+            if self.segments and self.segments[0][0] == seq:
+                self.read_offset = offset
+        except (IOError, ValueError):
+            self.read_offset = 0
+        for i, (seq, size) in enumerate(self.segments):
+            offset = self.read_offset if i == 0 else 0
+            self.records += self._count_records(seq, size, offset)
+        if self.records > 0:
+            logger.info("Spool [%s] loaded with %d records" % (self.directory, self.records))
+
+    def _save_cursor(self):
+        seq = self.segments[0][0] if self.segments else 0
+        fd = open(self._cursor_path(), "w")
+        fd.write("%d %d" % (seq, self.read_offset))
+        fd.close()
+
+    def _count_records(self, seq, size, offset):
+        count = 0
+        fd = open(self._segment_path(seq), "rb")
+        try:
+            while offset + SPOOL_RECORD_HEADER.size <= size:
+                fd.seek(offset)
+                length, spooled = SPOOL_RECORD_HEADER.unpack(fd.read(SPOOL_RECORD_HEADER.size))
+                offset += SPOOL_RECORD_HEADER.size + length
+                if offset > size:
+                    break
+                count += 1
+        finally:
+            fd.close()
+        return count
+
+    def _roll(self):
+        if self.writer:
+            self.writer.close()
+        if self.segments:
+            seq = self.segments[-1][0] + 1
+        else:
+            seq = 1
+        self.writer = open(self._segment_path(seq), "ab")
+        self.segments.append([seq, 0])
+
+    def _drop_oldest(self):
+        seq, size = self.segments.pop(0)
+        self.records -= self._count_records(seq, size, self.read_offset)
+        self.read_offset = 0
+        os.remove(self._segment_path(seq))
+        self._save_cursor()
+        return seq
+
+    def append(self, values):
+        """
+        Append item values to the spool.
+
+        Input:
+        * values: a list of item values, see sender.pack_sender_data()
+        """
+        payload = json.dumps(values)
+        record = SPOOL_RECORD_HEADER.pack(len(payload), time.time()) + payload
+        self.lock.acquire()
+        try:
+            if self.writer is None or self.segments[-1][1] >= self.segment_size:
+                self._roll()
+            self.writer.write(record)
+            self.writer.flush()
+            self.segments[-1][1] += len(record)
+            self.records += 1
+            while len(self.segments) > 1 and self.size() > self.max_size:
+                records = self.records
+                seq = self._drop_oldest()
+                self.dropped += records - self.records
+                logger.error("Spool [%s] is full, dropped segment %d with %d records" % \
+                             (self.directory, seq, records - self.records))
+        finally:
+            self.lock.release()
+
+    def read(self, max_records):
+        """
+        Read the oldest records without removing them from the spool.
+
+        Input:
+        * max_records: the maximum number of records to read
+
+        Output:
+        * (seq, records): the segment the records are read from and a list
+          of (end_offset, values) to be passed to commit() once handled
+        """
+        while True:
+            self.lock.acquire()
+            try:
+                while self.segments:
+                    seq, size = self.segments[0]
+                    if self.read_offset < size:
+                        break
+                    if self.writer and len(self.segments) == 1:
+                        return (seq, [])
+                    self.segments.pop(0)
+                    self.read_offset = 0
+                    os.remove(self._segment_path(seq))
+                    self._save_cursor()
+                if not self.segments:
+                    return (0, [])
+                if len(self.segments) == 1 and self.writer:
+                    # never map the segment being appended to
+                    self._roll()
+                seq, size = self.segments[0]
+                offset = self.read_offset
+            finally:
+                self.lock.release()
+
+            # the segment is immutable now, it can be read without the lock,
+            # but append() may drop it before it is opened
+            try:
+                fd = open(self._segment_path(seq), "rb")
+            except (IOError, OSError) as e:
+                self.lock.acquire()
+                dropped = not self.segments or self.segments[0][0] != seq
+                self.lock.release()
+                if dropped:
+                    continue
+                logger.error("Spool segment %d can't be read: %s" % (seq, str(e)))
+                return (seq, [])
+            return (seq, self._read_records(fd, seq, size, offset, max_records))
+
+    def _read_records(self, fd, seq, size, offset, max_records):
+        """
+        Read up to 'max_records' records of the opened segment 'seq' from
+        'offset', see read().
+        """
+        records = []
+        try:
+            mm = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            fd.close()
+            raise
+        try:
+            while offset + SPOOL_RECORD_HEADER.size <= size and len(records) < max_records:
+                length, spooled = SPOOL_RECORD_HEADER.unpack_from(mm, offset)
+                start = offset + SPOOL_RECORD_HEADER.size
+                if start + length > size:
+                    logger.error("Spool segment %d is truncated at %d" % (seq, offset))
+                    records.append((size, []))
+                    break
+                try:
+                    values = json.loads(mm[start:start + length])
+                except ValueError:
+                    logger.error("Spool segment %d is corrupted at %d" % (seq, offset))
+                    values = []
+                offset = start + length
+                records.append((offset, values))
+        finally:
+            mm.close()
+            fd.close()
+        return records
+
+    def commit(self, seq, end_offset):
+        """
+        Remove the records read from segment 'seq' up to 'end_offset'.
+        """
+        self.lock.acquire()
+        try:
+            self._commit(seq, end_offset)
+        finally:
+            self.lock.release()
+
+    def drop(self, seq, end_offset):
+        """
+        Like commit(), for records given up on rather than sent.
+        """
+        self.lock.acquire()
+        try:
+            self.dropped += self._commit(seq, end_offset)
+        finally:
+            self.lock.release()
+
+    def _commit(self, seq, end_offset):
+        if not self.segments or self.segments[0][0] != seq or \
+                end_offset <= self.read_offset:
+            # the segment has been dropped meanwhile
+            return 0
+        records = self._count_records(seq, end_offset, self.read_offset)
+        self.records -= records
+        self.read_offset = end_offset
+        if self.read_offset >= self.segments[0][1] and len(self.segments) > 1:
+            self.segments.pop(0)
+            self.read_offset = 0
+            os.remove(self._segment_path(seq))
+        self._save_cursor()
+        return records
+
+    def size(self):
+        """
+        The number of spooled bytes not replayed yet.
+        """
+        return sum(size for seq, size in self.segments) - self.read_offset
+
+    def oldest_age(self):
+        """
+        The age in seconds of the oldest record not replayed yet.
+        """
+        self.lock.acquire()
+        try:
+            for i, (seq, size) in enumerate(self.segments):
+                offset = self.read_offset if i == 0 else 0
+                if offset + SPOOL_RECORD_HEADER.size > size:
+                    continue
+                fd = open(self._segment_path(seq), "rb")
+                fd.seek(offset)
+                length, spooled = SPOOL_RECORD_HEADER.unpack(fd.read(SPOOL_RECORD_HEADER.size))
+                fd.close()
+                return max(time.time() - spooled, 0)
+            return 0
+        finally:
+            self.lock.release()
+
+    def stats(self):
+        return {"records": self.records,
+                "dropped": self.dropped,
+                "bytes": self.size(),
+                "segments": len(self.segments),
+                "oldest_age": self.oldest_age()}
+
+    def close(self):
+        self.lock.acquire()
+        if self.writer:
+            self.writer.close()
+            self.writer = None
+        self.lock.release()
+
+class SpoolReplayer(Thread):
+    """
+    Drain the spool into zabbix at no more than 'rate' values per second,
+    and back off for 'retry_interval' seconds while the trapper can't be
+    reached. A record the trapper doesn't accept is retried after
+    'retry_interval' seconds and dropped after 'max_attempts' sends, so it
+    doesn't block the records behind it.
+    """
+    REPLAY_RECORDS = 16
+
+    def __init__(self, spool, sender, rate, retry_interval, max_attempts):
+        Thread.__init__(self, name="SpoolReplayer")
+        self.setDaemon(True)
+        self.spool = spool
+        self.sender = sender
+        self.rate = rate
+        self.retry_interval = retry_interval
+        self.max_attempts = max_attempts
+        # (seq, end_offset) of the record failing, sends of it
+        self.failing = None
+        self.attempts = 0
+        self.stop_event = Event()
+
+    def run(self):
+        logger.info("Spool replayer started")
+        while not self.stop_event.is_set():
+            try:
+                seq, records = self.spool.read(SpoolReplayer.REPLAY_RECORDS)
+            except Exception as e:
+                logger.error("Spool read failure: %s" % str(e))
+                self.stop_event.wait(self.retry_interval)
+                continue
+            if not records:
+                self.stop_event.wait(self.retry_interval)
+                continue
+            logger.info("Replaying %d spooled records" % len(records))
+            for end_offset, values in records:
+                if self.stop_event.is_set():
+                    break
+                try:
+                    self.sender.send(values)
+                except ZabbixSenderConnectionException as e:
+                    logger.error("Replay %d spooled values failure: %s" % \
+                                 (len(values), e.message))
+                    self.stop_event.wait(self.retry_interval)
+                    break
+                except Exception as e:
+                    if self.failing != (seq, end_offset):
+                        self.failing = (seq, end_offset)
+                        self.attempts = 0
+                    self.attempts += 1
+                    if self.attempts < self.max_attempts:
+                        logger.error("Replay %d spooled values failure, attempt %d: %s" % \
+                                     (len(values), self.attempts, e.message))
+                        self.stop_event.wait(self.retry_interval)
+                        break
+                    logger.error("Drop %d spooled values after %d attempts: %s" % \
+                                 (len(values), self.attempts, e.message))
+                    self.spool.drop(seq, end_offset)
+                    continue
+                self.spool.commit(seq, end_offset)
+                self.stop_event.wait(float(len(values)) / self.rate)
+        logger.info("Spool replayer stopped")
+
+    def stop(self):
+        self.stop_event.set()
+        if self.is_alive():
+            self.join()
+
+# single instance
+spool_instance = None
+spool_lock = Lock()
+
+def get_spool():
+    """
+    Get the global spool instance.
+    """
+    spool_lock.acquire()
+    global spool_instance
+    if spool_instance == None:
+        spool_instance = Spool(config.SPOOL_DIR,
+                               config.SPOOL_SEGMENT_SIZE,
+                               config.SPOOL_MAX_SIZE)
+    spool_lock.release()
+    return spool_instance
+########################################
+# Spool section end
+########################################
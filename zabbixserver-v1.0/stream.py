@@ -0,0 +1,204 @@
+import config
+import json
+import re
+
+from exception import InvalidPacketException
+
+########################################
+# Streamed request body parsers
+########################################
+
+WHITESPACE = re.compile(r"\s*")
+# the characters changing the nesting of a JSON value, outside of strings
+JSON_STRUCTURE = re.compile(r'[\[\]{}"]')
+# the characters ending a JSON string or escaping the next one
+JSON_STRING_SPECIAL = re.compile(r'["\\]')
+# the end of a number, true, false or null array element
+JSON_SCALAR_END = re.compile(r"[,\]]")
+
+class NdjsonStreamParser(object):
+    """
+    Split a streamed NDJSON body into records, one JSON document per line.
+    A line that is not valid JSON only fails its own record, a line longer
+    than 'max_record_size' bytes fails the whole body.
+    """
+    def __init__(self, max_record_size=config.BATCH_MAX_RECORD_SIZE):
+        self.max_record_size = max_record_size
+        self.buffer = ""
+
+    def feed(self, chunk):
+        """
+        Input:
+        * chunk: the next part of the body
+
+        Output:
+        * records: list of (record, error) tuples, one for each complete
+          line, error is None when the line was decoded
+        """
+        self.buffer += chunk
+        lines = self.buffer.split("\n")
+        self.buffer = lines.pop()
+        if len(self.buffer) > self.max_record_size:
+            raise InvalidPacketException("record larger than %d bytes" % self.max_record_size)
+        return [self._decode(line) for line in lines if line.strip() != ""]
+
+    def close(self):
+        """
+        Decode the last line which may not end with a newline.
+        """
+        line = self.buffer
+        self.buffer = ""
+        if line.strip() == "":
+            return []
+        return [self._decode(line)]
+
+    def _decode(self, line):
+        try:
+            return (json.loads(line), None)
+        except ValueError as e:
+            return (None, InvalidPacketException(e.message))
+
+class JsonArrayStreamParser(object):
+    """
+    Decode the elements of a streamed JSON array as soon as each one is
+    complete, so the whole body never has to be held and decoded at once.
+
+    The end of an element is found by scanning its brackets and strings,
+    each byte once, then the element is decoded at once. An element which
+    is not valid JSON only fails its own record. A malformed array, or an
+    element larger than 'max_record_size' bytes, fails the whole body.
+    """
+    STATE_START = 0
+    STATE_FIRST = 1
+    STATE_ELEMENT = 2
+    STATE_SEPARATOR = 3
+    STATE_END = 4
+
+    def __init__(self, max_record_size=config.BATCH_MAX_RECORD_SIZE):
+        self.max_record_size = max_record_size
+        self.buffer = ""
+        self.state = JsonArrayStreamParser.STATE_START
+        self._reset_scan()
+
+    def _reset_scan(self):
+        # where the scan of the pending element resumes, relative to the
+        # start of the buffer, and its nesting depth
+        self.scan_pos = 0
+        self.depth = 0
+        self.in_string = False
+
+    def feed(self, chunk):
+        """
+        Input:
+        * chunk: the next part of the body
+
+        Output:
+        * records: list of (record, error) tuples of the completed elements,
+          error is None when the element was decoded
+        """
+        records = []
+        buf = self.buffer + chunk
+        pos = 0
+        while True:
+            if self.state != JsonArrayStreamParser.STATE_ELEMENT or self.scan_pos == 0:
+                pos = WHITESPACE.match(buf, pos).end()
+            if pos == len(buf):
+                break
+            if self.state == JsonArrayStreamParser.STATE_START:
+                if buf[pos] != "[":
+                    raise InvalidPacketException("body is not a JSON array")
+                self.state = JsonArrayStreamParser.STATE_FIRST
+                pos += 1
+            elif self.state == JsonArrayStreamParser.STATE_FIRST:
+                if buf[pos] == "]":
+                    self.state = JsonArrayStreamParser.STATE_END
+                    pos += 1
+                else:
+                    self.state = JsonArrayStreamParser.STATE_ELEMENT
+            elif self.state == JsonArrayStreamParser.STATE_ELEMENT:
+                end = self._scan(buf, pos)
+                if end is None:
+                    # the element is not complete yet, wait for more data
+                    if len(buf) - pos > self.max_record_size:
+                        raise InvalidPacketException("array element larger than %d bytes" % \
+                                                     self.max_record_size)
+                    break
+                records.append(self._decode(buf[pos:end]))
+                self._reset_scan()
+                pos = end
+                self.state = JsonArrayStreamParser.STATE_SEPARATOR
+            elif self.state == JsonArrayStreamParser.STATE_SEPARATOR:
+                if buf[pos] == ",":
+                    self.state = JsonArrayStreamParser.STATE_ELEMENT
+                elif buf[pos] == "]":
+                    self.state = JsonArrayStreamParser.STATE_END
+                else:
+                    raise InvalidPacketException("unexpected '%s' after array element" % buf[pos])
+                pos += 1
+            else:
+                raise InvalidPacketException("unexpected data after the JSON array")
+        self.buffer = buf[pos:]
+        return records
+
+    def _scan(self, buf, start):
+        """
+        Find the end of the element starting at 'start', from where the
+        last scan stopped.
+
+        Output:
+        * end: the offset after the element, None if it is not complete
+        """
+        if buf[start] not in "{[\"":
+            # the end of a scalar is only known from the next separator
+            match = JSON_SCALAR_END.search(buf, start + self.scan_pos)
+            if match is None:
+                self.scan_pos = len(buf) - start
+                return None
+            return match.start()
+        pos = start + self.scan_pos
+        while True:
+            if self.in_string:
+                match = JSON_STRING_SPECIAL.search(buf, pos)
+                if match is None or match.end() == len(buf):
+                    # wait for the character following a backslash
+                    self.scan_pos = (len(buf) if match is None else match.start()) - start
+                    return None
+                if match.group() == "\\":
+                    pos = match.end() + 1
+                    continue
+                self.in_string = False
+                pos = match.end()
+                if self.depth == 0:
+                    return pos
+            else:
+                match = JSON_STRUCTURE.search(buf, pos)
+                if match is None:
+                    self.scan_pos = len(buf) - start
+                    return None
+                pos = match.end()
+                char = match.group()
+                if char == "\"":
+                    self.in_string = True
+                elif char in "{[":
+                    self.depth += 1
+                else:
+                    self.depth -= 1
+                    if self.depth <= 0:
+                        return pos
+
+    def _decode(self, element):
+        try:
+            return (json.loads(element), None)
+        except ValueError as e:
+            return (None, InvalidPacketException(e.message))
+
+    def close(self):
+        """
+        Check that the whole array has been received.
+        """
+        if self.state != JsonArrayStreamParser.STATE_END:
+            raise InvalidPacketException("truncated JSON array")
+        return []
+########################################
+# Streamed request body parsers section end
+########################################
@@ -0,0 +1,81 @@
+import logging
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+config.LOG_FILE = os.devnull
+
+from utils import get_logger, set_log_level
+get_logger()
+set_log_level(logging.CRITICAL)
+
+import aggregate
+from aggregate import Aggregator
+
+class FakeSenderBuffer(object):
+    def __init__(self):
+        self.values = []
+        self.spool = None
+
+    def add(self, values):
+        self.values.extend(values)
+        return True
+
+class AggregatorTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1005.0
+        self.real_time = aggregate.time.time
+        aggregate.time.time = lambda: self.now
+        self.sender_buffer = FakeSenderBuffer()
+        self.aggregator = Aggregator({"tds": 60}, self.sender_buffer, lateness=5)
+
+    def tearDown(self):
+        aggregate.time.time = self.real_time
+
+    def test_split(self):
+        values = [("a", "tds", 1), ("a", "tds", "ok"), ("a", "temp", 2)]
+        self.assertEqual(self.aggregator.split(values),
+                         ([("a", "tds", 1)], [("a", "tds", "ok"), ("a", "temp", 2)]))
+
+    def test_window(self):
+        self.aggregator.add([("a", "tds", 4), ("a", "tds", 2), ("b", "tds", 7)])
+        self.aggregator.add([("a", "tds", 6)])
+        # windows are aligned to the epoch: [960, 1020), closed 5 seconds late
+        self.aggregator.flush(1024)
+        self.assertEqual(self.sender_buffer.values, [])
+        self.aggregator.flush(1025)
+        self.assertEqual(sorted(self.sender_buffer.values), [
+            ("a", "tds.avg", 4.0, 1020), ("a", "tds.count", 3, 1020), ("a", "tds.last", 6, 1020),
+            ("a", "tds.max", 6, 1020), ("a", "tds.min", 2, 1020),
+            ("b", "tds.avg", 7.0, 1020), ("b", "tds.count", 1, 1020), ("b", "tds.last", 7, 1020),
+            ("b", "tds.max", 7, 1020), ("b", "tds.min", 7, 1020)])
+        self.assertEqual(self.aggregator.states, {})
+        self.assertEqual(self.aggregator.deadlines, [])
+
+    def test_device_clock(self):
+        # a late sample goes to the window of its clock, not of its arrival
+        self.now = 1030.0
+        self.aggregator.add([("a", "tds", 4, 1010.5), ("a", "tds", 8, 1030.0)])
+        self.assertEqual(sorted(self.aggregator.states.keys()),
+                         [(1020, "a", "tds"), (1080, "a", "tds")])
+        self.aggregator.flush(self.now)
+        self.assertEqual(len(self.sender_buffer.values), 5)
+        self.assertTrue(("a", "tds.count", 1, 1020) in self.sender_buffer.values)
+        self.assertEqual(self.aggregator.states.keys(), [(1080, "a", "tds")])
+
+    def test_flush_visits_due_windows(self):
+        for i in range(100):
+            self.aggregator.add([("host%d" % i, "tds", i, 1000 + i * 60)])
+        self.aggregator.flush(1025)
+        self.assertEqual(len(self.sender_buffer.values), 5)
+        self.assertEqual(len(self.aggregator.states), 99)
+        self.assertEqual(self.aggregator.deadlines[0][0], 1080)
+        self.aggregator.flush()
+        self.assertEqual(len(self.sender_buffer.values), 500)
+        self.assertEqual(self.aggregator.states, {})
+
+if __name__ == "__main__":
+    unittest.main()
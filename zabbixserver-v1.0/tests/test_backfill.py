@@ -0,0 +1,95 @@
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+config.LOG_FILE = os.devnull
+
+from utils import get_logger, set_log_level
+get_logger()
+set_log_level(logging.CRITICAL)
+
+import backfill
+from backfill import Backfill
+from exception import ZabbixSenderException
+
+def make_record(hashkey, timestamp, tds):
+    return {"header": {"endpointKeyHash": {"string": hashkey},
+                       "timestamp": {"long": timestamp},
+                       "logSchemaVersion": {"int": 10}},
+            "event": {"outletTDS": tds,
+                      "hotWaterTemp": 98,
+                      "coldWaterTemp": 23,
+                      "waterPurified": 105,
+                      "failureStatus": 0,
+                      "filterStatus": {"filterList": [{"life": 100, "base": 360}]}}}
+
+# the items of a record, see config.ITEM_MAPPINGS
+RECORD_VALUES = 6
+
+class FakeSender(object):
+    def __init__(self, failures=0):
+        self.batches = []
+        self.failures = failures
+
+    def send(self, values):
+        if self.failures > 0:
+            self.failures -= 1
+            raise ZabbixSenderException("refused")
+        self.batches.append(list(values))
+        return (len(values), 0, len(values))
+
+class FakeDeviceStore(object):
+    def get_logical_addresses_by_hashkeys(self, hashkeys):
+        return dict((hashkey, "ADDR-" + hashkey) for hashkey in hashkeys if hashkey != "unknown")
+
+class BackfillTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        # out of order timestamps, in milliseconds
+        timestamps = [1476940343000 + ((i * 7919) % 50) * 1000 for i in range(50)]
+        records = [make_record("k%d" % (i % 3), timestamp, i) for i, timestamp in enumerate(timestamps)]
+        records.append(make_record("unknown", 1476940343000, 0))
+        records.append({"header": {}})
+        self.path = os.path.join(self.directory, "records.ndjson")
+        fd = open(self.path, "w")
+        for record in records:
+            fd.write(json.dumps(record) + "\n")
+        fd.close()
+        self.real_retry_interval = config.SPOOL_RETRY_INTERVAL
+        config.SPOOL_RETRY_INTERVAL = 0
+
+    def tearDown(self):
+        config.SPOOL_RETRY_INTERVAL = self.real_retry_interval
+        shutil.rmtree(self.directory)
+
+    def load(self, run_size, sender=None):
+        sender = sender or FakeSender()
+        loader = Backfill(sender, FakeDeviceStore(), 8, 1000000, run_size)
+        loader.load(self.path)
+        return loader, [value for batch in sender.batches for value in batch]
+
+    def test_runs_are_merged_in_time_order(self):
+        loader, in_memory = self.load(1000)
+        loader, merged = self.load(4)
+        self.assertEqual(len(merged), 50 * RECORD_VALUES)
+        clocks = [value[3] for value in merged]
+        self.assertEqual(clocks, sorted(clocks))
+        self.assertEqual(sorted(merged), sorted(tuple(value) for value in in_memory))
+        self.assertEqual((loader.records, loader.skipped, loader.processed), (52, 2, 50 * RECORD_VALUES))
+
+    def test_retries(self):
+        loader, values = self.load(1000, FakeSender(failures=backfill.SEND_RETRIES - 1))
+        self.assertEqual(len(values), 50 * RECORD_VALUES)
+        sender = FakeSender(failures=backfill.SEND_RETRIES)
+        loader = Backfill(sender, FakeDeviceStore(), 8, 1000000, 1000)
+        self.assertRaises(ZabbixSenderException, loader.load, self.path)
+
+if __name__ == "__main__":
+    unittest.main()
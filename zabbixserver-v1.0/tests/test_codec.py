@@ -0,0 +1,74 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bench"))
+
+import config
+config.LOG_FILE = os.devnull
+
+import codec
+from avro_writer import encode_avro
+from payload import SAMPLE_RECORD
+from exception import InvalidPacketException
+
+class AvroDecodeTest(unittest.TestCase):
+    def setUp(self):
+        self.version = SAMPLE_RECORD["header"]["logSchemaVersion"]["int"]
+        self.headers = {codec.HEADER_LOG_SCHEMA_VERSION: str(self.version)}
+        self.body = encode_avro(SAMPLE_RECORD, self.version)
+
+    def test_round_trip(self):
+        self.assertEqual(codec.decode_avro(self.body, self.headers), SAMPLE_RECORD)
+
+    def test_trailing_bytes(self):
+        self.assertRaises(InvalidPacketException, codec.decode_avro, self.body + "\x00", self.headers)
+
+    def test_truncated(self):
+        self.assertRaises(InvalidPacketException, codec.decode_avro, self.body[:-3], self.headers)
+
+    def test_unknown_version(self):
+        self.assertRaises(InvalidPacketException, codec.decode_avro, self.body,
+                          {codec.HEADER_LOG_SCHEMA_VERSION: "999"})
+
+    def test_missing_version(self):
+        self.assertRaises(InvalidPacketException, codec.decode_avro, self.body, {})
+
+def zigzag(n):
+    """
+    Encode small longs, enough for the malformed inputs below.
+    """
+    return chr((n << 1) ^ (n >> 63))
+
+class AvroMalformedTest(unittest.TestCase):
+    def decode(self, schema, data):
+        return codec.compile_avro_reader(schema)(codec.AvroDecoder(data))
+
+    def test_negative_length(self):
+        # used to move the read position back and loop forever
+        schema = {"type": "array", "items": "string"}
+        self.assertRaises(InvalidPacketException, self.decode, schema, zigzag(1) + zigzag(-2))
+        self.assertRaises(InvalidPacketException, self.decode, "bytes", zigzag(-1))
+
+    def test_block_count_beyond_data(self):
+        schema = {"type": "array", "items": "null"}
+        self.assertRaises(InvalidPacketException, self.decode, schema, zigzag(60) + "\x00")
+        self.assertRaises(InvalidPacketException, self.decode, schema,
+                          zigzag(-60) + zigzag(0) + "\x00")
+        self.assertEqual(self.decode(schema, zigzag(1) + zigzag(0)), [None])
+
+    def test_union_index(self):
+        schema = ["null", "string"]
+        self.assertRaises(InvalidPacketException, self.decode, schema, zigzag(-1))
+        self.assertRaises(InvalidPacketException, self.decode, schema, zigzag(2))
+        self.assertEqual(self.decode(schema, zigzag(1) + zigzag(1) + "a"), {"string": u"a"})
+
+    def test_enum_index(self):
+        schema = {"type": "enum", "name": "Status", "symbols": ["ON", "OFF"]}
+        self.assertRaises(InvalidPacketException, self.decode, schema, zigzag(-1))
+        self.assertRaises(InvalidPacketException, self.decode, schema, zigzag(2))
+        self.assertEqual(self.decode(schema, zigzag(1)), "OFF")
+
+if __name__ == "__main__":
+    unittest.main()
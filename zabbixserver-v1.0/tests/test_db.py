@@ -0,0 +1,191 @@
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from threading import Event, Thread
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+config.LOG_FILE = os.devnull
+
+from utils import get_logger, set_log_level
+get_logger()
+set_log_level(logging.CRITICAL)
+
+import db
+from db import ConnectionPool, DeviceMirror, DeviceStore, DEVICE_STATUS_ONLINE
+from exception import DBException
+
+DEVICE_STATUS_OFFLINE = 0
+
+class DeviceMirrorTest(unittest.TestCase):
+    def setUp(self):
+        self.rows = []
+        self.real_db_query = db.db_query
+        def db_query(pool, query, params=None, prepared=False):
+            return [row for row in self.rows if row[-1] >= params[0]]
+        db.db_query = db_query
+        self.mirror = DeviceMirror(None, "update_time", 10, 3600, os.devnull)
+        self.mirror.index = {"k1": "A1"}
+        self.mirror.last_sync_value = 100
+
+    def tearDown(self):
+        db.db_query = self.real_db_query
+
+    def test_unchanged_poll(self):
+        # the row at the last sync value comes back on every poll
+        self.rows = [("k1", "A1", DEVICE_STATUS_ONLINE, 100)]
+        self.assertFalse(self.mirror.delta_sync())
+        self.assertEqual(self.mirror.index, {"k1": "A1"})
+
+    def test_changed_rows(self):
+        self.rows = [("k1", "A1", DEVICE_STATUS_OFFLINE, 101),
+                     ("k2", "A2", DEVICE_STATUS_ONLINE, 102)]
+        self.assertTrue(self.mirror.delta_sync())
+        self.assertEqual(self.mirror.index, {"k2": "A2"})
+        self.assertEqual(self.mirror.last_sync_value, 102)
+        self.assertFalse(self.mirror.delta_sync())
+
+    def test_new_sync_value(self):
+        self.rows = [("k1", "A1", DEVICE_STATUS_ONLINE, 101)]
+        self.assertTrue(self.mirror.delta_sync())
+        self.assertEqual(self.mirror.last_sync_value, 101)
+
+    def test_concurrent_snapshot_saves(self):
+        directory = tempfile.mkdtemp()
+        snapshot_file = os.path.join(directory, "snapshot")
+        workers = []
+        for worker_id in range(2):
+            mirror = DeviceMirror(None, "update_time", 10, 3600, snapshot_file)
+            mirror.index = dict(("k%d" % i, "worker-%d" % worker_id)
+                                for i in range(1000 * (worker_id + 1)))
+            workers.append(mirror)
+        real_getpid, real_dump = os.getpid, db.pickle.dump
+        pids = [1001]
+        def dump(obj, fd, protocol):
+            real_dump(obj, fd, protocol)
+            if pids[0] == 1001:
+                # the other worker saves before this one closes its file
+                pids[0] = 1002
+                workers[1].save_snapshot()
+        os.getpid = lambda: pids[0]
+        db.pickle.dump = dump
+        try:
+            workers[0].save_snapshot()
+        finally:
+            os.getpid, db.pickle.dump = real_getpid, real_dump
+        try:
+            loaded = DeviceMirror(None, "update_time", 10, 3600, snapshot_file)
+            self.assertTrue(loaded.load_snapshot())
+            self.assertTrue(loaded.index in [mirror.index for mirror in workers])
+            self.assertEqual(os.listdir(directory), ["snapshot"])
+        finally:
+            shutil.rmtree(directory)
+
+class DeviceStoreTest(unittest.TestCase):
+    def setUp(self):
+        # device hash key -> logical address
+        self.devices = {}
+        self.fail = False
+        self.real_db_query = db.db_query
+        def db_query(pool, query, params=None, prepared=False):
+            if self.fail:
+                raise DBException("no free DB connection in 5 seconds")
+            hashkeys = [hashkey for hashkey in set(params) if hashkey in self.devices]
+            if query == db.QUERY_LOGICAL_ADDRESS:
+                return [(self.devices[hashkey],) for hashkey in hashkeys]
+            return [(hashkey, self.devices[hashkey]) for hashkey in hashkeys]
+        db.db_query = db_query
+        self.store = DeviceStore()
+
+    def tearDown(self):
+        db.db_query = self.real_db_query
+
+    def test_failure_isnt_cached(self):
+        self.fail = True
+        self.assertRaises(DBException, self.store.get_logical_address_by_hashkey, "k1")
+        self.assertRaises(DBException, self.store.get_logical_addresses_by_hashkeys, ["k1", "k2"])
+        self.fail = False
+        self.devices = {"k1": "A1", "k2": "A2"}
+        self.assertEqual(self.store.get_logical_address_by_hashkey("k1"), "A1")
+        self.assertEqual(self.store.get_logical_addresses_by_hashkeys(["k2"]), {"k2": "A2"})
+
+    def test_unknown_device_is_cached(self):
+        self.assertEqual(self.store.get_logical_address_by_hashkey("k1"), None)
+        self.assertEqual(self.store.get_logical_addresses_by_hashkeys(["k2"]), {})
+        self.devices = {"k1": "A1", "k2": "A2"}
+        self.assertEqual(self.store.get_logical_address_by_hashkey("k1"), None)
+        self.assertEqual(self.store.get_logical_addresses_by_hashkeys(["k2"]), {})
+
+class ConnectionPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.real_connect = db.mysql.connector.connect
+        self.attempts = 0
+
+    def tearDown(self):
+        db.mysql.connector.connect = self.real_connect
+
+    def test_concurrent_failures_back_off_once(self):
+        pool = ConnectionPool(5, 5, 30, 1, 60)
+        entered = Event()
+        fail = Event()
+        def connect(**kwargs):
+            self.attempts += 1
+            if self.attempts == 5:
+                entered.set()
+            fail.wait(5)
+            raise Exception("MySQL is down")
+        db.mysql.connector.connect = connect
+        errors = []
+        def acquire():
+            try:
+                pool.acquire()
+            except DBException as e:
+                errors.append(e)
+        threads = [Thread(target=acquire) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        entered.wait(5)
+        fail.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(errors), 5)
+        stats = pool.stats()
+        self.assertEqual(stats["connect_failures"], 5)
+        self.assertEqual(stats["created"], 0)
+        self.assertEqual(pool.reconnect_delay, 2)
+        # no attempt until the backoff is over
+        self.assertRaises(DBException, pool.acquire)
+        self.assertEqual(self.attempts, 5)
+
+    def test_query_raises_on_query_failure(self):
+        class Cursor(object):
+            def execute(self, query, params=None):
+                raise db.mysql.connector.errors.OperationalError("MySQL server has gone away")
+            def close(self):
+                pass
+        class Connection(object):
+            def cursor(self):
+                return Cursor()
+        class Pool(object):
+            def acquire(self):
+                return Connection()
+            def release(self, conn, broken=False):
+                self.broken = broken
+        pool = Pool()
+        self.assertRaises(DBException, db.db_query, pool, "select 1")
+        self.assertTrue(pool.broken)
+
+    def test_query_raises_when_pool_is_exhausted(self):
+        pool = ConnectionPool(1, 0, 30, 1, 60)
+        pool.created = 1
+        # an overloaded pool isn't an empty result
+        self.assertRaises(DBException, db.db_query, pool, "select 1")
+        self.assertEqual(pool.stats()["timeouts"], 1)
+
+if __name__ == "__main__":
+    unittest.main()
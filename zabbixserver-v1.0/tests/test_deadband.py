@@ -0,0 +1,67 @@
+import logging
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+config.LOG_FILE = os.devnull
+
+from utils import get_logger, set_log_level
+get_logger()
+set_log_level(logging.CRITICAL)
+
+import deadband
+from deadband import DeadbandFilter
+
+class DeadbandFilterTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.real_time = deadband.time.time
+        deadband.time.time = lambda: self.now
+
+    def tearDown(self):
+        deadband.time.time = self.real_time
+
+    def test_any_change(self):
+        deadband_filter = DeadbandFilter(0, 0.0, 300)
+        values = [("a", "tds", 10), ("b", "tds", 10)]
+        self.assertEqual(deadband_filter.filter(values), values)
+        self.assertEqual(deadband_filter.filter(values), [])
+        self.assertEqual(deadband_filter.filter([("a", "tds", 11)]), [("a", "tds", 11)])
+        self.assertEqual(deadband_filter.stats(), {"size": 2, "forwarded": 3, "suppressed": 2})
+
+    def test_deadbands(self):
+        deadband_filter = DeadbandFilter(5, 0.0, 300, {"temp": (0, 0.1)})
+        deadband_filter.filter([("a", "tds", 100), ("a", "temp", 100)])
+        self.assertEqual(deadband_filter.filter([("a", "tds", 105), ("a", "temp", 110)]), [])
+        self.assertEqual(deadband_filter.filter([("a", "tds", 106), ("a", "temp", 111)]),
+                         [("a", "tds", 106), ("a", "temp", 111)])
+        # not numbers: any change
+        deadband_filter.filter([("a", "tds", "ok")])
+        self.assertEqual(deadband_filter.filter([("a", "tds", "error")]), [("a", "tds", "error")])
+
+    def test_heartbeat(self):
+        deadband_filter = DeadbandFilter(0, 0.0, 300)
+        deadband_filter.filter([("a", "tds", 10)])
+        self.now += 299
+        self.assertEqual(deadband_filter.filter([("a", "tds", 10)]), [])
+        self.now += 1
+        self.assertEqual(deadband_filter.filter([("a", "tds", 10)]), [("a", "tds", 10)])
+
+    def test_purge(self):
+        deadband_filter = DeadbandFilter(0, 0.0, 300)
+        deadband_filter.filter([("a", "tds", 10)])
+        self.now += 300
+        deadband_filter.filter([("b", "tds", 10)])
+        self.assertEqual(deadband_filter.stats()["size"], 1)
+
+    def test_forget(self):
+        deadband_filter = DeadbandFilter(0, 0.0, 300)
+        values = deadband_filter.filter([("a", "tds", 10)])
+        deadband_filter.forget(values)
+        self.assertEqual(deadband_filter.filter([("a", "tds", 10)]), [("a", "tds", 10)])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+import json
+import logging
+import os
+import sys
+import unittest
+
+import tornado.testing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+config.LOG_FILE = os.devnull
+
+from utils import get_logger, set_log_level
+get_logger()
+set_log_level(logging.CRITICAL)
+logging.getLogger("tornado.access").setLevel(logging.CRITICAL)
+
+import api
+from aggregate import Aggregator
+from deadband import DeadbandFilter
+from exception import DBException
+
+class FakeSenderBuffer(object):
+    def __init__(self):
+        self.accept = True
+        self.values = []
+        self.spool = None
+
+    def is_overloaded(self):
+        return not self.accept
+
+    def add(self, values):
+        if not self.accept:
+            return False
+        self.values.extend(values)
+        return True
+
+class QueueValuesTest(unittest.TestCase):
+    def setUp(self):
+        self.sender_buffer = FakeSenderBuffer()
+        self.aggregator = Aggregator({"tds": 60}, self.sender_buffer)
+        self.deadband_filter = DeadbandFilter(0, 0.0, 300)
+        self.real = (api.get_sender_buffer, api.get_aggregator, api.get_deadband_filter)
+        api.get_sender_buffer = lambda: self.sender_buffer
+        api.get_aggregator = lambda: self.aggregator
+        api.get_deadband_filter = lambda: self.deadband_filter
+
+    def tearDown(self):
+        api.get_sender_buffer, api.get_aggregator, api.get_deadband_filter = self.real
+
+    def queue_values(self, values):
+        # queue_values() doesn't use the handler's state
+        return api.BaseHandler.queue_values.im_func(None, values)
+
+    def test_refused_upload_leaves_no_state(self):
+        values = [("host", "tds", 10, 1005), ("host", "temp", 20, 1005)]
+        self.sender_buffer.accept = False
+        self.assertFalse(self.queue_values(values))
+        self.assertEqual(self.aggregator.states, {})
+        self.sender_buffer.accept = True
+        self.assertTrue(self.queue_values(values))
+        self.assertTrue(self.queue_values([("host", "tds", 20, 1010)]))
+        state = self.aggregator.states[(1020, "host", "tds")]
+        # min, max, sum, count, last
+        self.assertEqual(state, [10, 20, 30, 2, 20])
+        self.assertEqual(self.sender_buffer.values, [("host", "temp", 20, 1005)])
+
+    def test_split(self):
+        aggregated, rest = self.aggregator.split([("h", "tds", 1), ("h", "tds", "text"), ("h", "x", 2)])
+        self.assertEqual(aggregated, [("h", "tds", 1)])
+        self.assertEqual(rest, [("h", "tds", "text"), ("h", "x", 2)])
+
+class FailingDeviceStore(object):
+    def get_logical_address_by_hashkey(self, hashkey):
+        raise DBException("no free DB connection in 5 seconds")
+
+    def get_logical_addresses_by_hashkeys(self, hashkeys):
+        raise DBException("no free DB connection in 5 seconds")
+
+RECORD = {"header": {"endpointKeyHash": {"string": "key"},
+                     "logSchemaVersion": {"int": 10},
+                     "timestamp": {"long": 1476940343424}},
+          "event": {"outletTDS": 8}}
+
+class DeviceLookupFailureTest(tornado.testing.AsyncHTTPTestCase):
+    def get_app(self):
+        return api.app
+
+    def setUp(self):
+        tornado.testing.AsyncHTTPTestCase.setUp(self)
+        self.real = (api.get_sender_buffer, api.get_device_store)
+        api.get_sender_buffer = lambda: FakeSenderBuffer()
+        api.get_device_store = lambda: FailingDeviceStore()
+
+    def tearDown(self):
+        api.get_sender_buffer, api.get_device_store = self.real
+        tornado.testing.AsyncHTTPTestCase.tearDown(self)
+
+    def check_refused(self, response):
+        # a DB failure isn't an unknown device, the client retries
+        self.assertEqual(response.code, 503)
+        self.assertEqual(response.headers["Retry-After"], str(config.INGEST_RETRY_AFTER))
+
+    def test_single(self):
+        response = self.fetch("%s/data" % api.BASE_URL, method="POST", body=json.dumps(RECORD),
+                              headers={"Content-Type": "application/json"})
+        self.check_refused(response)
+
+    def test_batch(self):
+        response = self.fetch("%s/data/batch" % api.BASE_URL, method="POST",
+                              body=json.dumps([RECORD, RECORD]),
+                              headers={"Content-Type": "application/json"})
+        self.check_refused(response)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,157 @@
+import json
+import logging
+import os
+import struct
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+config.LOG_FILE = os.devnull
+
+from utils import get_logger, set_log_level
+get_logger()
+set_log_level(logging.CRITICAL)
+
+from sender import ZBX_HEADER, ZBX_HEADER_LENGTH, SenderBuffer, \
+    pack_sender_data, split_clock, unpack_sender_response
+from exception import ZabbixSenderException
+
+def response_packet(body):
+    if not isinstance(body, str):
+        body = json.dumps(body)
+    return ZBX_HEADER + struct.pack("<Q", len(body)) + body
+
+def unpack_request(packet):
+    body_length = struct.unpack("<Q", packet[len(ZBX_HEADER):ZBX_HEADER_LENGTH])[0]
+    body = packet[ZBX_HEADER_LENGTH:]
+    return body_length, json.loads(body)
+
+class SenderProtocolTest(unittest.TestCase):
+    def test_pack(self):
+        packet = pack_sender_data([("host", "tds", 12), ("host", "status", "ok")])
+        self.assertTrue(packet.startswith(ZBX_HEADER))
+        body_length, request = unpack_request(packet)
+        self.assertEqual(body_length, len(packet) - ZBX_HEADER_LENGTH)
+        self.assertEqual(request["request"], "sender data")
+        self.assertEqual(request["data"], [
+            {"host": "host", "key": "tds", "value": "12"},
+            {"host": "host", "key": "status", "value": "ok"}])
+        # zabbix stamps the values with its receive time
+        self.assertFalse("clock" in request)
+
+    def test_pack_clock(self):
+        packet = pack_sender_data([("host", "tds", 12, 1500000000.25),
+                                   ("host", "temp", 30, None)])
+        body_length, request = unpack_request(packet)
+        self.assertEqual(request["data"][0]["clock"], 1500000000)
+        self.assertEqual(request["data"][0]["ns"], 250000000)
+        self.assertFalse("clock" in request["data"][1])
+        self.assertTrue("clock" in request and "ns" in request)
+
+    def test_split_clock(self):
+        self.assertEqual(split_clock(1500000000), (1500000000, 0))
+        self.assertEqual(split_clock(1500000000.000001), (1500000000, 1000))
+
+    def test_unpack(self):
+        packet = response_packet({"response": "success",
+                                  "info": "processed: 2; failed: 1; total: 3; seconds spent: 0.000055"})
+        self.assertEqual(unpack_sender_response(packet), (2, 1, 3))
+
+    def test_unpack_ignores_trailing_bytes(self):
+        packet = response_packet({"response": "success",
+                                  "info": "processed: 1; failed: 0; total: 1"})
+        self.assertEqual(unpack_sender_response(packet + "garbage"), (1, 0, 1))
+
+    def test_unpack_invalid(self):
+        packets = [
+            "ZBXD\x02" + response_packet("{}")[len(ZBX_HEADER):],
+            ZBX_HEADER + "\x00\x00",
+            response_packet("not json"),
+            response_packet({"response": "failed", "info": "processed: 0; failed: 1; total: 1"}),
+            response_packet({"response": "success", "info": "nothing"}),
+            response_packet({"response": "success"}),
+        ]
+        for packet in packets:
+            self.assertRaises(ZabbixSenderException, unpack_sender_response, packet)
+
+class FakeSender(object):
+    def __init__(self):
+        self.batches = []
+        self.fail = False
+
+    def send(self, values):
+        if self.fail:
+            raise ZabbixSenderException("unreachable")
+        self.batches.append(values)
+        return (len(values), 0, len(values))
+
+class FakeSpool(object):
+    def __init__(self):
+        self.batches = []
+
+    def append(self, values):
+        self.batches.append(values)
+
+def make_values(count, host="host"):
+    return [(host, "tds", i) for i in range(count)]
+
+class SenderBufferTest(unittest.TestCase):
+    def new_buffer(self, **kwargs):
+        self.sender = FakeSender()
+        self.spool = FakeSpool()
+        return SenderBuffer(self.sender, 10, 10000, 1, spool=self.spool, **kwargs)
+
+    def test_capacity(self):
+        sender_buffer = self.new_buffer(capacity=25)
+        self.assertTrue(sender_buffer.add(make_values(20)))
+        # nothing of a request that doesn't fit is added
+        self.assertFalse(sender_buffer.add(make_values(6)))
+        self.assertEqual(sender_buffer.size(), 20)
+        self.assertTrue(sender_buffer.add(make_values(5)))
+        self.assertTrue(sender_buffer.add([]))
+
+    def test_watermarks(self):
+        sender_buffer = self.new_buffer(capacity=100, high_watermark=30, low_watermark=10)
+        self.assertTrue(sender_buffer.add(make_values(29)))
+        self.assertFalse(sender_buffer.is_overloaded())
+        self.assertTrue(sender_buffer.add(make_values(5)))
+        self.assertTrue(sender_buffer.is_overloaded())
+        self.assertFalse(sender_buffer.add(make_values(1)))
+        sender_buffer.running = True
+        # 24 values left, above the low watermark
+        self.assertEqual(len(sender_buffer._take()), 10)
+        self.assertTrue(sender_buffer.is_overloaded())
+        self.assertEqual(len(sender_buffer._take()), 10)
+        self.assertEqual(len(sender_buffer._take()), 10)
+        self.assertFalse(sender_buffer.is_overloaded())
+        self.assertTrue(sender_buffer.add(make_values(1)))
+
+    def test_flush_and_spool(self):
+        sender_buffer = self.new_buffer()
+        sender_buffer.start()
+        sender_buffer.add(make_values(10, "a"))
+        sender_buffer.stop()
+        self.assertEqual(self.sender.batches, [make_values(10, "a")])
+        self.sender.fail = True
+        sender_buffer.start()
+        sender_buffer.add(make_values(3, "b"))
+        # stop() flushes the values still buffered
+        sender_buffer.stop()
+        self.assertEqual(self.spool.batches, [make_values(3, "b")])
+
+    def test_stopped_refuses(self):
+        sender_buffer = self.new_buffer()
+        sender_buffer.start()
+        sender_buffer.stop()
+        # no flusher would send them
+        self.assertFalse(sender_buffer.add(make_values(1)))
+        self.assertEqual(sender_buffer.size(), 0)
+        sender_buffer.start()
+        self.assertTrue(sender_buffer.add(make_values(10)))
+        sender_buffer.stop()
+        self.assertEqual(self.sender.batches, [make_values(10)])
+
+if __name__ == "__main__":
+    unittest.main()
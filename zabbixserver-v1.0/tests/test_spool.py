@@ -0,0 +1,181 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+config.LOG_FILE = os.devnull
+
+import logging
+from utils import get_logger, set_log_level
+get_logger()
+set_log_level(logging.CRITICAL)
+
+import spool
+from spool import Spool, SpoolReplayer
+from exception import ZabbixSenderException, ZabbixSenderConnectionException
+
+class SpoolTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def new_spool(self, segment_size=1 << 20, max_size=1 << 30):
+        return Spool(os.path.join(self.directory, "spool"), segment_size, max_size)
+
+    def test_read_commit(self):
+        s = self.new_spool()
+        s.append([{"host": "a", "key": "k", "value": "1"}])
+        s.append([{"host": "b", "key": "k", "value": "2"}])
+        seq, records = s.read(10)
+        self.assertEqual([values[0]["host"] for end_offset, values in records], ["a", "b"])
+        self.assertEqual(s.records, 2)
+        s.commit(seq, records[0][0])
+        self.assertEqual(s.records, 1)
+        seq, records = s.read(10)
+        self.assertEqual([values[0]["host"] for end_offset, values in records], ["b"])
+        s.commit(seq, records[-1][0])
+        self.assertEqual(s.records, 0)
+        self.assertEqual(s.read(10)[1], [])
+        s.close()
+
+    def test_cursor_survives_restart(self):
+        s = self.new_spool()
+        for i in range(3):
+            s.append([i])
+        seq, records = s.read(1)
+        s.commit(seq, records[0][0])
+        s.close()
+        s = self.new_spool()
+        self.assertEqual(s.records, 2)
+        seq, records = s.read(10)
+        self.assertEqual([values for end_offset, values in records], [[1], [2]])
+        s.close()
+
+    def test_full_spool_drops_oldest(self):
+        # one 15 bytes record per segment, 4 of them fit
+        s = self.new_spool(segment_size=1, max_size=60)
+        for i in range(10):
+            s.append([i])
+        self.assertEqual(len(s.segments), 4)
+        self.assertEqual(s.records, 4)
+        seq, records = s.read(10)
+        self.assertEqual([values for end_offset, values in records], [[6]])
+        self.assertEqual(s.dropped, 6)
+        s.close()
+
+    def test_drop(self):
+        s = self.new_spool()
+        s.append(["poison"])
+        s.append(["value"])
+        seq, records = s.read(10)
+        s.drop(seq, records[0][0])
+        self.assertEqual(s.stats()["dropped"], 1)
+        self.assertEqual(s.records, 1)
+        seq, records = s.read(10)
+        self.assertEqual([values for end_offset, values in records], [["value"]])
+        s.close()
+
+    def test_segment_dropped_before_read(self):
+        s = self.new_spool(segment_size=1)
+        for i in range(3):
+            s.append([i])
+        s.max_size = 0
+        real_open = open
+        def racing_open(path, *args):
+            # append() drops the segment between read()'s lock and open()
+            del spool.open
+            s.append(["new"])
+            return real_open(path, *args)
+        spool.open = racing_open
+        try:
+            seq, records = s.read(10)
+        finally:
+            if hasattr(spool, "open"):
+                del spool.open
+        self.assertEqual([values for end_offset, values in records], [["new"]])
+        s.close()
+
+class FakeSender(object):
+    def __init__(self, errors=None):
+        self.sent = []
+        # values -> exception raised sending them
+        self.errors = errors or {}
+
+    def send(self, values):
+        self.sent.append(values)
+        if values[0] in self.errors:
+            raise self.errors[values[0]]
+
+class FailingSpool(object):
+    def __init__(self):
+        self.reads = 0
+
+    def read(self, max_records):
+        self.reads += 1
+        if self.reads == 1:
+            raise IOError("segment gone")
+        if self.reads == 2:
+            return (1, [(10, ["value"])])
+        return (1, [])
+
+    def commit(self, seq, end_offset):
+        pass
+
+class SpoolReplayerTest(unittest.TestCase):
+    def test_read_failure_keeps_replaying(self):
+        sender = FakeSender()
+        replayer = SpoolReplayer(FailingSpool(), sender, 1000, 0.01, 3)
+        replayer.start()
+        deadline = time.time() + 5
+        while not sender.sent and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(replayer.is_alive())
+        replayer.stop()
+        self.assertEqual(sender.sent, [["value"]])
+
+    def replay(self, s, sender, done):
+        replayer = SpoolReplayer(s, sender, 1000, 0.01, 3)
+        replayer.start()
+        deadline = time.time() + 5
+        while not done() and time.time() < deadline:
+            time.sleep(0.01)
+        replayer.stop()
+
+    def test_refused_record_is_dropped(self):
+        directory = tempfile.mkdtemp()
+        try:
+            s = Spool(os.path.join(directory, "spool"), 1 << 20, 1 << 30)
+            s.append(["poison"])
+            s.append(["value"])
+            sender = FakeSender({"poison": ZabbixSenderException("trapper refused data")})
+            self.replay(s, sender, lambda: ["value"] in sender.sent)
+            self.assertEqual(sender.sent, [["poison"]] * 3 + [["value"]])
+            self.assertEqual(s.dropped, 1)
+            self.assertEqual(s.records, 0)
+            s.close()
+        finally:
+            shutil.rmtree(directory)
+
+    def test_unreachable_trapper_keeps_record(self):
+        directory = tempfile.mkdtemp()
+        try:
+            s = Spool(os.path.join(directory, "spool"), 1 << 20, 1 << 30)
+            s.append(["value"])
+            sender = FakeSender({"value": ZabbixSenderConnectionException("refused")})
+            self.replay(s, sender, lambda: len(sender.sent) > 5)
+            self.assertTrue(len(sender.sent) > 5)
+            self.assertEqual(s.dropped, 0)
+            self.assertEqual(s.records, 1)
+            s.close()
+        finally:
+            shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    unittest.main()
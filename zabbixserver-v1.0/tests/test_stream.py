@@ -0,0 +1,95 @@
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+config.LOG_FILE = os.devnull
+
+from exception import InvalidPacketException
+from stream import JsonArrayStreamParser, NdjsonStreamParser
+
+def parse(parser, body, chunk_size):
+    records = []
+    for start in range(0, len(body), chunk_size):
+        records.extend(parser.feed(body[start:start + chunk_size]))
+    records.extend(parser.close())
+    return records
+
+class NdjsonStreamParserTest(unittest.TestCase):
+    def test_records(self):
+        body = '{"a": 1}\n\n{"b": 2}\n{"c": 3}'
+        for chunk_size in (1, 3, len(body)):
+            records = parse(NdjsonStreamParser(), body, chunk_size)
+            self.assertEqual(records, [({"a": 1}, None), ({"b": 2}, None), ({"c": 3}, None)])
+
+    def test_invalid_line(self):
+        records = parse(NdjsonStreamParser(), '{"a": 1}\n{"b":}\n{"c": 3}\n', 4)
+        self.assertEqual([record for record, error in records], [{"a": 1}, None, {"c": 3}])
+        self.assertTrue(isinstance(records[1][1], InvalidPacketException))
+
+    def test_line_too_long(self):
+        parser = NdjsonStreamParser(max_record_size=16)
+        self.assertRaises(InvalidPacketException, parser.feed, '{"a": "%s"' % ("x" * 32))
+
+class JsonArrayStreamParserTest(unittest.TestCase):
+    ELEMENTS = [{"a": 1, "b": [1, {"c": "]}"}]},
+                {"s": "quote \" and backslash \\ and \\\""},
+                [],
+                "string",
+                123.5,
+                True,
+                None,
+                {}]
+
+    def test_elements(self):
+        body = json.dumps(JsonArrayStreamParserTest.ELEMENTS, indent=1)
+        for chunk_size in range(1, 12) + [len(body)]:
+            records = parse(JsonArrayStreamParser(), body, chunk_size)
+            self.assertEqual(records, [(element, None) for element in JsonArrayStreamParserTest.ELEMENTS])
+
+    def test_empty_array(self):
+        self.assertEqual(parse(JsonArrayStreamParser(), " [ ] ", 1), [])
+
+    def test_number_split_across_chunks(self):
+        self.assertEqual(parse(JsonArrayStreamParser(), "[12345]", 2), [(12345, None)])
+
+    def test_invalid_element(self):
+        body = '[{"a":}, {"b":1}, {"c": tru}, 12x, {"d": 2}]'
+        for chunk_size in (1, 5, len(body)):
+            records = parse(JsonArrayStreamParser(), body, chunk_size)
+            self.assertEqual([record for record, error in records],
+                             [None, {"b": 1}, None, None, {"d": 2}])
+            for index in (0, 2, 3):
+                self.assertTrue(isinstance(records[index][1], InvalidPacketException))
+
+    def test_not_an_array(self):
+        self.assertRaises(InvalidPacketException, JsonArrayStreamParser().feed, '{"a": 1}')
+
+    def test_bad_separator(self):
+        self.assertRaises(InvalidPacketException, JsonArrayStreamParser().feed, '[{"a": 1} {"b": 2}]')
+
+    def test_data_after_array(self):
+        self.assertRaises(InvalidPacketException, JsonArrayStreamParser().feed, '[1] [2]')
+
+    def test_truncated(self):
+        parser = JsonArrayStreamParser()
+        self.assertEqual(parser.feed('[{"a": 1}, {"b": '), [({"a": 1}, None)])
+        self.assertRaises(InvalidPacketException, parser.close)
+
+    def test_element_too_large(self):
+        parser = JsonArrayStreamParser(max_record_size=16)
+        parser.feed('[{"a": "')
+        self.assertRaises(InvalidPacketException, parser.feed, "x" * 32)
+
+    def test_large_element_scanned_once(self):
+        parser = JsonArrayStreamParser()
+        element = {"values": ["v%d" % i for i in range(20000)]}
+        body = json.dumps([element])
+        records = parse(parser, body, 64)
+        self.assertEqual(records, [(element, None)])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,6 +5,7 @@ import sys
 import time
 import pickle
 
+from collections import OrderedDict
 from threading import Lock
 
 
@@ -179,6 +180,95 @@ class LockedList:
         self.lock.release()
         return ret
 
+# the same as LRUCache in python/zabbix/common/utils.py, the two
+# packages are deployed separately: change both copies together
+class LRUCache:
+    """
+    Bounded map evicting the least recently used element, whose elements
+    expire 'ttl' seconds after they were added.
+    """
+    def __init__(self, capacity, ttl):
+        self.lock = Lock()
+        self.capacity = capacity
+        self.ttl = ttl
+        # key -> (value, expire time), least recently used first
+        self.data_map = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def add(self, key, value, ttl=None):
+        """
+        Add or replace the element related with 'key', it expires after
+        'ttl' seconds, the cache ttl by default.
+        """
+        if ttl is None:
+            ttl = self.ttl
+        self.lock.acquire()
+        self.data_map.pop(key, None)
+        self.data_map[key] = (value, time.time() + ttl)
+        while len(self.data_map) > self.capacity:
+            self.data_map.popitem(last=False)
+            self.evictions += 1
+        self.lock.release()
+
+    def find(self, key):
+        """
+        Find out the element related with the 'key'
+
+        Output:
+        * (found, value): found is False if there is no such element or it
+          has expired, a cached None is a hit with value None
+        """
+        ret = (False, None)
+        self.lock.acquire()
+        element = self.data_map.pop(key, None)
+        if element is None:
+            self.misses += 1
+        elif element[1] < time.time():
+            self.misses += 1
+            self.expirations += 1
+        else:
+            self.data_map[key] = element
+            self.hits += 1
+            ret = (True, element[0])
+        self.lock.release()
+        return ret
+
+    def peek(self, key):
+        """
+        Like find(), without counting a hit or miss nor refreshing the
+        element.
+        """
+        ret = (False, None)
+        self.lock.acquire()
+        element = self.data_map.get(key)
+        if element is not None and element[1] >= time.time():
+            ret = (True, element[0])
+        self.lock.release()
+        return ret
+
+    def delete(self, key):
+        """
+        Delete the element related with 'key'.
+        """
+        self.lock.acquire()
+        self.data_map.pop(key, None)
+        self.lock.release()
+
+    def clear(self):
+        self.lock.acquire()
+        self.data_map.clear()
+        self.lock.release()
+
+    def stats(self):
+        return {"size": len(self.data_map),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations}
+
 # make a the process a daemon. If any error happen, it will raise an exception.
 def daemonize(root_dir="/", \
               pidfile="", \
@@ -1,16 +1,19 @@
 import config
+import errno
 import fcntl
 import signal
 import os
 import sys
 import time
+import tornado.netutil
 from optparse import OptionParser
 from api import APIService
+from profiler import get_profiler
 from utils import logger, daemonize
 
 class Server:
-    def __init__(self):
-        self.api_server = APIService(config.WEB_SERVICE_HOST, config.WEB_SERVICE_PORT)
+    def __init__(self, sockets=None):
+        self.api_server = APIService(config.WEB_SERVICE_HOST, config.WEB_SERVICE_PORT, sockets)
         self.running = False
 
     # register the signal handler
@@ -25,8 +28,19 @@ class Server:
             logger.debug("Server terminate signal is received")
             self.stop()
 
+        def profile_signal_handler(signum, frame):
+            '''
+            Profile the server for the default duration, the requests keep
+            being served meanwhile
+            '''
+            try:
+                get_profiler().start()
+            except Exception as e:
+                logger.error("Start profile failure: %s" % e)
+
         signal.signal(signal.SIGINT, agent_signal_handler)
         signal.signal(signal.SIGTERM, agent_signal_handler)
+        signal.signal(signal.SIGUSR2, profile_signal_handler)
         signal.signal(signal.SIGPIPE, signal.SIG_IGN)
 
     def start(self):
@@ -58,12 +72,113 @@ class Server:
         while self.running:
             time.sleep(1)
 
+class Supervisor:
+    """
+    Run the server in 'workers' child processes sharing one listening
+    socket, and restart the workers that die.
+    """
+    def __init__(self, workers):
+        self.workers = workers
+        self.sockets = None
+        # pid -> worker id
+        self.children = {}
+        self.running = False
+
+    def register_signal_handler(self):
+        def supervisor_signal_handler(signum, frame):
+            logger.debug("Supervisor terminate signal is received")
+            self.stop()
+
+        def profile_signal_handler(signum, frame):
+            # each worker profiles itself
+            for pid in self.children.keys():
+                try:
+                    os.kill(pid, signal.SIGUSR2)
+                except OSError, e:
+                    logger.error("Profile worker (pid %d) failed: %s" % (pid, e.strerror))
+
+        signal.signal(signal.SIGINT, supervisor_signal_handler)
+        signal.signal(signal.SIGTERM, supervisor_signal_handler)
+        signal.signal(signal.SIGUSR2, profile_signal_handler)
+        signal.signal(signal.SIGPIPE, signal.SIG_IGN)
+
+    def start(self):
+        logger.info("Starting %d workers" % self.workers)
+        host = config.WEB_SERVICE_HOST
+        if host == "":
+            host = None
+        self.sockets = tornado.netutil.bind_sockets(config.WEB_SERVICE_PORT, host)
+        self.register_signal_handler()
+        self.running = True
+        for worker_id in range(self.workers):
+            self.spawn(worker_id)
+
+    def spawn(self, worker_id):
+        pid = os.fork()
+        if pid > 0:
+            self.children[pid] = worker_id
+            logger.info("Worker %d started, pid %d" % (worker_id, pid))
+            return
+        # child: never return into the supervisor loop
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        self.children = {}
+        try:
+            run_worker(worker_id, self.sockets)
+        finally:
+            os._exit(0)
+
+    def stop(self):
+        logger.info("Stopping workers")
+        self.running = False
+        for pid in self.children.keys():
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError, e:
+                logger.error("Stop worker (pid %d) failed: %s" % (pid, e.strerror))
+
+    def loop(self):
+        # supervisor loop, restart the workers that die
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except OSError, e:
+                if e.errno == errno.EINTR:
+                    continue
+                break
+            worker_id = self.children.pop(pid, None)
+            if worker_id is None:
+                continue
+            if not self.running:
+                logger.info("Worker %d (pid %d) stopped" % (worker_id, pid))
+                continue
+            logger.error("Worker %d (pid %d) died with status %d, restarting" % \
+                         (worker_id, pid, status))
+            time.sleep(config.WORKER_RESTART_DELAY)
+            if self.running:
+                self.spawn(worker_id)
+        logger.info("All workers stopped")
+
+def run_worker(worker_id, sockets):
+    # each worker spools to its own directory
+    config.SPOOL_DIR = os.path.join(config.SPOOL_DIR, "worker-%d" % worker_id)
+    try:
+        server = Server(sockets)
+        server.start()
+    except Exception:
+        logger.error("Start worker %d failure" % worker_id)
+        os._exit(2)
+    server.loop()
+
 def parse_command_line():
     usage = "usage: %prog [options]"
     parser = OptionParser(usage=usage)
     parser.add_option("-d", "--daemon", action="store_true", dest="daemonize",
                       default=False,
                       help="Run the server as daemon.")
+    parser.add_option("-w", "--workers", type="int", dest="workers",
+                      default=config.WEB_SERVICE_WORKERS,
+                      help="Number of worker processes sharing the listening socket.")
 
     (options, args) = parser.parse_args()
     return (options, args)
@@ -85,6 +200,16 @@ def main():
     else:
         logger.info("Run the server in interactive mode")
 
+    if options.workers > 1:
+        try:
+            supervisor = Supervisor(options.workers)
+            supervisor.start()
+        except Exception:
+            logger.error("Start server failure")
+            os._exit(2)
+        supervisor.loop()
+        return 0
+
     try:
         server = Server()
         server.start()